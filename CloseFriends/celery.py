@@ -2,7 +2,9 @@
 
 from __future__ import absolute_import, unicode_literals
 import os
+import time
 from celery import Celery
+from celery.signals import task_prerun, task_postrun, worker_process_init, worker_ready
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CloseFriends.settings')
@@ -13,4 +15,67 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
 
+# Task durations for the metrics, labelled with the tenant and account from the task kwargs
+_task_started = {}
+# Log context of the running tasks, so their records are tagged with tenant, account and job id
+_task_log_context = {}
+# Profilers of the running tasks selected by PROFILE_TASKS / PROFILE_SAMPLE_RATE
+_task_profilers = {}
 
+
+@task_prerun.connect
+def _task_prerun(task_id=None, task=None, kwargs=None, **extra):
+    from bot.log import set_log_context
+    from bot.profiling import start_profile
+
+    kwargs = kwargs or {}
+    _task_started[task_id] = time.monotonic()
+    _task_log_context[task_id] = set_log_context(kwargs.get('user'), kwargs.get('username'), task_id)
+
+    profiler = start_profile(task.name)
+    if profiler is not None:
+        _task_profilers[task_id] = profiler
+
+
+@task_postrun.connect
+def _task_postrun(task_id=None, task=None, kwargs=None, state=None, **extra):
+    from bot import metrics
+    from bot.log import reset_log_context
+    from bot.profiling import finish_profile
+
+    profiler = _task_profilers.pop(task_id, None)
+    if profiler is not None:
+        finish_profile(profiler, task_id, (kwargs or {}).get('user'), (kwargs or {}).get('username'), state)
+
+    tokens = _task_log_context.pop(task_id, None)
+    if tokens is not None:
+        reset_log_context(tokens)
+
+    started = _task_started.pop(task_id, None)
+    if started is None:
+        return
+
+    kwargs = kwargs or {}
+    metrics.TASK_SECONDS.observe(
+        time.monotonic() - started,
+        task=task.name, tenant=kwargs.get('user', ''), account=kwargs.get('username', ''), state=state or '',
+    )
+
+
+# Prefork children get their own server, the prefork parent runs no tasks and serves none
+@worker_process_init.connect
+def _serve_metrics(**kwargs):
+    from bot.metrics import serve_worker_metrics
+
+    serve_worker_metrics()
+
+
+# Threads, gevent and solo pools run the tasks in the main process
+@worker_ready.connect
+def _serve_pool_metrics(sender=None, **kwargs):
+    from celery.concurrency.prefork import TaskPool
+    from bot.metrics import serve_worker_metrics
+
+    controller = getattr(sender, 'controller', None)
+    if controller is not None and not issubclass(controller.pool_cls, TaskPool):
+        serve_worker_metrics()
@@ -163,6 +163,38 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'  
 
 CELERY_TASK_TRACK_STARTED = True
+
+# Scrapes and close friends runs get their own queues (and workers), so one kind of work
+# never waits behind the other: celery -A CloseFriends worker -Q scrape / -Q close_friends
+CELERY_TASK_ROUTES = {
+    'get_account_followers': {'queue': 'scrape'},
+    'add_followers_to_close_freinds': {'queue': 'close_friends'},
+    'close_friends_step': {'queue': 'close_friends'},
+    'add_close_friends_batch': {'queue': 'close_friends'},
+    # Short, and only useful when a worker picks it up, so it rides along with the scrapes
+    'dispatch_jobs': {'queue': 'scrape'},
+}
+
+# Safety net for the fair-share dispatcher, which otherwise runs whenever a job is requested or ends
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-jobs': {
+        'task': 'dispatch_jobs',
+        'schedule': 60,
+        # Ticks that waited behind busy scrape workers for a minute are superseded by the next one
+        'options': {'expires': 60},
+    },
+}
+
+# The 'jobs' cache is shared by the web and worker processes (live job progress)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('JOBS_CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache/jobs')),
+    },
+}
 # CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 
 LOGGING = {
@@ -14,3 +14,125 @@ class PasswordResetCodeAdmin(admin.ModelAdmin):
     list_filter = ['created_when']
 
 admin.site.register(PasswordResetCode, PasswordResetCodeAdmin)
+
+class InstagramAccountAdmin(admin.ModelAdmin):
+    list_display = ['username', 'owner', 'followers_count', 'getting_followers', 'adding_to_close_friends', 'updated_when']
+    search_fields = ['username', 'owner__username']
+    list_filter = ['getting_followers', 'adding_to_close_friends']
+
+admin.site.register(InstagramAccount, InstagramAccountAdmin)
+
+class JobLeaseAdmin(admin.ModelAdmin):
+    list_display = ['username', 'user', 'kind', 'task_id', 'holder', 'enqueued_when', 'dispatched_when', 'heartbeat_when', 'expires_when']
+    search_fields = ['username', 'user', 'task_id']
+    list_filter = ['kind']
+
+admin.site.register(JobLease, JobLeaseAdmin)
+
+class TaskProfileAdmin(admin.ModelAdmin):
+    list_display = ['task_name', 'username', 'user', 'state', 'wall_seconds', 'cpu_seconds', 'peak_memory', 'created_when', 'download']
+    search_fields = ['task_id', 'username', 'user']
+    list_filter = ['task_name', 'state', 'created_when']
+    exclude = ['stats', 'summary']
+    readonly_fields = ['task_id', 'task_name', 'user', 'username', 'state', 'wall_seconds', 'cpu_seconds', 'peak_memory', 'top_functions', 'top_allocations', 'created_when', 'download']
+
+    def get_urls(self):
+        from django.urls import path
+
+        urls = [
+            path('<int:profile_id>/download/', self.admin_site.admin_view(self.download_view), name='Core_taskprofile_download'),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, profile_id):
+        from django.http import HttpResponse
+        from django.shortcuts import get_object_or_404
+
+        profile = get_object_or_404(TaskProfile, pk=profile_id)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile.task_name}-{profile.task_id}.prof"'
+        return response
+
+    @admin.display(description='Profile')
+    def download(self, profile):
+        from django.urls import reverse
+        from django.utils.html import format_html
+
+        return format_html('<a href="{}">.prof</a>', reverse('admin:Core_taskprofile_download', args=[profile.pk]))
+
+    @admin.display(description='Top functions')
+    def top_functions(self, profile):
+        from django.utils.html import format_html
+
+        lines = [
+            f"{function['cumulative']:10.3f}s {function['total']:10.3f}s {function['calls']:>9}  {function['function']}"
+            for function in profile.summary.get('top_functions', [])
+        ]
+        return format_html('<pre>{}</pre>', '\n'.join(['cumulative      total     calls  function'] + lines))
+
+    @admin.display(description='Top allocations')
+    def top_allocations(self, profile):
+        from django.utils.html import format_html
+
+        lines = [
+            f"{allocation['size'] / 1024:10.1f} KiB {allocation['count']:>9}  {allocation['site']}"
+            for allocation in profile.summary.get('top_allocations', [])
+        ]
+        return format_html('<pre>{}</pre>', '\n'.join(lines))
+
+    def has_add_permission(self, request):
+        return False
+
+admin.site.register(TaskProfile, TaskProfileAdmin)
+
+class JobRunSegmentInline(admin.TabularInline):
+    model = JobRunSegment
+    fields = ['task_id', 'proxy', 'started_when', 'ended_when', 'duration_seconds', 'items', 'added', 'sleep_seconds', 'active_seconds', 'stop_reason']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ['username', 'user', 'kind', 'started_when', 'duration_seconds', 'items', 'added', 'adds_per_minute', 'sleep_seconds', 'active_seconds', 'stop_reason', 'proxy']
+    search_fields = ['username', 'user', 'task_id', 'chain_id', 'proxy']
+    inlines = [JobRunSegmentInline]
+    list_filter = ['kind', 'stop_reason', 'started_when']
+    date_hierarchy = 'started_when'
+    change_list_template = 'admin/Core/jobrun/change_list.html'
+
+    def get_urls(self):
+        from django.urls import path
+
+        urls = [
+            path('stats/', self.admin_site.admin_view(self.stats_view), name='Core_jobrun_stats'),
+        ]
+        return urls + super().get_urls()
+
+    def stats_view(self, request):
+        from django.template.response import TemplateResponse
+        from bot.history import account_stats, proxy_stats
+
+        kind = request.GET.get('kind') or None
+        try:
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Job run stats',
+            'kind': kind or '',
+            'days': days,
+            'account_stats': account_stats(kind, days),
+            'proxy_stats': proxy_stats(kind, days),
+        }
+        return TemplateResponse(request, 'admin/Core/jobrun/stats.html', context)
+
+    def has_add_permission(self, request):
+        return False
+
+admin.site.register(JobRun, JobRunAdmin)
@@ -0,0 +1,38 @@
+import os
+from django.core.management.base import BaseCommand
+from bot.bot import InstagramBot
+from bot.followers import convert_txt_followers
+
+
+class Command(BaseCommand):
+    help = "Convert the legacy users/<user>/followers/<username>.txt files to the binary .bin follower list format"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', action='store_true', help="Keep the .txt files after converting them")
+
+    def handle(self, *args, **options):
+
+        base_data_dir = InstagramBot().base_data_dir
+        converted = 0
+
+        if not os.path.exists(base_data_dir):
+            return
+
+        for user in os.listdir(base_data_dir):
+            followers_path = os.path.join(base_data_dir, user, 'followers')
+            if not os.path.isdir(followers_path):
+                continue
+
+            for filename in os.listdir(followers_path):
+                if not filename.endswith('.txt'):
+                    continue
+
+                txt_path = os.path.join(followers_path, filename)
+                count = convert_txt_followers(txt_path, f'{txt_path[:-4]}.bin')
+                if not options['keep']:
+                    os.remove(txt_path)
+
+                converted += 1
+                self.stdout.write(f"{user}/{filename[:-4]}: {count} followers")
+
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} follower lists"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from Core.models import User, InstagramAccount
+from bot.accounts import import_file_accounts
+
+
+class Command(BaseCommand):
+    help = "Import the legacy users/<user>/accounts/<username>.json files into the InstagramAccount table"
+
+    def handle(self, *args, **options):
+
+        imported = import_file_accounts(User.objects.exclude(username=None), InstagramAccount)
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} Instagram accounts"))
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0003_passwordresetcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstagramAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(help_text='The Instagram username.', max_length=255)),
+                ('password', models.CharField(help_text='The Instagram password used by the bot to log in.', max_length=255)),
+                ('config', models.JSONField(default=dict, help_text='The bot configuration (BotConfig) for this account.')),
+                ('followers_count', models.IntegerField(default=0, help_text='The number of followers scraped for this account')),
+                ('adding_to_close_friends', models.BooleanField(default=False, help_text='Indicates whether followers are currently being added to close friends.')),
+                ('getting_followers', models.BooleanField(default=False, help_text='Indicates whether followers are currently being scraped.')),
+                ('created_when', models.DateTimeField(auto_now_add=True)),
+                ('updated_when', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(help_text='The user that linked this Instagram account.', on_delete=django.db.models.deletion.CASCADE, related_name='instagram_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'getting_followers'], name='ig_account_owner_getting_idx'), models.Index(fields=['owner', 'adding_to_close_friends'], name='ig_account_owner_adding_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'username'), name='unique_instagram_account_per_owner')],
+            },
+        ),
+    ]
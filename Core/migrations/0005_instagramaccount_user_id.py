@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0004_instagramaccount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instagramaccount',
+            name='user_id',
+            field=models.BigIntegerField(blank=True, help_text='The numeric Instagram user id, resolved when the account is linked.', null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0005_instagramaccount_user_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(help_text='The username of the bot operator.', max_length=255)),
+                ('username', models.CharField(help_text='The Instagram username the job runs on.', max_length=255)),
+                ('kind', models.CharField(help_text="The kind of job ('scrape' or 'close_friends').", max_length=32)),
+                ('task_id', models.CharField(help_text="The Celery task id of the job's current (or next) task.", max_length=255)),
+                ('holder', models.CharField(blank=True, default='', help_text='The worker running the task, empty while it waits in the queue.', max_length=255)),
+                ('heartbeat_when', models.DateTimeField(blank=True, help_text='The last time the running task reported it is alive.', null=True)),
+                ('expires_when', models.DateTimeField(help_text='The lease can be taken over by another task after this time.')),
+                ('created_when', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'username', 'kind'), name='unique_job_lease_per_account')],
+            },
+        ),
+    ]
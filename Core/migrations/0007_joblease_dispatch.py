@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0006_joblease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='joblease',
+            name='task_name',
+            field=models.CharField(blank=True, default='', help_text='The Celery task the job starts with.', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='joblease',
+            name='task_kwargs',
+            field=models.JSONField(default=dict, help_text='The arguments of the task the job starts with.'),
+        ),
+        migrations.AddField(
+            model_name='joblease',
+            name='enqueued_when',
+            field=models.DateTimeField(blank=True, help_text='When the job was requested.', null=True),
+        ),
+        migrations.AddField(
+            model_name='joblease',
+            name='dispatched_when',
+            field=models.DateTimeField(blank=True, help_text='When the job was sent to its Celery queue, empty while it waits for a free slot of its tenant.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='joblease',
+            index=models.Index(fields=['kind', 'dispatched_when'], name='job_lease_kind_dispatched_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0007_joblease_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(help_text='The Celery task id of the profiled task.', max_length=255, unique=True)),
+                ('task_name', models.CharField(help_text='The name of the profiled task.', max_length=255)),
+                ('user', models.CharField(blank=True, default='', help_text='The username of the bot operator.', max_length=255)),
+                ('username', models.CharField(blank=True, default='', help_text='The Instagram username the task ran on.', max_length=255)),
+                ('state', models.CharField(blank=True, default='', help_text='The final state of the task (SUCCESS, FAILURE, ...).', max_length=32)),
+                ('wall_seconds', models.FloatField(help_text='Wall clock duration of the task.')),
+                ('cpu_seconds', models.FloatField(help_text="CPU time of the task's thread, the rest was spent sleeping or waiting on the network.")),
+                ('peak_memory', models.BigIntegerField(blank=True, help_text='Peak memory traced by tracemalloc during the task, in bytes.', null=True)),
+                ('summary', models.JSONField(default=dict, help_text='Top functions by cumulative time and top allocation sites.')),
+                ('stats', models.BinaryField(help_text='The raw cProfile stats (marshalled pstats), as written by pstats.Stats.dump_stats.')),
+                ('created_when', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['task_name', 'created_when'], name='task_profile_name_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0008_taskprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(help_text='The username of the bot operator.', max_length=255)),
+                ('username', models.CharField(help_text='The Instagram username the job ran on.', max_length=255)),
+                ('kind', models.CharField(help_text="The kind of job ('scrape' or 'close_friends').", max_length=32)),
+                ('task_id', models.CharField(blank=True, default='', help_text='The Celery task id of the run.', max_length=255)),
+                ('proxy', models.CharField(blank=True, default='', help_text='The proxy (host:port) the run went through.', max_length=255)),
+                ('started_when', models.DateTimeField()),
+                ('ended_when', models.DateTimeField()),
+                ('duration_seconds', models.FloatField(help_text='Wall clock duration of the run.')),
+                ('items', models.IntegerField(default=0, help_text='Followers scraped or gone through for close friends.')),
+                ('added', models.IntegerField(default=0, help_text='Followers added to close friends.')),
+                ('adds_per_minute', models.FloatField(default=0, help_text='Followers added to close friends per minute of the run.')),
+                ('sleep_seconds', models.FloatField(default=0, help_text='Time spent waiting for the next action.')),
+                ('active_seconds', models.FloatField(default=0, help_text='Time spent logging in and making requests.')),
+                ('stop_reason', models.CharField(help_text="Why the run ended ('done', 'feedback_required', 'error', or 'paused' when the job continues in another task).", max_length=32)),
+                ('error', models.TextField(blank=True, default='', help_text='The error that stopped the run.')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['user', 'started_when'], name='job_run_user_started_idx'),
+                    models.Index(fields=['username', 'started_when'], name='job_run_username_started_idx'),
+                    models.Index(fields=['kind', 'started_when'], name='job_run_kind_started_idx'),
+                    models.Index(fields=['proxy', 'started_when'], name='job_run_proxy_started_idx'),
+                    models.Index(fields=['started_when'], name='job_run_started_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:10
+
+import os
+import json
+
+from django.db import migrations
+
+# users/ next to the project, frozen here rather than imported from bot.accounts
+USERS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../users'))
+
+
+def import_json_accounts(apps, schema_editor):
+    # The database is the default account store, accounts linked before it existed live in JSON files
+    User = apps.get_model('Core', 'User')
+    InstagramAccount = apps.get_model('Core', 'InstagramAccount')
+
+    for user in User.objects.exclude(username=None):
+        accounts_dir = os.path.join(USERS_DIR, f'{user.username}/accounts')
+        if not os.path.exists(accounts_dir):
+            continue
+
+        for filename in os.listdir(accounts_dir):
+            if not filename.endswith('.json'):
+                continue
+
+            with open(os.path.join(accounts_dir, filename), 'r') as f:
+                account_data = json.load(f)
+
+            InstagramAccount.objects.update_or_create(
+                owner=user,
+                username=filename[:-5],  # Remove '.json'
+                defaults={
+                    'password': account_data['password'],
+                    'user_id': account_data.get('user_id'),
+                    'config': account_data['config'],
+                    'followers_count': account_data.get('followers_count', 0),
+                    'adding_to_close_friends': account_data.get('adding_to_close_friends', False),
+                    'getting_followers': account_data.get('getting_followers', False),
+                }
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0009_jobrun'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_json_accounts, migrations.RunPython.noop),
+    ]
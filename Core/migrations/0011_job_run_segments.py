@@ -0,0 +1,82 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def segment_existing_runs(apps, schema_editor):
+    # Runs recorded before segments existed count as one segment on the day they ended
+    JobRun = apps.get_model('Core', 'JobRun')
+    JobRunSegment = apps.get_model('Core', 'JobRunSegment')
+    JobRunSegment.objects.bulk_create([
+        JobRunSegment(
+            run=run, task_id=run.task_id, proxy=run.proxy, started_when=run.started_when, ended_when=run.ended_when,
+            duration_seconds=run.duration_seconds, items=run.items, added=run.added, sleep_seconds=run.sleep_seconds,
+            active_seconds=run.active_seconds, stop_reason=run.stop_reason,
+        )
+        for run in JobRun.objects.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0010_import_json_accounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRunSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(blank=True, default='', help_text='The Celery task id of the segment.', max_length=255)),
+                ('proxy', models.CharField(blank=True, default='', help_text='The proxy (host:port) the segment went through.', max_length=255)),
+                ('started_when', models.DateTimeField(help_text='When the segment started, the end of the previous one for a continued run.')),
+                ('ended_when', models.DateTimeField()),
+                ('duration_seconds', models.FloatField(help_text='Wall clock duration of the segment.')),
+                ('items', models.IntegerField(default=0, help_text='Followers scraped or gone through for close friends.')),
+                ('added', models.IntegerField(default=0, help_text='Followers added to close friends.')),
+                ('sleep_seconds', models.FloatField(default=0, help_text="Time spent waiting for the next action, or in the queue before the segment's task.")),
+                ('active_seconds', models.FloatField(default=0, help_text='Time spent logging in and making requests.')),
+                ('stop_reason', models.CharField(help_text="Why the segment ended, 'paused' unless it ended the run.", max_length=32)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='joblease',
+            name='chain_id',
+            field=models.CharField(blank=True, default='', help_text='Identifies the job across the tasks it is handed off to, and its JobRun.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='jobrun',
+            name='chain_id',
+            field=models.CharField(blank=True, default='', help_text='The job (lease chain) the run records, its tasks extend the same run.', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='jobrun',
+            name='proxy',
+            field=models.CharField(blank=True, default='', help_text='The proxy (host:port) the run last went through, its segments have every one.', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='jobrun',
+            name='task_id',
+            field=models.CharField(blank=True, default='', help_text="The Celery task id of the run's last task.", max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='jobrun',
+            index=models.Index(fields=['chain_id'], name='job_run_chain_idx'),
+        ),
+        migrations.AddField(
+            model_name='jobrunsegment',
+            name='run',
+            field=models.ForeignKey(help_text='The run the segment belongs to.', on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='Core.jobrun'),
+        ),
+        migrations.AddIndex(
+            model_name='jobrunsegment',
+            index=models.Index(fields=['ended_when'], name='job_run_segment_ended_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jobrunsegment',
+            index=models.Index(fields=['proxy', 'ended_when'], name='job_run_segment_proxy_idx'),
+        ),
+        migrations.RunPython(segment_existing_runs, migrations.RunPython.noop),
+    ]
@@ -52,4 +52,147 @@ class PasswordResetCode(models.Model):
     created_when = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f'Password reset for {self.user.username} at {self.created_when}'
\ No newline at end of file
+        return f'Password reset for {self.user.username} at {self.created_when}'
+
+class InstagramAccount(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='instagram_accounts', help_text="The user that linked this Instagram account.")
+    username = models.CharField(max_length=255, help_text="The Instagram username.")
+    password = models.CharField(max_length=255, help_text="The Instagram password used by the bot to log in.")
+    user_id = models.BigIntegerField(null=True, blank=True, help_text="The numeric Instagram user id, resolved when the account is linked.")
+    config = models.JSONField(default=dict, help_text="The bot configuration (BotConfig) for this account.")
+
+    followers_count = models.IntegerField(default=0, help_text="The number of followers scraped for this account")
+    adding_to_close_friends = models.BooleanField(default=False, help_text="Indicates whether followers are currently being added to close friends.")
+    getting_followers = models.BooleanField(default=False, help_text="Indicates whether followers are currently being scraped.")
+
+    created_when = models.DateTimeField(auto_now_add=True)
+    updated_when = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'username'], name='unique_instagram_account_per_owner'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'getting_followers'], name='ig_account_owner_getting_idx'),
+            models.Index(fields=['owner', 'adding_to_close_friends'], name='ig_account_owner_adding_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.username} ({self.owner.username})'
+
+    def as_dict(self):
+        """Return the account in the same shape as the legacy accounts/<username>.json files."""
+
+        return {
+            'username': self.username,
+            'password': self.password,
+            'user_id': self.user_id,
+            'config': self.config,
+            'followers_count': self.followers_count,
+            'adding_to_close_friends': self.adding_to_close_friends,
+            'getting_followers': self.getting_followers,
+        }
+
+class JobLease(models.Model):
+    user = models.CharField(max_length=255, help_text="The username of the bot operator.")
+    username = models.CharField(max_length=255, help_text="The Instagram username the job runs on.")
+    kind = models.CharField(max_length=32, help_text="The kind of job ('scrape' or 'close_friends').")
+    task_id = models.CharField(max_length=255, help_text="The Celery task id of the job's current (or next) task.")
+    holder = models.CharField(max_length=255, blank=True, default='', help_text="The worker running the task, empty while it waits in the queue.")
+    task_name = models.CharField(max_length=255, blank=True, default='', help_text="The Celery task the job starts with.")
+    task_kwargs = models.JSONField(default=dict, help_text="The arguments of the task the job starts with.")
+    chain_id = models.CharField(max_length=64, blank=True, default='', help_text="Identifies the job across the tasks it is handed off to, and its JobRun.")
+
+    enqueued_when = models.DateTimeField(null=True, blank=True, help_text="When the job was requested.")
+    dispatched_when = models.DateTimeField(null=True, blank=True, help_text="When the job was sent to its Celery queue, empty while it waits for a free slot of its tenant.")
+    heartbeat_when = models.DateTimeField(null=True, blank=True, help_text="The last time the running task reported it is alive.")
+    expires_when = models.DateTimeField(help_text="The lease can be taken over by another task after this time.")
+    created_when = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'username', 'kind'], name='unique_job_lease_per_account'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'dispatched_when'], name='job_lease_kind_dispatched_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} lease on {self.username} ({self.user})'
+
+class TaskProfile(models.Model):
+    task_id = models.CharField(max_length=255, unique=True, help_text="The Celery task id of the profiled task.")
+    task_name = models.CharField(max_length=255, help_text="The name of the profiled task.")
+    user = models.CharField(max_length=255, blank=True, default='', help_text="The username of the bot operator.")
+    username = models.CharField(max_length=255, blank=True, default='', help_text="The Instagram username the task ran on.")
+    state = models.CharField(max_length=32, blank=True, default='', help_text="The final state of the task (SUCCESS, FAILURE, ...).")
+
+    wall_seconds = models.FloatField(help_text="Wall clock duration of the task.")
+    cpu_seconds = models.FloatField(help_text="CPU time of the task's thread, the rest was spent sleeping or waiting on the network.")
+    peak_memory = models.BigIntegerField(null=True, blank=True, help_text="Peak memory traced by tracemalloc during the task, in bytes.")
+    summary = models.JSONField(default=dict, help_text="Top functions by cumulative time and top allocation sites.")
+    stats = models.BinaryField(help_text="The raw cProfile stats (marshalled pstats), as written by pstats.Stats.dump_stats.")
+    created_when = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task_name', 'created_when'], name='task_profile_name_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task_name} profile ({self.task_id})'
+
+class JobRun(models.Model):
+    user = models.CharField(max_length=255, help_text="The username of the bot operator.")
+    username = models.CharField(max_length=255, help_text="The Instagram username the job ran on.")
+    kind = models.CharField(max_length=32, help_text="The kind of job ('scrape' or 'close_friends').")
+    task_id = models.CharField(max_length=255, blank=True, default='', help_text="The Celery task id of the run's last task.")
+    chain_id = models.CharField(max_length=64, blank=True, default='', help_text="The job (lease chain) the run records, its tasks extend the same run.")
+    proxy = models.CharField(max_length=255, blank=True, default='', help_text="The proxy (host:port) the run last went through, its segments have every one.")
+
+    started_when = models.DateTimeField()
+    ended_when = models.DateTimeField()
+    duration_seconds = models.FloatField(help_text="Wall clock duration of the run.")
+    items = models.IntegerField(default=0, help_text="Followers scraped or gone through for close friends.")
+    added = models.IntegerField(default=0, help_text="Followers added to close friends.")
+    adds_per_minute = models.FloatField(default=0, help_text="Followers added to close friends per minute of the run.")
+    sleep_seconds = models.FloatField(default=0, help_text="Time spent waiting for the next action.")
+    active_seconds = models.FloatField(default=0, help_text="Time spent logging in and making requests.")
+    stop_reason = models.CharField(max_length=32, help_text="Why the run ended ('done', 'feedback_required', 'error', or 'paused' when the job continues in another task).")
+    error = models.TextField(blank=True, default='', help_text="The error that stopped the run.")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'started_when'], name='job_run_user_started_idx'),
+            models.Index(fields=['username', 'started_when'], name='job_run_username_started_idx'),
+            models.Index(fields=['kind', 'started_when'], name='job_run_kind_started_idx'),
+            models.Index(fields=['proxy', 'started_when'], name='job_run_proxy_started_idx'),
+            models.Index(fields=['started_when'], name='job_run_started_idx'),
+            models.Index(fields=['chain_id'], name='job_run_chain_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} run on {self.username} ({self.user})'
+
+class JobRunSegment(models.Model):
+    run = models.ForeignKey(JobRun, on_delete=models.CASCADE, related_name='segments', help_text="The run the segment belongs to.")
+    task_id = models.CharField(max_length=255, blank=True, default='', help_text="The Celery task id of the segment.")
+    proxy = models.CharField(max_length=255, blank=True, default='', help_text="The proxy (host:port) the segment went through.")
+
+    started_when = models.DateTimeField(help_text="When the segment started, the end of the previous one for a continued run.")
+    ended_when = models.DateTimeField()
+    duration_seconds = models.FloatField(help_text="Wall clock duration of the segment.")
+    items = models.IntegerField(default=0, help_text="Followers scraped or gone through for close friends.")
+    added = models.IntegerField(default=0, help_text="Followers added to close friends.")
+    sleep_seconds = models.FloatField(default=0, help_text="Time spent waiting for the next action, or in the queue before the segment's task.")
+    active_seconds = models.FloatField(default=0, help_text="Time spent logging in and making requests.")
+    stop_reason = models.CharField(max_length=32, help_text="Why the segment ended, 'paused' unless it ended the run.")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ended_when'], name='job_run_segment_ended_idx'),
+            models.Index(fields=['proxy', 'ended_when'], name='job_run_segment_proxy_idx'),
+        ]
+
+    def __str__(self):
+        return f'Segment of {self.run}'
@@ -1,18 +1,103 @@
 from CloseFriends.celery import app
 from celery.utils.log import get_task_logger
 from bot.bot import InstagramBot
+from bot.lease import AccountLease
+from bot.dispatch import dispatch
+from bot.progress import SCRAPE_JOB, CLOSE_FRIENDS_JOB
 
 logger = get_task_logger(__name__)
 
-@app.task(name='get_account_followers', time_limit=36000, soft_time_limit=34200)
-def get_account_followers(user, username):
+# Every task takes the account's lease for its kind of job first and backs off when another
+# task holds it, so double clicks or redelivered messages never run two loops on one account.
 
-    bot = InstagramBot(user=user)
-    # bot.get_followers_via_instagrapi(username=username)
-    bot.get_followers_via_hiker(username=username)
+# With HIKER_SCRAPE_MODE=async, run the worker with a threads pool (e.g. -P threads -c 50) so the
+# scrapes of many accounts share the AsyncHikerScraper event loop of the process.
+# Not acks_late: the broker redelivers an unacked message after its consumer_timeout (30 minutes
+# on RabbitMQ), long before a 10 hour scrape is done. A scrape killed with its worker or by the
+# time limit resumes from its saved cursor when it is started again.
+@app.task(bind=True, name='get_account_followers', time_limit=36000, soft_time_limit=34200)
+def get_account_followers(self, user, username):
 
-@app.task(name='add_followers_to_close_freinds', time_limit=36000, soft_time_limit=34200)
-def add_followers_to_close_freinds(user, username):
+    lease = AccountLease(user, username, SCRAPE_JOB, self.request.id)
+    if not lease.acquire():
+        return
 
-    bot = InstagramBot(user=user)
-    bot.add_to_close_friends(username=username)
\ No newline at end of file
+    try:
+        bot = InstagramBot(user=user)
+        # bot.get_followers_via_instagrapi(username=username)
+        bot.get_followers_via_hiker(username=username)
+    finally:
+        lease.release()
+
+# Safe to run on a gevent worker (-P gevent -c 500): every task gets its own InstagramBot and
+# the sleeps and instagrapi requests yield, see bot/green.py
+@app.task(bind=True, name='add_followers_to_close_freinds', time_limit=36000, soft_time_limit=34200)
+def add_followers_to_close_freinds(self, user, username):
+
+    lease = AccountLease(user, username, CLOSE_FRIENDS_JOB, self.request.id)
+    if not lease.acquire():
+        return
+
+    retry = None
+    try:
+        bot = InstagramBot(user=user)
+        retry = bot.add_to_close_friends(username=username)
+    finally:
+        # No proxy to run on, wait for one in the queue instead of in a worker
+        if retry is not None:
+            add_followers_to_close_freinds.apply_async(
+                kwargs={'user': user, 'username': username},
+                countdown=retry, task_id=lease.hand_off(retry)
+            )
+        else:
+            lease.release()
+
+@app.task(bind=True, name='close_friends_step', time_limit=900, soft_time_limit=840)
+def close_friends_step(self, user, username):
+
+    lease = AccountLease(user, username, CLOSE_FRIENDS_JOB, self.request.id)
+    if not lease.acquire():
+        return
+
+    next_step = None
+    try:
+        bot = InstagramBot(user=user)
+        next_step = bot.close_friends_step(username=username)
+    finally:
+        # Free the worker until the account's next action is due
+        if next_step is not None:
+            close_friends_step.apply_async(
+                kwargs={'user': user, 'username': username},
+                countdown=next_step, task_id=lease.hand_off(next_step)
+            )
+        else:
+            lease.release()
+
+@app.task(bind=True, name='add_close_friends_batch', time_limit=3600, soft_time_limit=3420, acks_late=True)
+def add_close_friends_batch(self, user, username, offset=None, last_id=None):
+
+    lease = AccountLease(user, username, CLOSE_FRIENDS_JOB, self.request.id)
+    if not lease.acquire():
+        return
+
+    next_batch = None
+    try:
+        bot = InstagramBot(user=user)
+        next_batch = bot.add_close_friends_batch(username=username, offset=offset, last_id=last_id)
+    finally:
+        # The next batch carries the checkpoint and waits out the cooldown in the queue, not in a worker
+        if next_batch is not None:
+            cooldown, offset, last_id = next_batch
+            add_close_friends_batch.apply_async(
+                kwargs={'user': user, 'username': username, 'offset': offset, 'last_id': last_id},
+                countdown=cooldown, task_id=lease.hand_off(cooldown)
+            )
+        else:
+            lease.release()
+
+# Run by celery beat, sends jobs waiting for a free slot of their tenant (e.g. after a lease expired)
+@app.task(name='dispatch_jobs')
+def dispatch_jobs():
+
+    for kind in (SCRAPE_JOB, CLOSE_FRIENDS_JOB):
+        dispatch(kind)
@@ -12,6 +12,9 @@ urlpatterns = [
     path('add-instagram-acount/', views.Account, name='add-instagram-acount'),
     path('edit-instagram-acount/<str:old_username>/', views.Account, name='update-instagram-acount'),
     path('accounts/', views.UserConnectedAccounts, name='accounts'),
+    path('accounts/progress/', views.AccountsProgress, name='accounts-progress'),
+    path('jobs/queues/', views.JobQueues, name='job-queues'),
+    path('metrics', views.Metrics, name='metrics'),
     path('accounts/verification-code/', views.VerificationCode, name='verification-code'),
     path('delete-connected-account/<str:username>/', views.DeleteIGAccount, name='delete-ig-account'),
     path('get-account-followers/<str:username>/', views.GetFollowers, name='get-account-followers'),
@@ -1,9 +1,15 @@
 from django.shortcuts import render, redirect
+from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from .models import User, PasswordResetCode
 from bot.bot import InstagramBot
+from bot.progress import get_progress
+from bot.dispatch import queue_stats
+from bot.proxies import proxy_pool
+from bot.metrics import collect_all, render as render_metrics
+from decouple import config
 from .utils import *
 from django.urls import reverse
 from django.core.mail import EmailMessage
@@ -371,6 +377,36 @@ def UserConnectedAccounts(request):
     context = {'accounts': accounts}
     return render(request, 'accounts.html', context)
 
+@login_required
+def AccountsProgress(request):
+
+    bot = InstagramBot(user=request.user.username)
+    accounts = bot.get_user_accounts()
+    progress = get_progress(request.user.username, [account['username'] for account in accounts])
+
+    for account in accounts:
+        account['jobs'] = progress[account['username']]
+
+    return JsonResponse({'accounts': accounts})
+
+@login_required
+def JobQueues(request):
+
+    # Staff see every tenant and the proxy pool, users only their own queue
+    if not request.user.is_staff:
+        return JsonResponse({'tenants': queue_stats([request.user.username])})
+
+    return JsonResponse({'tenants': queue_stats(), 'proxies': proxy_pool.stats()})
+
+def Metrics(request):
+
+    # Scraped with METRICS_TOKEN as a bearer token, staff can also open it from the browser
+    token = config('METRICS_TOKEN', default='')
+    if not (token and request.headers.get('Authorization') == f'Bearer {token}') and not request.user.is_staff:
+        return HttpResponse(status=403)
+
+    return HttpResponse(render_metrics(collect_all()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def DeleteIGAccount(request, username):
 
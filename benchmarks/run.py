@@ -0,0 +1,329 @@
+"""
+End to end benchmark of the bot against the local stub server.
+
+For every follower count, a fresh process logs an account in, scrapes its followers
+with get_followers_via_hiker and adds them to close friends with add_to_close_friends,
+with the action delays and pauses scaled down by --delay-scale. Each stage reports its
+wall and CPU time, throughput, peak RSS and file I/O, and the whole run is written to a
+JSON file that can be compared with a previous one:
+
+    python -m benchmarks.run --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks.run --sizes 1000 --baseline results.json
+
+The benchmark runs with the project's settings (the jobs cache in particular), under a
+throwaway bench-<pid> tenant in the users directory that is removed afterwards.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+from datetime import datetime, timezone
+
+from .stub_server import StubServer, StubConfig
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def _io_counters():
+    """Read and write syscalls and storage bytes of the process, from /proc/self/io (Linux only)."""
+
+    counters = {}
+    try:
+        with open('/proc/self/io') as io:
+            for line in io:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except OSError:
+        pass
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        # Include socket reads and writes, the storage counters below do not
+        'read_calls': counters.get('syscr', 0),
+        'write_calls': counters.get('syscw', 0),
+        'read_bytes': counters.get('read_bytes', 0),
+        'write_bytes': counters.get('write_bytes', 0),
+        'block_inputs': usage.ru_inblock,
+        'block_outputs': usage.ru_oublock,
+    }
+
+
+class Stage:
+    """Context manager measuring one stage of a benchmark run into results[name]."""
+
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+
+    def __enter__(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.cpu = usage.ru_utime + usage.ru_stime
+        self.io = _io_counters()
+        self.started = time.perf_counter()
+        self.result = self.results[self.name] = {}
+        return self.result
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = _io_counters()
+
+        self.result.update({
+            'seconds': seconds,
+            'cpu_seconds': usage.ru_utime + usage.ru_stime - self.cpu,
+            'peak_rss_kb': usage.ru_maxrss,
+            'io': {name: io[name] - self.io[name] for name in io},
+        })
+        if 'items' in self.result:
+            self.result['per_second'] = self.result['items'] / seconds if seconds else 0.0
+        if exc is not None:
+            self.result['error'] = f'{exc_type.__name__}: {exc}'
+        # A failed stage is reported, the next stages still run
+        return exc_type is not None and issubclass(exc_type, Exception)
+
+
+def _scaled_client_class(client_class, stub_url, delay_scale):
+    """A Client subclass sending the private API requests to the stub, with its request delays scaled."""
+
+    from requests.adapters import HTTPAdapter
+
+    class StubAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = stub_url + request.url.split('i.instagram.com', 1)[1]
+            kwargs['proxies'] = {}
+            return super().send(request, **kwargs)
+
+    class StubClient(client_class):
+        _delay_range = None
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.request_timeout = 0
+            self._mount_stub()
+
+        def _mount_stub(self):
+            # The password encryption keys are read through the public session
+            for session in (self.private, self.public):
+                session.mount('https://i.instagram.com/', StubAdapter())
+
+        def set_settings(self, settings):
+            result = super().set_settings(settings)
+            self._mount_stub()
+            return result
+
+        @property
+        def delay_range(self):
+            return self._delay_range
+
+        @delay_range.setter
+        def delay_range(self, value):
+            self._delay_range = [delay * delay_scale for delay in value] if value else value
+
+    return StubClient
+
+
+def _metric_total(snapshot, name):
+    metric = snapshot.get(name)
+    if metric is None:
+        return 0
+    if metric['type'] == 'counter':
+        return sum(metric['samples'].values())
+    return sum(sample['sum'] for sample in metric['samples'].values())
+
+
+def run_size(size, stub_url, args):
+    """Benchmark one follower count in this process and return its results."""
+
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CloseFriends.settings')
+    django.setup()
+
+    import bot.bot
+    from bot import metrics
+    from bot.bot import InstagramBot, BotConfig
+    from bot.hiker import request_timings
+
+    bot.bot.Client = _scaled_client_class(bot.bot.Client, stub_url, args.delay_scale)
+
+    user = f'bench-{os.getpid()}'
+    username = f'bench_{size}'
+    instagram = InstagramBot(user=user)
+    instagram.feedback_error_sleep_time *= args.delay_scale
+    instagram._setup_directories(user)
+
+    defaults = BotConfig()
+    bot_config = BotConfig(
+        max_followers=size,
+        action_delay_min=defaults.action_delay_min * args.delay_scale,
+        action_delay_max=defaults.action_delay_max * args.delay_scale,
+        batch_cooldown=defaults.batch_cooldown * args.delay_scale,
+        close_friends_group_size=args.group_size,
+    )
+
+    results = {'size': size, 'stages': {}}
+    try:
+        with Stage(results['stages'], 'login') as stage:
+            instagram.username, instagram.password = username, 'bench'
+            session_file = f'{instagram.cache_path}/{username}_session.json'
+            client = instagram._create_client(session_file).client
+            client.dump_settings(session_file)
+            instagram.store.create(username, {
+                'username': username,
+                'password': 'bench',
+                'user_id': int(client.user_id),
+                'config': bot_config.overrides(),
+                'adding_to_close_friends': False,
+                'getting_followers': False,
+            })
+
+        with Stage(results['stages'], 'scrape') as stage:
+            instagram.get_followers_via_hiker(username)
+            stage['items'] = instagram.store.get(username).get('followers_count', 0)
+            stage['requests'] = request_timings.snapshot()
+
+        with Stage(results['stages'], 'close_friends') as stage:
+            instagram.add_to_close_friends(username)
+            snapshot = metrics.registry.snapshot()
+            stage['items'] = _metric_total(snapshot, 'ig_close_friends_added_total')
+            stage['soft_blocks'] = _metric_total(snapshot, 'ig_soft_blocks_total')
+            stage['sleep_seconds'] = _metric_total(snapshot, 'close_friends_sleep_seconds_total')
+            stage['work_seconds'] = _metric_total(snapshot, 'close_friends_work_seconds_total')
+    finally:
+        if not args.keep:
+            shutil.rmtree(instagram.user_account, ignore_errors=True)
+
+    results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def _child_command(size, stub_url, args):
+    command = [
+        sys.executable, '-m', 'benchmarks.run', '--child', '--sizes', str(size), '--stub-url', stub_url,
+        '--delay-scale', str(args.delay_scale), '--group-size', str(args.group_size),
+    ]
+    if args.keep:
+        command.append('--keep')
+    return command
+
+
+def _child_env(stub_url, args):
+    return {
+        **os.environ,
+        'HIKER_BASE_URL': stub_url,
+        'HIKER_TOKEN': 'bench',
+        'HIKER_HTTP2': 'False',
+        'HIKER_SCRAPE_MODE': args.scrape_mode,
+        'ACCOUNT_STORE_BACKEND': 'file',
+        'CLOSE_FRIENDS_SYNC': str(args.sync),
+        'CLOSE_FRIENDS_THROTTLE_PAUSE': str(300 * args.delay_scale),
+        # Straight to the stub, never through the deployment's proxies
+        'PROXY_POOL': '',
+        'PROXY_HOST': '',
+        'METRICS_PORT': '0',
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of results against a baseline run: slower stages and higher peak RSS."""
+
+    previous = {run['size']: run for run in baseline['runs']}
+    regressions = []
+    for run in results['runs']:
+        before = previous.get(run['size'])
+        if before is None:
+            continue
+
+        for name, stage in run['stages'].items():
+            rate, previous_rate = stage.get('per_second'), before['stages'].get(name, {}).get('per_second')
+            if rate is not None and previous_rate and rate < previous_rate * (1 - tolerance):
+                regressions.append(f"{run['size']} {name}: {rate:.1f}/s, was {previous_rate:.1f}/s")
+
+        if run['peak_rss_kb'] > before['peak_rss_kb'] * (1 + tolerance):
+            regressions.append(f"{run['size']} peak RSS: {run['peak_rss_kb']} KB, was {before['peak_rss_kb']} KB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bot end to end against a local stub of Hiker and Instagram")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Follower counts to benchmark")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean seconds added to every stub response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Standard deviation of the added latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of close friends requests answered with a 429")
+    parser.add_argument('--feedback-rate', type=float, default=0.0, help="Share of close friends requests answered with feedback_required")
+    parser.add_argument('--page-size', type=int, default=100, help="Followers per Hiker page")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--delay-scale', type=float, default=0.001, help="Factor applied to the action delays and pauses")
+    parser.add_argument('--group-size', type=int, default=1, help="Followers added to close friends per request")
+    parser.add_argument('--scrape-mode', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--sync', action='store_true', help="Run close friends in sync mode (CLOSE_FRIENDS_SYNC)")
+    parser.add_argument('--output', help="Results file, benchmarks/results/<time>.json by default")
+    parser.add_argument('--baseline', help="Previous results file to compare with, exits with 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown or RSS growth against the baseline")
+    parser.add_argument('--keep', action='store_true', help="Keep the benchmark tenant's files")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--stub-url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_size(args.sizes[0], args.stub_url, args)))
+        return 0
+
+    stub = StubServer(StubConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        feedback_rate=args.feedback_rate, page_size=args.page_size, seed=args.seed,
+    )).start()
+
+    results = {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'arguments': {name: value for name, value in vars(args).items() if name not in ('child', 'stub_url')},
+        'runs': [],
+    }
+    try:
+        for pk, size in enumerate(args.sizes, start=1):
+            stub.add_account(f'bench_{size}', pk, size)
+            stub.state.reset_stats()
+
+            # A process per size, so peak RSS and I/O are those of that size only
+            completed = subprocess.run(
+                _child_command(size, stub.url, args), env=_child_env(stub.url, args),
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                run = {'size': size, 'stages': {}, 'peak_rss_kb': 0, 'error': completed.stderr[-2000:]}
+            else:
+                run = json.loads(completed.stdout.strip().splitlines()[-1])
+            run['stub'] = stub.stats()['requests']
+            results['runs'].append(run)
+
+            summary = ', '.join(
+                f"{name} {stage['seconds']:.1f}s" + (f" ({stage['per_second']:.0f}/s)" if 'per_second' in stage else '')
+                for name, stage in run['stages'].items()
+            )
+            print(f"{size} followers: {summary or run.get('error')}, peak RSS {run['peak_rss_kb'] // 1024} MB", file=sys.stderr)
+    finally:
+        stub.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
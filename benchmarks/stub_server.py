@@ -0,0 +1,319 @@
+"""
+Local stand-in for the Hiker API and the Instagram private API, for the benchmarks.
+
+Serves the Hiker followers pagination and user lookup the scrapes use, and the
+instagrapi login, session check and close friends (besties) endpoints, over plain HTTP
+on localhost. Every request can be slowed down by a configurable latency and answered
+with an injected server error, throttling (429) or feedback block, so the bot's
+retry and back off paths are exercised as well as its happy path.
+"""
+import json
+import time
+import base64
+import random
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+HIKER_USER_BY_USERNAME = '/v1/user/by/username'
+HIKER_FOLLOWERS = '/v2/user/followers'
+INSTAGRAM_PREFIX = '/api/v1/'
+
+# Follower ids of an account are FOLLOWER_ID_BASE + account pk * ACCOUNT_ID_SPAN + index
+FOLLOWER_ID_BASE = 10 ** 12
+ACCOUNT_ID_SPAN = 10 ** 8
+
+
+@dataclass
+class StubConfig:
+    """
+    Behaviour of the stub server.
+    Attributes:
+        latency (float): Mean seconds added to every response.
+        jitter (float): Standard deviation of the added latency.
+        error_rate (float): Share of requests answered with a 500.
+        throttle_rate (float): Share of close friends requests answered with a 429.
+        feedback_rate (float): Share of close friends requests answered with feedback_required.
+        page_size (int): Users per Hiker followers page and per besties page.
+        seed (int): Seed of the fault injection, for reproducible runs.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    feedback_rate: float = 0.0
+    page_size: int = 100
+    seed: int = 0
+
+
+class StubState:
+    """The fake accounts, their close friends and the request counters, shared by the handler threads."""
+
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.accounts = {}
+        self.besties = defaultdict(set)
+        self.requests = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+        self._public_key = None
+
+    def add_account(self, username, pk, followers_count):
+        with self.lock:
+            self.accounts[username] = {'pk': pk, 'followers_count': followers_count}
+
+    def account_by_pk(self, pk):
+        return next((
+            (username, account) for username, account in self.accounts.items() if account['pk'] == pk
+        ), (None, None))
+
+    def roll(self, rate):
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def count(self, endpoint, status):
+        with self.lock:
+            self.requests[endpoint][str(status)] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': {endpoint: dict(statuses) for endpoint, statuses in self.requests.items()},
+                'besties': {pk: len(ids) for pk, ids in self.besties.items()},
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+
+    def public_key(self):
+        """Base64 PEM of an RSA key, served as Instagram's password encryption key."""
+
+        with self.lock:
+            if self._public_key is None:
+                from cryptography.hazmat.primitives import serialization
+                from cryptography.hazmat.primitives.asymmetric import rsa
+
+                key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+                pem = key.public_key().public_bytes(
+                    serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+                self._public_key = base64.b64encode(pem).decode()
+            return self._public_key
+
+
+def _authorization(pk):
+    payload = json.dumps({'ds_user_id': str(pk), 'sessionid': f'{pk}%3Abench%3A1'})
+    return f'Bearer IGT:2:{base64.b64encode(payload.encode()).decode()}'
+
+
+def _user(pk, username):
+    return {
+        'pk': str(pk), 'pk_id': str(pk), 'id': str(pk), 'username': username, 'full_name': username,
+        'is_private': False, 'is_verified': False, 'profile_pic_url': 'https://localhost/pic.jpg',
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the bot's connection pooling is measured too
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, endpoint, status, body, headers=None):
+        self.state.count(endpoint, status)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        # instagrapi signs the payload as signed_body=SIGNATURE.<json>
+        signed = form.get('signed_body')
+        if signed and '.' in signed:
+            form.update(json.loads(signed.split('.', 1)[1]))
+        return form
+
+    def _session_pk(self, form):
+        authorization = self.headers.get('Authorization') or ''
+        if authorization.startswith('Bearer IGT:2:'):
+            try:
+                return int(json.loads(base64.b64decode(authorization[13:]))['ds_user_id'])
+            except (ValueError, KeyError):
+                pass
+        uid = form.get('_uid')
+        return int(uid) if uid else None
+
+    def _delay(self):
+        config = self.state.config
+        if config.latency or config.jitter:
+            time.sleep(max(0.0, random.gauss(config.latency, config.jitter)))
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        self._handle(self._read_form())
+
+    def _handle(self, form):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self._delay()
+
+        if url.path.startswith(INSTAGRAM_PREFIX):
+            endpoint = url.path[len(INSTAGRAM_PREFIX):]
+            if self.state.roll(self.state.config.error_rate):
+                return self._send(endpoint, 500, {'message': 'Injected server error', 'status': 'fail'})
+            return self._instagram(endpoint, {**query, **form})
+
+        if self.state.roll(self.state.config.error_rate):
+            return self._send(url.path, 500, {'detail': 'Injected server error'})
+        if url.path == HIKER_USER_BY_USERNAME:
+            return self._hiker_user(query)
+        if url.path == HIKER_FOLLOWERS:
+            return self._hiker_followers(query)
+        return self._send(url.path, 404, {'detail': 'Not found'})
+
+    # Hiker
+
+    def _hiker_user(self, query):
+        account = self.state.accounts.get(query.get('username'))
+        if account is None:
+            return self._send(HIKER_USER_BY_USERNAME, 404, {'detail': 'User not found'})
+        return self._send(HIKER_USER_BY_USERNAME, 200, _user(account['pk'], query['username']))
+
+    def _hiker_followers(self, query):
+        _, account = self.state.account_by_pk(int(query.get('user_id', 0)))
+        if account is None:
+            return self._send(HIKER_FOLLOWERS, 404, {'detail': 'User not found'})
+
+        page_size = self.state.config.page_size
+        page = int(query.get('page_id') or 0)
+        start = page * page_size
+        end = min(start + page_size, account['followers_count'])
+        first_id = FOLLOWER_ID_BASE + account['pk'] * ACCOUNT_ID_SPAN
+        users = [{'id': str(first_id + index), 'username': f'follower{index}'} for index in range(start, end)]
+
+        return self._send(HIKER_FOLLOWERS, 200, {
+            'response': {'users': users},
+            'next_page_id': str(page + 1) if end < account['followers_count'] else None,
+        })
+
+    # Instagram private API
+
+    def _instagram(self, endpoint, form):
+        if endpoint in ('qe/sync/', 'launcher/sync/'):
+            return self._send(endpoint, 200, {'status': 'ok'}, {
+                'ig-set-password-encryption-key-id': '41',
+                'ig-set-password-encryption-pub-key': self.state.public_key(),
+            })
+        if endpoint == 'accounts/login/':
+            return self._login(endpoint, form)
+
+        pk = self._session_pk(form)
+        if pk is None:
+            return self._send(endpoint, 403, {'message': 'login_required', 'status': 'fail'})
+
+        if endpoint == 'friendships/set_besties/':
+            return self._set_besties(endpoint, pk, form)
+        if endpoint == 'friendships/besties/':
+            return self._besties(endpoint, pk, form)
+        if endpoint == 'accounts/current_user/':
+            username, _ = self.state.account_by_pk(pk)
+            return self._send(endpoint, 200, {'user': _user(pk, username), 'status': 'ok'})
+
+        # Session checks and the rest of the login flow (feed/timeline/, feed/reels_tray/, ...)
+        return self._send(endpoint, 200, {'status': 'ok', 'feed_items': [], 'tray': [], 'more_available': False})
+
+    def _login(self, endpoint, form):
+        account = self.state.accounts.get(form.get('username'))
+        if account is None:
+            return self._send(endpoint, 400, {
+                'message': 'The password you entered is incorrect.', 'error_type': 'bad_password', 'status': 'fail',
+            })
+
+        pk = account['pk']
+        return self._send(endpoint, 200, {'logged_in_user': _user(pk, form['username']), 'status': 'ok'}, {
+            'ig-set-authorization': _authorization(pk),
+            'ig-set-ig-u-ds-user-id': str(pk),
+        })
+
+    def _set_besties(self, endpoint, pk, form):
+        if self.state.roll(self.state.config.throttle_rate):
+            return self._send(endpoint, 429, {'message': 'Please wait a few minutes before you try again.', 'status': 'fail'})
+        if self.state.roll(self.state.config.feedback_rate):
+            return self._send(endpoint, 400, {
+                'message': 'feedback_required', 'feedback_title': 'Try Again Later',
+                'feedback_message': 'We limit how often you can do certain things on Instagram.', 'spam': True, 'status': 'fail',
+            })
+
+        add = [str(user_id) for user_id in form.get('add') or []]
+        remove = [str(user_id) for user_id in form.get('remove') or []]
+        with self.state.lock:
+            besties = self.state.besties[pk]
+            besties.update(int(user_id) for user_id in add)
+            besties.difference_update(int(user_id) for user_id in remove)
+
+        statuses = {user_id: {'is_bestie': True} for user_id in add}
+        statuses.update({user_id: {'is_bestie': False} for user_id in remove})
+        return self._send(endpoint, 200, {'friendship_statuses': statuses, 'status': 'ok'})
+
+    def _besties(self, endpoint, pk, form):
+        page_size = self.state.config.page_size
+        start = int(form.get('max_id') or 0)
+        with self.state.lock:
+            ids = sorted(self.state.besties[pk])[start:start + page_size]
+            more = start + page_size < len(self.state.besties[pk])
+
+        return self._send(endpoint, 200, {
+            'users': [{'pk': str(user_id), 'username': f'bestie{user_id}'} for user_id in ids],
+            'next_max_id': str(start + page_size) if more else None,
+            'status': 'ok',
+        })
+
+
+class StubServer:
+    """
+    The stub server, run on a background thread of the benchmark process.
+    Attributes:
+        config (StubConfig): Latency and fault injection of the server.
+        port (int): Port to listen on, 0 for any free port.
+    """
+    def __init__(self, config=None, port=0):
+        self.config = config or StubConfig()
+        self.state = StubState(self.config)
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.state = self.state
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='stub-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_account(self, username, pk, followers_count):
+        self.state.add_account(username, pk, followers_count)
+
+    def stats(self):
+        return {'config': asdict(self.config), **self.state.stats()}
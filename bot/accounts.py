@@ -0,0 +1,269 @@
+import os
+import json
+import threading
+from abc import ABC, abstractmethod
+from decouple import config
+
+# users/ next to the project, the same directory as InstagramBot.base_data_dir
+USERS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../users'))
+
+
+class AccountStore(ABC):
+    """
+    Storage backend for the Instagram accounts linked by a user.
+    Account data is exchanged as plain dicts with the same keys as the legacy
+    accounts/<username>.json files (username, password, user_id, config,
+    followers_count, adding_to_close_friends, getting_followers).
+    Attributes:
+        user (str): The username of the bot operator owning the accounts.
+    """
+    def __init__(self, user):
+        self.user = user
+
+    @abstractmethod
+    def all(self):
+        """Return a dict of every account of the user keyed by Instagram username."""
+
+    @abstractmethod
+    def get(self, username):
+        """Return the account data for a username, or None if it does not exist."""
+
+    def exists(self, username):
+        return self.get(username) is not None
+
+    @abstractmethod
+    def version(self):
+        """Return a cheap value that changes whenever any account of the user changes."""
+
+    @abstractmethod
+    def create(self, username, account_data):
+        """Store a newly linked account."""
+
+    @abstractmethod
+    def save(self, username, account_data):
+        """Replace the stored account data for a username."""
+
+    @abstractmethod
+    def update(self, username, **fields):
+        """Update a few top level fields (e.g. a status flag) of an account."""
+
+    @abstractmethod
+    def rename(self, old_username, new_username):
+        """Move an account to its new Instagram username."""
+
+    @abstractmethod
+    def delete(self, username):
+        """Remove an account, doing nothing when it does not exist."""
+
+
+class FileAccountStore(AccountStore):
+    """Legacy backend storing every account in users/<user>/accounts/<username>.json."""
+
+    def __init__(self, user, accounts_dir):
+        super().__init__(user)
+        self.accounts_dir = accounts_dir
+
+    def _account_file(self, username):
+        return os.path.join(self.accounts_dir, f'{username}.json')
+
+    def all(self):
+        accounts = {}
+        if os.path.exists(self.accounts_dir):
+            for filename in os.listdir(self.accounts_dir):
+                if filename.endswith('.json'):
+                    username = filename[:-5]  # Remove '.json'
+                    with open(os.path.join(self.accounts_dir, filename), 'r') as f:
+                        accounts[username] = json.load(f)
+        return accounts
+
+    def get(self, username):
+        account_file = self._account_file(username)
+        if not os.path.exists(account_file):
+            return None
+        with open(account_file, 'r') as f:
+            return json.load(f)
+
+    def exists(self, username):
+        return os.path.exists(self._account_file(username))
+
+    def version(self):
+        if not os.path.exists(self.accounts_dir):
+            return None
+        with os.scandir(self.accounts_dir) as entries:
+            return tuple(sorted(
+                (entry.name, entry.stat().st_mtime_ns) for entry in entries if entry.name.endswith('.json')
+            ))
+
+    def create(self, username, account_data):
+        os.makedirs(self.accounts_dir, exist_ok=True)
+        self.save(username, account_data)
+
+    def save(self, username, account_data):
+        with open(self._account_file(username), 'w') as f:
+            json.dump(account_data, f)
+
+    def update(self, username, **fields):
+        account_data = self.get(username)
+        if account_data is not None:
+            account_data.update(fields)
+            self.save(username, account_data)
+
+    def rename(self, old_username, new_username):
+        old_account_file = self._account_file(old_username)
+        if os.path.exists(old_account_file):
+            os.rename(old_account_file, self._account_file(new_username))
+
+    def delete(self, username):
+        account_file = self._account_file(username)
+        if os.path.exists(account_file):
+            os.remove(account_file)
+
+
+class DatabaseAccountStore(AccountStore):
+    """
+    Backend storing accounts in the InstagramAccount table.
+    Status flips are single row UPDATEs and listing the accounts of a user is one
+    query on the (owner, ...) indexes, so concurrent workers no longer overwrite
+    each other's changes the way the read-modify-write of the JSON files did.
+    """
+
+    def _queryset(self):
+        from Core.models import InstagramAccount
+
+        return InstagramAccount.objects.filter(owner__username=self.user)
+
+    def all(self):
+        return {
+            account.username: account.as_dict()
+            for account in self._queryset().order_by('username')
+        }
+
+    def get(self, username):
+        account = self._queryset().filter(username=username).first()
+        return account.as_dict() if account is not None else None
+
+    def exists(self, username):
+        return self._queryset().filter(username=username).exists()
+
+    def version(self):
+        from django.db.models import Count, Max
+
+        version = self._queryset().aggregate(updated=Max('updated_when'), count=Count('id'))
+        return version['updated'], version['count']
+
+    def create(self, username, account_data):
+        from Core.models import InstagramAccount, User
+
+        InstagramAccount.objects.create(
+            owner=User.objects.get(username=self.user),
+            username=username,
+            password=account_data['password'],
+            user_id=account_data.get('user_id'),
+            config=account_data['config'],
+            followers_count=account_data.get('followers_count', 0),
+            adding_to_close_friends=account_data.get('adding_to_close_friends', False),
+            getting_followers=account_data.get('getting_followers', False),
+        )
+
+    def save(self, username, account_data):
+        self.update(
+            username,
+            password=account_data['password'],
+            user_id=account_data.get('user_id'),
+            config=account_data['config'],
+            followers_count=account_data.get('followers_count', 0),
+            adding_to_close_friends=account_data.get('adding_to_close_friends', False),
+            getting_followers=account_data.get('getting_followers', False),
+        )
+
+    def update(self, username, **fields):
+        from django.utils import timezone
+
+        # QuerySet.update() skips auto_now, so bump the timestamp explicitly
+        self._queryset().filter(username=username).update(updated_when=timezone.now(), **fields)
+
+    def rename(self, old_username, new_username):
+        self.update(old_username, username=new_username)
+
+    def delete(self, username):
+        self._queryset().filter(username=username).delete()
+
+
+def import_file_accounts(users, account_model, base_data_dir=USERS_DIR):
+    """
+    Copy the accounts/<username>.json files of the given users into the InstagramAccount
+    table (account_model), leaving the files in place, for the import_ig_accounts command.
+    Migration 0010 runs a frozen copy of this loop when upgrading. Returns the number of
+    accounts created.
+    """
+
+    imported = 0
+    for user in users:
+        accounts_dir = os.path.join(base_data_dir, f'{user.username}/accounts')
+        if not os.path.exists(accounts_dir):
+            continue
+
+        for filename in os.listdir(accounts_dir):
+            if not filename.endswith('.json'):
+                continue
+
+            with open(os.path.join(accounts_dir, filename), 'r') as f:
+                account_data = json.load(f)
+
+            _, created = account_model.objects.update_or_create(
+                owner=user,
+                username=filename[:-5],  # Remove '.json'
+                defaults={
+                    'password': account_data['password'],
+                    'user_id': account_data.get('user_id'),
+                    'config': account_data['config'],
+                    'followers_count': account_data.get('followers_count', 0),
+                    'adding_to_close_friends': account_data.get('adding_to_close_friends', False),
+                    'getting_followers': account_data.get('getting_followers', False),
+                }
+            )
+            imported += created
+    return imported
+
+
+def get_account_store(user, accounts_dir):
+    """Return the account store configured by the ACCOUNT_STORE_BACKEND setting ('database' or 'file')."""
+
+    backend = config('ACCOUNT_STORE_BACKEND', default='database')
+
+    if backend == 'database':
+        return DatabaseAccountStore(user)
+    if backend == 'file':
+        return FileAccountStore(user, accounts_dir)
+
+    raise ValueError(f"Unknown account store backend '{backend}'")
+
+
+class AccountRegistry:
+    """
+    Process-wide cache of the accounts of each user, kept in front of an AccountStore.
+    The cached accounts are reused for as long as the store's version() is unchanged, so
+    web requests only pay for a cheap version check instead of loading every account.
+    """
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, store):
+        self.store = store
+        self._key = (type(store).__name__, store.user)
+
+    def all(self):
+        version = self.store.version()
+
+        with self._lock:
+            cached = self._cache.get(self._key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        accounts = self.store.all()
+        with self._lock:
+            self._cache[self._key] = (version, accounts)
+        return accounts
+
+    def get(self, username):
+        return self.all().get(username)
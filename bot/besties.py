@@ -0,0 +1,70 @@
+from array import array
+from bisect import bisect_left
+
+SET_BESTIES_ENDPOINT = 'friendships/set_besties/'
+BESTIES_ENDPOINT = 'friendships/besties/'
+
+
+def set_besties(client, add=(), remove=()):
+    """
+    Add and remove close friends in a single friendships/set_besties/ request.
+    This is the request instagrapi's close_friend_add and close_friend_remove make for
+    one user id; the endpoint takes lists, so a whole group of followers costs one call.
+    Returns the ids of add that Instagram confirmed as close friends and the ids of
+    remove it confirmed as removed.
+    """
+
+    add = [str(user_id) for user_id in add]
+    remove = [str(user_id) for user_id in remove]
+    data = {
+        "block_on_empty_thread_creation": "false",
+        "module": "CLOSE_FRIENDS_V2_SEARCH",
+        "source": "audience_manager",
+        "_uid": client.user_id,
+        "_uuid": client.uuid,
+        "remove": remove,
+        "add": add,
+    }
+    result = client.private_request(SET_BESTIES_ENDPOINT, data)
+
+    statuses = result.get('friendship_statuses') or {}
+    added = {user_id for user_id in add if (statuses.get(user_id) or {}).get('is_bestie') is True}
+    removed = {user_id for user_id in remove if (statuses.get(user_id) or {}).get('is_bestie') is False}
+    return added, removed
+
+
+def fetch_besties(client):
+    """Return the account's current close friends as a sorted array of ids, following every page."""
+
+    ids = array('q')
+    max_id = None
+    while True:
+        result = client.private_request(BESTIES_ENDPOINT, params={'max_id': max_id} if max_id else None)
+        ids.extend(int(user['pk']) for user in result.get('users') or [])
+
+        max_id = result.get('next_max_id')
+        if not max_id:
+            break
+    return array('q', sorted(ids))
+
+
+def besties_delta(followers, besties):
+    """
+    Compare a follower list with the current close friends (a sorted array of ids).
+    Returns the followers that are not close friends yet, in follower list order, and
+    the close friends that are no longer followers. The followers are streamed once and
+    looked up by binary search in the besties array, marking the close friends they
+    match in a bytearray, so only int64 arrays and one byte per close friend are built.
+    """
+
+    following = bytearray(len(besties))
+    to_add = array('q')
+    for user_id in followers:
+        index = bisect_left(besties, user_id)
+        if index < len(besties) and besties[index] == user_id:
+            following[index] = 1
+        else:
+            to_add.append(user_id)
+
+    to_remove = array('q', (user_id for user_id, follows in zip(besties, following) if not follows))
+    return to_add, to_remove
@@ -2,17 +2,34 @@ from instagrapi import Client
 from instagrapi.exceptions import (
     LoginRequired, BadPassword, 
     BadCredentials, TwoFactorRequired, 
-    UnknownError, FeedbackRequired
+    UnknownError
 )
 import time
 import os
 import logging
-from dataclasses import dataclass, asdict
-import random
-from hikerapi import Client as HikerClient
-import json
+from typing import Optional
+from dataclasses import dataclass, asdict, replace
 from decouple import config
 
+from .accounts import AccountRegistry, get_account_store
+from .checkpoint import CloseFriendsCheckpoint
+from .crawler import FollowerCrawler
+from .hiker import ScrapeJob, PooledHikerClient, get_async_scraper
+from .client_pool import PooledClient, client_pool
+from .progress import JobProgress, SCRAPE_JOB, CLOSE_FRIENDS_JOB
+from .lease import enqueue_once, LeaseLost
+from . import metrics
+from .log import setup_logging
+from .close_friends import CloseFriendsRun, STOP_DONE, STOP_ERROR, PROXY_RETRY_DELAY, STEP_MAX_INLINE_WAIT
+from .history import record_job_run
+from .clock import system_clock
+from .proxies import NoProxyAvailable
+from .green import is_green, release_db_connection
+from .followers import (
+    FollowerList, HEADER_SIZE,
+    SOURCE_HIKER, SOURCE_INSTAGRAPI,
+    write_follower_list, convert_txt_followers
+)
 from Core.utils import (
     VERIFICATION_CODE_REQUIRED_FOR_ACCOUNT,
     TWO_FACTOR_REQUIRED_FOR_ACCOUNT,
@@ -31,6 +48,14 @@ ENDC = '\033[0m'
 BOLD = '\033[1m'
 UNDERLINE = '\033[4m'
 
+# BotConfig fields that fall back to a setting of the deployment: (setting, default, cast)
+DEPLOYMENT_SETTINGS = {
+    'close_friends_group_size': ('CLOSE_FRIENDS_GROUP_SIZE', 1, int),
+    'close_friends_sync': ('CLOSE_FRIENDS_SYNC', False, bool),
+    'close_friends_remove_stale': ('CLOSE_FRIENDS_REMOVE_STALE', False, bool),
+}
+
+
 @dataclass
 class BotConfig:
     """
@@ -41,12 +66,36 @@ class BotConfig:
         max_followers (int): Maximum number of followers to fetch.
         action_delay_min (int): Minimum delay between actions in seconds.
         action_delay_max (int): Maximum delay between actions in seconds.
+        close_friends_group_size (int): Number of followers added to close friends per request.
+        close_friends_sync (bool): Only add the followers that are not close friends yet.
+        close_friends_remove_stale (bool): In sync mode, also remove close friends that no longer follow.
+    The close_friends_* settings are None unless the account overrides them, and only
+    resolved() reads the deployment's value, when a run starts. None values are not
+    stored with the account, so changing the setting reaches every account.
     """
     followers_batch_size: int = 200
     batch_cooldown: int = 60
     max_followers: int = 100  # Default value
     action_delay_min: int = 2  # Minimum delay between actions
     action_delay_max: int = 5  # Maximum delay between actions
+    close_friends_group_size: Optional[int] = None
+    close_friends_sync: Optional[bool] = None
+    close_friends_remove_stale: Optional[bool] = None
+
+    def resolved(self):
+        """Return a copy with the settings the account does not override read from the environment."""
+
+        return replace(self, **{
+            name: config(setting, default=default, cast=cast)
+            for name, (setting, default, cast) in DEPLOYMENT_SETTINGS.items()
+            if getattr(self, name) is None
+        })
+
+    def overrides(self):
+        """The fields to store with the account, leaving out the settings it does not override."""
+
+        return {name: value for name, value in asdict(self).items() if value is not None}
+
 
 class InstagramChallengeRequired(Exception):
     """Exception raised when Instagram requires a verification code"""
@@ -59,24 +108,31 @@ class InstagramBot:
         user (str): The username of the bot operator.
         base_data_dir (str): Base directory for storing user data.
         hiker_token (str): Token for the Hiker API.
-        accounts_dir (str): Directory to store account data.
-        followers_path (str): Directory to store followers data.
-        last_added_path (str): Directory to store the last added follower.
+        accounts_dir (str): Directory to store account data (used by the file account store).
+        store (AccountStore): Backend holding the account details and status flags.
+        registry (AccountRegistry): Process-wide cache of the accounts in the store.
+        followers_path (str): Directory to store the follower lists (<username>.bin).
+        last_added_path (str): Directory to store the close friends checkpoints.
         cache_path (str): Directory to store session cache.
         accounts (dict): Dictionary to store account details.
+        clock (SystemClock): Clock the close friends runs read the time from and sleep on, a VirtualClock to simulate them.
+    Construction is cheap (no file or database reads), so web requests can build a bot
+    freely: accounts come from the cached registry and the Hiker token is read on use.
     """
-    def __init__(self, user=None):
+    record_history = True
+
+    def __init__(self, user=None, clock=None):
 
         self.user = user
+        self.clock = clock or system_clock
         self.base_data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../users'))
         self.user_account = os.path.join(self.base_data_dir, f'{self.user}')
-        self.hiker_token = config('HIKER_TOKEN')
         self.feedback_error_sleep_time = 1800
 
         if self.user is not None:
             self.accounts_dir = os.path.join(self.base_data_dir, f'{self.user}/accounts')
-
-            self.accounts = self._load_accounts()
+            self.store = get_account_store(self.user, self.accounts_dir)
+            self.registry = AccountRegistry(self.store)
 
             self.followers_path = os.path.join(self.base_data_dir, f'{self.user}/followers')
             self.last_added_path = os.path.join(self.base_data_dir, f'{self.user}/last_added')
@@ -94,25 +150,19 @@ class InstagramBot:
             os.makedirs(path, exist_ok=True)
 
     def _setup_logging(self):
-        """Configure logging for the bot."""
+        """Configure logging for the bot, once per process."""
 
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            filename=f'{self.base_data_dir}/bot.log'
-        )
+        setup_logging(self.base_data_dir)
 
-    def _load_accounts(self):
-        """Load account data from JSON files."""
+    @property
+    def hiker_token(self):
+        return config('HIKER_TOKEN')
 
-        accounts = {}
-        if os.path.exists(self.accounts_dir):
-            for filename in os.listdir(self.accounts_dir):
-                if filename.endswith('.json'):
-                    username = filename[:-5]  # Remove '.json'
-                    with open(os.path.join(self.accounts_dir, filename), 'r') as f:
-                        accounts[username] = json.load(f)
-        return accounts
+    @property
+    def accounts(self):
+        """Account data of the user keyed by Instagram username."""
+
+        return self.registry.all()
     
     def _get_account(self, username):
         """Retrieve account details for a given username."""
@@ -128,9 +178,9 @@ class InstagramBot:
         return os.path.exists(f'{self.base_data_dir}/{account}')
     
     def _ig_account_exists(self, username):
-        """Check if an Instagram account JSON file exists."""
+        """Check if an Instagram account is linked to the user."""
 
-        return os.path.exists(f'{self.accounts_dir}/{username}.json')
+        return self.store.exists(username)
 
     def custom_code_handler(self, username, choice=None):
         """Handle Instagram verification code requests."""
@@ -148,7 +198,7 @@ class InstagramBot:
 
         self.verification_code = verification_code
 
-        if self._account_exists(username):
+        if self._ig_account_exists(username):
             return False, "Esiste già un account con quel nome utente"
 
         # Create a temporary client to test login
@@ -187,14 +237,15 @@ class InstagramBot:
         account_data = {
             'username': username,
             'password': password,
-            'config': asdict(config),
+            # Resolved once here so Hiker scrapes never need to log in to Instagram
+            'user_id': int(temp_client.user_id),
+            'config': config.overrides(),
             'adding_to_close_friends': False,
             'getting_followers': False,
         }
 
         # Save user's account details
-        with open(os.path.join(self.user_account, f'accounts/{username}.json'), 'w') as f:
-            json.dump(account_data, f)
+        self.store.create(username, account_data)
 
         from Core.models import User
 
@@ -208,44 +259,33 @@ class InstagramBot:
         """Retrieve a list of all user accounts."""
 
         accounts = []
-        if self._account_exists(self.user):
-            for filename in os.listdir(self.accounts_dir):
-                if filename.endswith('.json'):
-                    username = filename[:-5]  # Remove '.json'
-                    with open(os.path.join(f'{self.base_data_dir}/{self.user}/accounts', filename), 'r') as f:
-                        account_data = json.load(f)
-                        followers_count = account_data.get('followers_count', 0)
-                        adding_to_close_friends = account_data.get('adding_to_close_friends', False)
-                        getting_followers = account_data.get('getting_followers', False)
-                        accounts.append({
-                            'username': username,
-                            'followers_count': followers_count,
-                            'adding_to_close_friends': adding_to_close_friends,
-                            'getting_followers': getting_followers
-                        })
+        for username, account_data in self.accounts.items():
+            accounts.append({
+                'username': username,
+                'followers_count': account_data.get('followers_count', 0),
+                'adding_to_close_friends': account_data.get('adding_to_close_friends', False),
+                'getting_followers': account_data.get('getting_followers', False)
+            })
         return accounts
     
     def _rename_account_files(self, old_username, new_username):
         """Rename all files associated with an account when the username changes."""
     
         try:
-            # Rename account file
-            old_account_file = os.path.join(self.accounts_dir, f'{old_username}.json')
-            new_account_file = os.path.join(self.accounts_dir, f'{new_username}.json')
-            if os.path.exists(old_account_file):
-                os.rename(old_account_file, new_account_file)
-
-            # Rename followers file
-            old_followers_file = os.path.join(self.followers_path, f'{old_username}.txt')
-            new_followers_file = os.path.join(self.followers_path, f'{new_username}.txt')
-            if os.path.exists(old_followers_file):
-                os.rename(old_followers_file, new_followers_file)
-
-            # Rename last_added file
-            old_last_added_file = os.path.join(self.last_added_path, f'{old_username}.txt')
-            new_last_added_file = os.path.join(self.last_added_path, f'{new_username}.txt')
-            if os.path.exists(old_last_added_file):
-                os.rename(old_last_added_file, new_last_added_file)
+            # Rename account record
+            self.store.rename(old_username, new_username)
+
+            # Rename followers files
+            for old_followers_file, new_followers_file in zip(self._all_followers_files(old_username), self._all_followers_files(new_username)):
+                if os.path.exists(old_followers_file):
+                    os.rename(old_followers_file, new_followers_file)
+
+            # Rename checkpoint files
+            old_checkpoint_files = CloseFriendsCheckpoint.files(self.last_added_path, old_username)
+            new_checkpoint_files = CloseFriendsCheckpoint.files(self.last_added_path, new_username)
+            for old_checkpoint_file, new_checkpoint_file in zip(old_checkpoint_files, new_checkpoint_files):
+                if os.path.exists(old_checkpoint_file):
+                    os.rename(old_checkpoint_file, new_checkpoint_file)
 
             # Rename cache file
             old_cache_file = os.path.join(self.cache_path, f'{old_username}_session.json')
@@ -270,20 +310,16 @@ class InstagramBot:
 
         self.verification_code = verification_code
 
-        account_file = os.path.join(self.accounts_dir, f"{old_username}.json")
+        account_data = self.store.get(old_username)
 
-        # Check if the account file exists
-        if not os.path.exists(account_file):
+        # Check if the account exists
+        if account_data is None:
             return False, f"Account '{old_username}' non esiste."
 
         # Ensure username is provided
         if username is None:
             return False, "Il campo Nome utente non può essere lasciato vuoto."
         try:
-            # Load the existing account data
-            with open(account_file, "r") as f:
-                account_data = json.load(f)
-
             # Validate credentials if username or password is being updated
             if account_data["username"] != username or (
                 password is not None and account_data["password"] != password
@@ -303,6 +339,7 @@ class InstagramBot:
                     # Save the new session if credentials are valid
                     cache_path = f"{self.user_account}/cache/{username or old_username}_session.json"
                     temp_client.dump_settings(cache_path)
+                    account_data["user_id"] = int(temp_client.user_id)
 
                 except InstagramChallengeRequired:
                     return False, VERIFICATION_CODE_REQUIRED_FOR_ACCOUNT
@@ -326,10 +363,11 @@ class InstagramBot:
             if number_of_followers is not None:
                 account_data["config"]["max_followers"] = number_of_followers
 
-            # Save the updated account data back to the file
-            new_account_file = os.path.join(self.accounts_dir, f"{username or old_username}.json")
-            with open(new_account_file, "w") as f:
-                json.dump(account_data, f, indent=4)
+            # Save the updated account data back to the store
+            self.store.save(username or old_username, account_data)
+
+            # Pooled clients of this worker still hold the old credentials
+            client_pool.discard_account(self.user, old_username)
 
             logging.info(f"Account '{username or old_username}' updated successfully.")
             return True, f"Account '{username or old_username}'aggiornato con successo."
@@ -340,72 +378,93 @@ class InstagramBot:
         
     def update_adding_to_close_friends_status(self, username, status):
        
-        account_file = os.path.join(self.accounts_dir, f'{username}.json')
-        if os.path.exists(account_file):
-            with open(account_file, 'r') as f:
-                account_data = json.load(f)
-            account_data['adding_to_close_friends'] = status
-            with open(account_file, 'w') as f:
-                json.dump(account_data, f)
+        self.store.update(username, adding_to_close_friends=status)
 
     def update_getting_followers_status(self, username, status):
        
-        account_file = os.path.join(self.accounts_dir, f'{username}.json')
-        if os.path.exists(account_file):
-            with open(account_file, 'r') as f:
-                account_data = json.load(f)
-            account_data['getting_followers'] = status
-            with open(account_file, 'w') as f:
-                json.dump(account_data, f)
+        self.store.update(username, getting_followers=status)
         
-    def _initialize_client(self, username, add_to_close_friends_mode=False) -> Client:
-        client = Client()
-        client.delay_range = [1, 5]
-
-        if add_to_close_friends_mode:
-            proxy_login = config('PROXY_LOGIN')
-            proxy_password = config('PROXY_PASSWORD')
-            proxy_host = config('PROXY_HOST')
-            proxy_port = config('PROXY_PORT')
-            
-            proxy_url = f"http://{proxy_login}:{proxy_password}@{proxy_host}:{proxy_port}"
-            client.set_proxy(proxy_url)
+    def _initialize_client(self, username, add_to_close_friends_mode=False, proxy=None) -> Client:
+        """
+        Return a logged-in client for the account, reusing the worker's pooled client when
+        there is one. The session is only checked again once it is older than the pool's
+        TTL, and the session file is only rewritten when the settings changed. With a
+        proxy from the proxy pool, the client's requests go through it.
+        """
+
+        pool_key = (self.user, username, add_to_close_friends_mode)
+        session_file = f'{self.cache_path}/{username}_session.json'
+
+        pooled = client_pool.get(pool_key)
+        if pooled is not None and proxy is not None and pooled.client.proxy != proxy.url:
+            # The account was moved to another proxy since the client was pooled
+            pooled.client.set_proxy(proxy.url)
+
+        if pooled is not None and not pooled.is_stale(client_pool.session_ttl):
+            self.user_id = pooled.client.user_id
+            return pooled.client
 
         try:
-            if os.path.exists(f'{self.cache_path}/{username}_session.json') and os.path.getsize(f'{self.cache_path}/{username}_session.json') > 0:
-                session = client.load_settings(f'{self.cache_path}/{username}_session.json')
-                if session:
-                    client.set_settings(session)
-                    self._validate_session(client)
-            else:
-                self._login_with_credentials(client)
+            if pooled is None:
+                pooled = self._create_client(session_file, proxy)
 
-            client.dump_settings(f'{self.cache_path}/{username}_session.json')
+            validated = pooled.is_stale(client_pool.session_ttl)
+            if validated:
+                self._validate_session(pooled.client)
+                pooled.validated_at = time.time()
 
-            self.user_id = client.user_id
-            return client
-            
+            settings = pooled.client.get_settings()
+            if settings != pooled.settings:
+                pooled.client.dump_settings(session_file)
+                pooled.settings = settings
+            elif validated:
+                # The session file mtime tells other workers when the session was last checked
+                os.utime(session_file)
+
+            client_pool.put(pool_key, pooled)
+
+            self.user_id = pooled.client.user_id
+            return pooled.client
 
         except BadPassword as e:
+            client_pool.discard(pool_key)
             logging.error(f"Login failed: {e}")
             logging.info(f"🤖 -> {FAIL}Incorrect username or password. Please reset the account.{ENDC}")
            
-            # Delete the account's JSON file
-            account_file = os.path.join(self.accounts_dir, f'{self.username}.json')
-            if os.path.exists(account_file):
-                os.remove(account_file)
+            # Delete the account's record
+            self.store.delete(self.username)
             raise  # Re-raise the exception to stop further execution
         except Exception as e:
+            client_pool.discard(pool_key)
             logging.error(f"Failed to initialize client: {e}")
             raise
 
+    def _create_client(self, session_file, proxy=None) -> PooledClient:
+        """Build a client from the cached session file, or log in with the account's credentials."""
+
+        client = Client()
+        client.delay_range = [1, 5]
+
+        if proxy is not None:
+            client.set_proxy(proxy.url)
+
+        if os.path.exists(session_file) and os.path.getsize(session_file) > 0:
+            session = client.load_settings(session_file)
+            if session:
+                client.set_settings(session)
+                return PooledClient(client, os.path.getmtime(session_file), settings=client.get_settings())
+
+        self._login_with_credentials(client)
+        return PooledClient(client, time.time())
+
     def _initialize_credentials(self, username):
         self.username, self.password, self.config = self._get_account(username)
         self.client = self._initialize_client(username)
 
     def _validate_session(self, client: Client):
+        """Check a session with a single authenticated request, logging in again only if it expired."""
+
         try:
-            client.login(self.username, self.password)
             client.get_timeline_feed()
         except LoginRequired:
             logging.warning("Session invalid, performing fresh login")
@@ -416,67 +475,106 @@ class InstagramBot:
 
     def _login_with_credentials(self, client: Client):
         logging.info(f"Logging in as {self.username}")
+        started = time.monotonic()
         try:
             if not client.login(self.username, self.password):
                 raise Exception("Failed to login with credentials")
+            metrics.LOGIN_SECONDS.observe(time.monotonic() - started, tenant=self.user, account=self.username, outcome='ok')
         except BadPassword as e:
+            metrics.LOGIN_SECONDS.observe(time.monotonic() - started, tenant=self.user, account=self.username, outcome='bad_password')
             logging.error(f"Login failed: {e}")
             logging.info(f"🤖 -> {FAIL}Incorrect username or password. Please try again.{ENDC}")
            
-            # Delete the account's JSON file if it exists
-            account_file = os.path.join(self.accounts_dir, f'{self.username}.json')
-            if os.path.exists(account_file):
-                os.remove(account_file)
+            # Delete the account's record if it exists
+            self.store.delete(self.username)
             raise  # Re-raise the exception to stop further execution
+        except Exception:
+            metrics.LOGIN_SECONDS.observe(time.monotonic() - started, tenant=self.user, account=self.username, outcome='error')
+            raise
 
     def initialise_scrape_followers_task(self, username):
-        if os.path.exists(f'{self.followers_path}/{username}.txt') and os.path.getsize(f'{self.followers_path}/{username}.txt') > 0:
+        if self._has_followers(username):
             return False, f"Follower già raccolti per {username}. Per ottenere nuovamente follower, reimposta i follower di questo account."
         
         from Core.tasks import get_account_followers
-        
-        get_account_followers.delay(user=self.user, username=username)
+
+        task_id, enqueued = enqueue_once(get_account_followers, self.user, username, SCRAPE_JOB)
+        if not enqueued:
+            return True, f"Raccolta di follower già in corso per {username} (job {task_id})."
         return True, f"Raccolta di follower avviata con successo per {username}."
         
+    def _get_ig_user_id(self, username):
+        """Return the numeric Instagram user id stored with the account, looking it up on Hiker for older accounts."""
+
+        user_id = self.accounts[username].get('user_id')
+        if user_id is None:
+            user_id = int(PooledHikerClient(self.hiker_token).user_by_username_v1(username)['pk'])
+            self.store.update(username, user_id=user_id)
+        return user_id
+
     def get_followers_via_hiker(self, username):
-        self._initialize_credentials(username)
-        hiker_client = HikerClient(token=self.hiker_token)
-        
-        followers = []
-        
-        self.update_getting_followers_status(username, True)
-        next_page_id = None
+        # Hiker only needs the numeric user id, so no Instagram login is made here
+        self.username, self.password, self.config = self._get_account(username)
+        self.user_id = self._get_ig_user_id(username)
 
-        while len(followers) < self.config.max_followers:
-        
-            get_followers = hiker_client.user_followers_v2(user_id=self.user_id, page_id=next_page_id)
+        progress = JobProgress(self.user, username, SCRAPE_JOB, total=self.config.max_followers)
 
-            for follower in get_followers["response"]["users"]:
-                followers.append(follower)
-            
-            next_page_id = get_followers["next_page_id"]
-        
-        followers_list = followers[:self.config.max_followers]
-        
-        self._save_followers_from_hiker(followers_list)
-        self.update_getting_followers_status(username, False)
+        self.update_getting_followers_status(username, True)
+        started = time.time()
+        lease_lost = False
+        try:
+            if config('HIKER_SCRAPE_MODE', default='sync') == 'async':
+                followers_count = self._get_followers_via_async_hiker(username, progress)
+            else:
+                followers_count = self._get_followers_via_sync_hiker(username, progress)
 
-    def _save_followers_from_hiker(self, followers):
-        
-        followers_count = len(followers)
-        with open(f'{self.followers_path}/{self.username}.txt', 'w') as f:
-            for follower in followers:
-                f.write(f"{follower.get('id')}\n")
-                logging.info(f"🤖 -> {OKCYAN}Saved username{ENDC}: {WARNING}{follower.get('username')}{ENDC}")
-
-        # Update the account's JSON file to include the number of followers
-        account_file = os.path.join(self.accounts_dir, f'{self.username}.json')
-        if os.path.exists(account_file):
-            with open(account_file, 'r') as f:
-                account_data = json.load(f)
-            account_data['followers_count'] = followers_count
-            with open(account_file, 'w') as f:
-                json.dump(account_data, f)
+            logging.info(f"🤖 -> {OKCYAN}Saved {followers_count} followers{ENDC}: {WARNING}{username}{ENDC}")
+
+            # Update the account's record to include the number of followers
+            self.store.update(username, followers_count=followers_count)
+            progress.finish()
+            record_job_run(self.user, username, SCRAPE_JOB, started, items=followers_count, stop_reason=STOP_DONE)
+        except LeaseLost:
+            # Another task took the scrape over, its progress and status are left alone
+            lease_lost = True
+            raise
+        except BaseException as e:
+            progress.error(e)
+            progress.finish('stopped')
+            record_job_run(self.user, username, SCRAPE_JOB, started, stop_reason=STOP_ERROR, error=f'{type(e).__name__}: {e}')
+            raise
+        finally:
+            if not lease_lost:
+                self.update_getting_followers_status(username, False)
+
+    def _get_followers_via_sync_hiker(self, username, progress=None):
+        # Shares the worker's kept-alive Hiker connections with every other scrape
+        hiker_client = PooledHikerClient(self.hiker_token)
+
+        def fetch_page(page_id):
+            with metrics.HIKER_PAGE_SECONDS.time(tenant=self.user, account=username):
+                get_followers = hiker_client.user_followers_v2(user_id=self.user_id, page_id=page_id)
+            users = get_followers["response"]["users"]
+            metrics.FOLLOWERS_RECEIVED.inc(len(users), tenant=self.user, account=username)
+            return users, get_followers.get("next_page_id")
+
+        # Pages are written as they arrive, a killed task resumes from the saved cursor
+        crawler = FollowerCrawler(self.followers_path, username, self.config.max_followers, SOURCE_HIKER, progress)
+        return crawler.run(fetch_page)
+
+    def _get_followers_via_async_hiker(self, username, progress=None):
+        """Hand the scrape to the process-wide asyncio engine, which multiplexes many accounts."""
+
+        job = ScrapeJob(
+            user=self.user,
+            username=username,
+            user_id=self.user_id,
+            max_followers=self.config.max_followers,
+            followers_path=self.followers_path,
+            api_key=self.hiker_token,
+            progress=progress,
+        )
+        return get_async_scraper().scrape(job)
     
     def get_followers_via_instagrapi(self, username):
         self._initialize_credentials(username)
@@ -494,122 +592,210 @@ class InstagramBot:
             logging.error(f"Failed to fetch followers: {e}")
 
     def _save_followers_from_instagrapi(self, followers):
-        followers_count = len(followers)
-        with open(f'{self.followers_path}/{self.username}.txt', 'w') as f:
-            for uid, user in followers.items():
-                f.write(f'{uid}\n')
-                logging.info(f"🤖 -> {OKCYAN}Saved username{ENDC}: {WARNING}{user.username}{ENDC}")
-
-        # Update the account's JSON file to include the number of followers
-        account_file = os.path.join(self.accounts_dir, f'{self.username}.json')
-        if os.path.exists(account_file):
-            with open(account_file, 'r') as f:
-                account_data = json.load(f)
-            account_data['followers_count'] = followers_count
-            with open(account_file, 'w') as f:
-                json.dump(account_data, f)
+        for user in followers.values():
+            logging.info(f"Saved username: {user.username}", extra={'sample': True})
+
+        followers_file, _ = self._followers_files(self.username)
+        followers_count = write_follower_list(followers_file, followers.keys(), SOURCE_INSTAGRAPI)
+
+        # Update the account's record to include the number of followers
+        self.store.update(self.username, followers_count=followers_count)
 
     def intialize_close_friends_add(self, username):
 
-        if not os.path.exists(f'{self.followers_path}/{username}.txt') or os.path.getsize(f'{self.followers_path}/{username}.txt') == 0: 
+        if not self._has_followers(username):
             return False, "Nessun follower trovato. Seleziona 'Ottieni follower' prima di poter aggiungere follower agli amici più stretti."
 
-        from Core.tasks import add_followers_to_close_freinds
-        
-        add_followers_to_close_freinds.delay(user=self.user, username=username)
+        from Core.tasks import add_followers_to_close_freinds, close_friends_step, add_close_friends_batch
+
+        # 'scheduled' hands the account back to the queue between actions instead of sleeping in the worker,
+        # 'batched' runs every batch as its own task and enqueues the next one after the cooldown
+        task_mode = config('CLOSE_FRIENDS_TASK_MODE', default='loop')
+        if task_mode == 'scheduled':
+            task = close_friends_step
+        elif task_mode == 'batched':
+            task = add_close_friends_batch
+        else:
+            task = add_followers_to_close_freinds
+
+        task_id, enqueued = enqueue_once(task, self.user, username, CLOSE_FRIENDS_JOB)
+        if not enqueued:
+            return True, f"Aggiunta agli amici più stretti già in corso per {username} (job {task_id})."
         return True, f"Aggiunta di follower di {username} agli amici più stretti."
 
-    def add_to_close_friends(self, username):
+    def _start_close_friends_run(self, username, offset=None, last_id=None):
+        """
+        Build the CloseFriendsRun of an account. The run logs in, reads the follower list
+        and, in sync mode, fetches the besties list, so when any of that fails the account
+        is no longer marked as adding to close friends.
+        """
 
-        self.username, self.password, self.config = self._get_account(username)
-        self.client = self._initialize_client(username, add_to_close_friends_mode=True)
-        
-        followers = self._read_followers(username)
-        last_added = self._get_last_added(username)
+        try:
+            return CloseFriendsRun(self, username, offset=offset, last_id=last_id)
+        except NoProxyAvailable:
+            raise
+        except Exception:
+            self.update_adding_to_close_friends_status(username, False)
+            raise
 
-        if last_added:
-            last_index = followers.index(last_added)
-            followers = followers[last_index + 1:]
+    def add_to_close_friends(self, username):
+        """
+        Add the account's followers to close friends in one long run, sleeping between actions
+        and through soft block pauses. Returns None, or the number of seconds after which to
+        try again when every proxy is down or full.
+        """
 
         logging.info(f"🤖 -> {HEADER}Adding followers to Close Friends{ENDC}: {WARNING}{username}...{ENDC}")
 
-        batch_size = self.config.followers_batch_size
-        total_followers = len(followers)
+        try:
+            run = self._start_close_friends_run(username)
+        except NoProxyAvailable as e:
+            logging.warning(e)
+            return PROXY_RETRY_DELAY
+        self.update_adding_to_close_friends_status(username, True)
+
+        # The loop itself does not touch the database, don't hold a connection per greenlet for hours
+        if is_green():
+            release_db_connection()
+
+        try:
+            run.run()
+        except LeaseLost:
+            raise
+        except Exception as e:
+            logging.exception(f"Error: {e}")
+            run.fail(e)
+        finally:
+            run.close()
+            if not run.lease_lost:
+                self.update_adding_to_close_friends_status(username, False)
+
+    def close_friends_step(self, username, max_inline_wait=None, max_duration=600):
+        """
+        Add followers to close friends for up to max_duration seconds, sleeping through the
+        gaps between actions, and return as soon as the next action is further away than
+        max_inline_wait (a batch cooldown or a soft block pause) with the number of seconds
+        until it is due (None once the run is over), so the worker can reschedule the
+        account instead of sleeping. max_inline_wait defaults to the longest gap the
+        scheduler leaves between two actions, up to STEP_MAX_INLINE_WAIT.
+        """
 
+        try:
+            run = self._start_close_friends_run(username)
+        except NoProxyAvailable as e:
+            logging.warning(e)
+            return PROXY_RETRY_DELAY
         self.update_adding_to_close_friends_status(username, True)
+
+        if max_inline_wait is None:
+            max_inline_wait = min(run.scheduler.max_action_gap(), STEP_MAX_INLINE_WAIT)
+
         try:
-            stop_processing = False
-            for i in range(0, total_followers, batch_size):
-
-                if stop_processing:
-                    break
-
-                batch = followers[i:i + batch_size]
-                logging.info(f"🤖 -> {OKCYAN}Processing batch {i // batch_size + 1}/{-(-total_followers // batch_size)}{ENDC}")
-
-                for follower in batch:
-                    try:
-                        self.client.close_friend_add(user_id=follower)
-                        logging.info(f"Added {follower} to Close Friends\n")
-                        self._save_last_added(username, follower)
-                        time.sleep(random.uniform(self.config.action_delay_min, self.config.action_delay_max))
-
-                    except FeedbackRequired as e:
-                        self.update_adding_to_close_friends_status(username, False)
-                        logging.error(f"Feedback required: {e}")
-                        stop_processing = True
-                        break
-
-                    except Exception as e:
-                        self.update_adding_to_close_friends_status(username, False)
-                        logging.error(f"Failed to add {follower}: {e}")
-                        stop_processing = True
-                        break
-
-                cooldown = random.uniform(self.config.batch_cooldown, self.config.batch_cooldown * 2)
-                logging.info(f"Cooling down for {cooldown:.2f} seconds...")
-                time.sleep(cooldown)
+            next_step = run.run(max_inline_wait=max_inline_wait, max_duration=max_duration)
+        except LeaseLost:
+            raise
+        except Exception as e:
+            logging.exception(f"Error: {e}")
+            run.fail(e)
+            next_step = None
+        finally:
+            run.close()
 
+        if next_step is None:
             self.update_adding_to_close_friends_status(username, False)
+        return next_step
+
+    def add_close_friends_batch(self, username, offset=None, last_id=None):
+        """
+        Add one batch of followers to close friends, resuming from the checkpoint carried
+        by the previous batch task. Returns (cooldown, offset, last_id) for the next batch,
+        or None once the run is over.
+        """
+
+        try:
+            run = self._start_close_friends_run(username, offset=offset, last_id=last_id)
+        except NoProxyAvailable as e:
+            logging.warning(e)
+            return PROXY_RETRY_DELAY, offset, last_id
+        self.update_adding_to_close_friends_status(username, True)
+
+        try:
+            cooldown = run.run(max_batches=1)
+        except LeaseLost:
+            raise
         except Exception as e:
+            logging.exception(f"Error: {e}")
+            run.fail(e)
+            cooldown = None
+        finally:
+            run.close()
+
+        if cooldown is None:
             self.update_adding_to_close_friends_status(username, False)
-            logging.info("Error: ", e)
+            return None
+        return cooldown, run.checkpoint.offset, run.checkpoint.last_id
+
+    def _followers_files(self, username):
+        """Return the follower list file and the legacy one-id-per-line text file of an account."""
+
+        return (
+            os.path.join(self.followers_path, f'{username}.bin'),
+            os.path.join(self.followers_path, f'{username}.txt'),
+        )
+
+    def _all_followers_files(self, username):
+        """Return the follower lists of an account along with any unfinished scrape state."""
+
+        return (
+            list(self._followers_files(username))
+            + [self._sync_followers_file(username), self._stale_followers_file(username)]
+            + FollowerCrawler.files(self.followers_path, username)
+        )
+
+    def _sync_followers_file(self, username):
+        """Return the list of followers a close friends sync still has to add."""
+
+        return os.path.join(self.followers_path, f'{username}.sync.bin')
+
+    def _stale_followers_file(self, username):
+        """Return the list of close friends that no longer follow, which a close friends sync removes."""
+
+        return os.path.join(self.followers_path, f'{username}.stale.bin')
+
+    def _has_followers(self, username):
+        followers_file, legacy_file = self._followers_files(username)
+
+        if os.path.exists(followers_file):
+            return os.path.getsize(followers_file) > HEADER_SIZE
+        return os.path.exists(legacy_file) and os.path.getsize(legacy_file) > 0
+
+    def _read_followers(self, username) -> FollowerList:
+        """Memory-map the follower list of an account, converting a legacy .txt list on first use."""
 
-    def _read_followers(self, username):
-        with open(f'{self.followers_path}/{username}.txt', 'r') as f:
-            return f.read().splitlines()
+        followers_file, legacy_file = self._followers_files(username)
 
-    def _get_last_added(self, username):
-        if os.path.exists(f'{self.last_added_path}/{username}.txt'):
-            with open(f'{self.last_added_path}/{username}.txt', 'r') as f:
-                return f.read().strip()
-        return ""
+        if not os.path.exists(followers_file) and os.path.exists(legacy_file):
+            convert_txt_followers(legacy_file, followers_file)
+            os.remove(legacy_file)
 
-    def _save_last_added(self, username, user_id):
-        with open(f'{self.last_added_path}/{username}.txt', 'w') as f:
-            f.write(user_id)
+        return FollowerList(followers_file)
 
     def reset_user_followers(self, username) -> None:
 
         self.username, self.password, self.config = self._get_account(username)
         max_followers = self.config.max_followers
 
-        if os.path.exists(f'{self.followers_path}/{self.username}.txt'):
-            os.remove(f'{self.followers_path}/{self.username}.txt')
+        for followers_file in self._all_followers_files(self.username):
+            if os.path.exists(followers_file):
+                os.remove(followers_file)
 
         # removed last added incase user wants to get more followers. Script will remember where it stopped
 
         # if os.path.exists(f'{self.last_added_path}/{self.username}.txt'):
         #     os.remove(f'{self.last_added_path}/{self.username}.txt')
 
-        # Update the account's JSON file to include the number of followers
-        account_file = os.path.join(self.accounts_dir, f'{self.username}.json')
-        if os.path.exists(account_file):
-            with open(account_file, 'r') as f:
-                account_data = json.load(f)
-            account_data['followers_count'] = 0
-            with open(account_file, 'w') as f:
-                json.dump(account_data, f)
+        # Reset the number of followers on the account's record
+        self.store.update(self.username, followers_count=0)
 
         from Core.models import User
 
@@ -631,17 +817,19 @@ class InstagramBot:
             user.current_allocation -= self.config.max_followers
             user.save()
 
-            if os.path.exists(f'{self.accounts_dir}/{username}.json'):
-                os.remove(f'{self.accounts_dir}/{username}.json')
+            self.store.delete(username)
+            client_pool.discard_account(self.user, username)
 
             if os.path.exists(f'{self.cache_path}/{username}_session.json'):
                 os.remove(f'{self.cache_path}/{username}_session.json')
 
-            if os.path.exists(f'{self.followers_path}/{username}.txt'):
-                os.remove(f'{self.followers_path}/{username}.txt')
+            for followers_file in self._all_followers_files(username):
+                if os.path.exists(followers_file):
+                    os.remove(followers_file)
 
-            if os.path.exists(f'{self.last_added_path}/{username}.txt'):
-                os.remove(f'{self.last_added_path}/{username}.txt')
+            for checkpoint_file in CloseFriendsCheckpoint.files(self.last_added_path, username):
+                if os.path.exists(checkpoint_file):
+                    os.remove(checkpoint_file)
 
             return True, f"Account '{username}' eliminato con successo"
         
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+
+
+class CloseFriendsCheckpoint:
+    """
+    Resumable position of the close friends add loop of one Instagram account.
+    Two files are kept in the account's last_added directory:
+        <username>.pos      JSON with the offset into the followers list, the last processed id and
+                            the number of stale close friends removed, replaced atomically on every commit.
+        <username>.journal  The ids of the group being committed, one "<offset> <id>" line each.
+    Processed ids are buffered and committed in groups: journal append + fsync, then the
+    position file, then the journal is truncated. A checkpoint loaded after a crash between
+    the journal and the position write replays the journal past the stored offset, so the
+    journal never holds more than one group. A crash before the journal write loses at
+    most one group, re-adding those followers is harmless since adding an existing close
+    friend is a no-op on Instagram.
+    Attributes:
+        directory (str): Directory holding the checkpoint files (users/<user>/last_added).
+        username (str): The Instagram username the checkpoint belongs to.
+        commit_every (int): Number of processed ids buffered before a group commit.
+        commit_interval (float): Maximum number of seconds between two group commits.
+        clock (callable): Monotonic clock commit_interval is measured with, the run's clock in a simulation.
+        offset (int): Index of the next follower to process.
+        last_id (str): The last processed follower id.
+        removed (int): Number of stale close friends removed from the sync mode's stale list.
+    """
+    def __init__(self, directory, username, commit_every=20, commit_interval=30, clock=time.monotonic):
+        self.directory = directory
+        self.username = username
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.clock = clock
+
+        self.position_file = os.path.join(directory, f'{username}.pos')
+        self.journal_file = os.path.join(directory, f'{username}.journal')
+        self.legacy_file = os.path.join(directory, f'{username}.txt')
+
+        self.offset = 0
+        self.last_id = ''
+        self.removed = 0
+        self._pending = []
+        self._last_commit = self.clock()
+        self._journal = None
+
+        self._load()
+
+    @staticmethod
+    def files(directory, username):
+        """Return every file a checkpoint may create for an account."""
+
+        return [os.path.join(directory, f'{username}{suffix}') for suffix in ('.pos', '.journal', '.txt')]
+
+    def _load(self):
+        if os.path.exists(self.position_file):
+            with open(self.position_file, 'r') as f:
+                position = json.load(f)
+            self.offset = position.get('offset', 0)
+            self.last_id = position.get('last_id', '')
+            self.removed = position.get('removed', 0)
+
+        elif os.path.exists(self.legacy_file):
+            # Checkpoints written before the offset existed only store the last added id
+            with open(self.legacy_file, 'r') as f:
+                self.last_id = f.read().strip()
+            self.offset = -1
+            return
+
+        self._replay_journal()
+
+    def _replay_journal(self):
+        """Move past the ids journaled by a group commit whose position write never happened."""
+
+        if not os.path.exists(self.journal_file):
+            return
+
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    # A line torn by the crash, or written before the journal had offsets
+                    continue
+                offset, user_id = int(parts[0]), parts[1]
+                if offset >= self.offset:
+                    self.offset, self.last_id = offset + 1, user_id
+
+    def resume_offset(self, followers):
+        """
+        Return the index in followers to resume from.
+        The stored offset is used directly when the follower before it is still the last
+        processed id. Otherwise (legacy checkpoint or the list was scraped again) the last
+        id is looked up once, and if it is gone the run starts over from the beginning.
+        """
+
+        if not self.last_id:
+            return 0
+
+        if 0 < self.offset <= len(followers) and str(followers[self.offset - 1]) == self.last_id:
+            return self.offset
+
+        for index, follower in enumerate(followers):
+            if str(follower) == self.last_id:
+                self.offset = index + 1
+                return self.offset
+
+        logging.warning(f"Last added follower {self.last_id} of {self.username} is no longer in the followers list, starting over")
+        self.offset = 0
+        return 0
+
+    def record(self, user_id):
+        """Mark the follower at the current offset as processed."""
+
+        self._pending.append(f'{self.offset} {user_id}')
+        self.offset += 1
+        self.last_id = str(user_id)
+
+        if len(self._pending) >= self.commit_every or self.clock() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        """Durably write the buffered ids to the journal, then the new position, then empty the journal."""
+
+        if self._pending:
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a')
+            self._journal.write('\n'.join(self._pending) + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending = []
+
+        tmp_file = f'{self.position_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'offset': self.offset, 'last_id': self.last_id, 'removed': self.removed}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.position_file)
+
+        # The position covers the group now (or was reset), the journal only ever holds the one being committed
+        if self._journal is not None:
+            self._journal.truncate(0)
+        elif os.path.exists(self.journal_file) and os.path.getsize(self.journal_file):
+            os.truncate(self.journal_file, 0)
+
+        if os.path.exists(self.legacy_file):
+            os.remove(self.legacy_file)
+
+        self._last_commit = self.clock()
+
+    def close(self, commit=True):
+        if commit:
+            self.commit()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+
+from decouple import config
+
+
+class PooledClient:
+    """
+    A logged-in instagrapi client kept in the ClientPool.
+    Attributes:
+        client (Client): The instagrapi client.
+        validated_at (float): time.time() of the last successful session check or login.
+        settings (dict): The client settings as last dumped to the session file.
+    """
+    def __init__(self, client, validated_at, settings=None):
+        self.client = client
+        self.validated_at = validated_at
+        self.settings = settings
+
+    def is_stale(self, ttl):
+        return time.time() - self.validated_at >= ttl
+
+
+class ClientPool:
+    """
+    Per-process LRU pool of authenticated instagrapi clients keyed by account.
+    Repeat tasks on the same account reuse the pooled client and only re-check the
+    session once it is older than session_ttl, instead of logging in again every time.
+    Attributes:
+        max_size (int): Maximum number of clients kept, the least recently used is evicted.
+        session_ttl (int): Seconds after which a pooled session must be validated again.
+    """
+    def __init__(self, max_size=32, session_ttl=1800):
+        self.max_size = max_size
+        self.session_ttl = session_ttl
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the pooled client for a key (marking it as recently used) or None."""
+
+        with self._lock:
+            pooled = self._clients.get(key)
+            if pooled is not None:
+                self._clients.move_to_end(key)
+            return pooled
+
+    def put(self, key, pooled):
+        with self._lock:
+            self._clients[key] = pooled
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._clients.pop(key, None)
+
+    def discard_account(self, user, username):
+        """Drop every pooled client of an Instagram account (e.g. after its credentials changed)."""
+
+        with self._lock:
+            for key in [key for key in self._clients if key[:2] == (user, username)]:
+                del self._clients[key]
+
+
+client_pool = ClientPool(
+    max_size=config('IG_CLIENT_POOL_SIZE', default=32, cast=int),
+    session_ttl=config('IG_SESSION_TTL', default=1800, cast=int),
+)
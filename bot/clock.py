@@ -0,0 +1,48 @@
+import time
+
+
+class SystemClock:
+    """The real clock: time(), monotonic() and sleep() of the time module."""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Simulated clock, sleeping only moves it forward, so a run of hours finishes in seconds.
+    Attributes:
+        start (float): The timestamp the clock starts at.
+        elapsed (float): Simulated seconds since the start.
+        slept (float): Simulated seconds spent in sleep().
+    """
+    def __init__(self, start=None):
+        self.start = time.time() if start is None else start
+        self.elapsed = 0.0
+        self.slept = 0.0
+
+    def time(self):
+        return self.start + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.elapsed += seconds
+            self.slept += seconds
+
+    def advance(self, seconds):
+        """Let seconds pass without sleeping, e.g. the duration of a simulated request."""
+
+        if seconds > 0:
+            self.elapsed += seconds
+
+
+system_clock = SystemClock()
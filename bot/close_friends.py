@@ -0,0 +1,446 @@
+import os
+import uuid
+import logging
+
+from decouple import config
+from instagrapi.exceptions import (
+    FeedbackRequired, PleaseWaitFewMinutes, ClientThrottledError,
+    ClientConnectionError, ClientRequestTimeout, ProxyAddressIsBlocked
+)
+
+from . import metrics
+from .besties import set_besties, fetch_besties, besties_delta
+from .checkpoint import CloseFriendsCheckpoint
+from .followers import FollowerList, write_follower_list
+from .history import record_job_run, STOP_PAUSED
+from .lease import check_lease, current_chain_id, LeaseLost
+from .progress import JobProgress, CLOSE_FRIENDS_JOB
+from .proxies import proxy_pool, NoProxyAvailable
+from .scheduler import ActionScheduler
+
+STOP_DONE = 'done'
+STOP_FEEDBACK_REQUIRED = 'feedback_required'
+STOP_ERROR = 'error'
+
+# Soft blocks in a row after which the account is left alone until someone restarts it
+MAX_FEEDBACK_STRIKES = config('CLOSE_FRIENDS_MAX_FEEDBACK_STRIKES', default=3, cast=int)
+# Pause after a 429 style throttling error, FeedbackRequired pauses for bot.feedback_error_sleep_time
+THROTTLE_PAUSE = config('CLOSE_FRIENDS_THROTTLE_PAUSE', default=300, cast=float)
+# Connection errors in a row after which a run without a proxy pool gives up
+MAX_CONNECTION_ERRORS = config('CLOSE_FRIENDS_MAX_CONNECTION_ERRORS', default=5, cast=int)
+# Pause when every proxy is down or full
+PROXY_RETRY_DELAY = config('PROXY_RETRY_DELAY', default=60, cast=int)
+# Longest gap between two actions a close friends step sleeps through instead of rescheduling the account
+STEP_MAX_INLINE_WAIT = config('CLOSE_FRIENDS_STEP_MAX_INLINE_WAIT', default=120, cast=int)
+
+
+class CloseFriendsRun:
+    """
+    One pass of the close friends add loop of an account, from its checkpoint onwards.
+    The run can be driven to completion in one go (sleeping between actions) or in
+    short steps that return as soon as the next action is not due yet, so the caller
+    can release the worker and come back later. A soft block (FeedbackRequired or
+    throttling) parks the account and ends the current batch; the run picks up from the
+    checkpoint once the pause is over.
+    The run holds a slot on a proxy of the proxy pool. Connection errors count against
+    the proxy's health, and once the proxy is taken out of the pool the run fails over
+    to the account's next proxy. Without a proxy pool the run goes out from the worker's
+    own address, and stops with STOP_ERROR after MAX_CONNECTION_ERRORS connection errors
+    in a row.
+    With a close_friends_group_size above 1 in the account's BotConfig, every action adds
+    a whole group of followers in one set_besties request and the checkpoint is committed
+    after every group.
+    With close_friends_sync, the run goes through <username>.sync.bin instead of the
+    whole follower list: the followers that were not close friends when the run started,
+    computed once from the current besties list and rebuilt after a rescrape. With
+    close_friends_remove_stale, the close friends that no longer follow the account are
+    written to <username>.stale.bin at the same time, and the run removes them first,
+    as actions paced and backed off like the adds, counted in the checkpoint's removed.
+    Attributes:
+        bot (InstagramBot): The bot the run belongs to, with its client initialized.
+        username (str): The Instagram username followers are added from.
+        clock (SystemClock): The bot's clock, every sleep and timestamp of the run and its scheduler, progress
+            and checkpoint goes through it. The proxy pool keeps the wall clock, its health and slot expiry
+            times are shared with the other processes.
+        followers (FollowerList): The scraped followers of the account.
+        stale (FollowerList): Close friends to remove in sync mode, None when there are none.
+        checkpoint (CloseFriendsCheckpoint): Resumable position in the followers.
+        progress (JobProgress): Live progress of the run.
+        scheduler (ActionScheduler): Pacing of the actions.
+        proxy (Proxy): The proxy the run goes through, None without a proxy pool.
+        position (int): Index of the next follower to add.
+        group_size (int): Number of followers added per request.
+        failed (int): Followers Instagram did not confirm as added in a group.
+        connection_errors (int): Connection errors in a row, reset by any answer from Instagram.
+        batch_done (bool): Whether the last add completed a batch.
+        stop_reason (str): Why the run stopped (STOP_DONE, STOP_FEEDBACK_REQUIRED or STOP_ERROR).
+        error (str): The error that stopped the run with STOP_ERROR.
+        lease_lost (bool): Whether the run stopped because another task took its lease over.
+        added (int): Followers added to close friends by this run.
+        sleep_seconds (float): Time the run spent waiting for its next action.
+    The run is recorded as a JobRun when it is closed, and as a segment of it whenever it fails over to another proxy.
+    """
+    def __init__(self, bot, username, offset=None, last_id=None):
+        self.bot = bot
+        self.username = username
+        self.clock = bot.clock
+
+        bot.username, bot.password, bot.config = bot._get_account(username)
+        bot.config = bot.config.resolved()
+
+        self.proxy = None
+        if proxy_pool:
+            self.proxy = proxy_pool.acquire(bot.user, username)
+            if self.proxy is None:
+                raise NoProxyAvailable(f"Every proxy is down or full, {username} has to wait")
+        else:
+            logging.warning(f"No proxy pool configured (PROXY_POOL and PROXY_HOST are unset), {username} adds close friends from the worker's address")
+        self._proxy_kept_at = self.clock.monotonic()
+
+        self.followers = None
+        self.stale = None
+        self.checkpoint = None
+        try:
+            bot.client = bot._initialize_client(username, add_to_close_friends_mode=True, proxy=self.proxy)
+
+            self.group_size = max(bot.config.close_friends_group_size, 1)
+            self.scheduler = ActionScheduler(
+                bot.user, username, bot.config,
+                proxy=self.proxy.key if self.proxy else None,
+                proxy_rate=config('PROXY_RATE_LIMIT', default=1.0, cast=float),
+                clock=self.clock.time,
+            )
+
+            self.followers = bot._read_followers(username)
+            self.checkpoint = CloseFriendsCheckpoint(bot.last_added_path, username, clock=self.clock.monotonic)
+            if offset is not None:
+                # A checkpoint carried by the task wins, resume_offset() still checks it against the list
+                self.checkpoint.offset, self.checkpoint.last_id = offset, last_id or ''
+            if bot.config.close_friends_sync:
+                self._sync()
+            self.position = self.checkpoint.resume_offset(self.followers)
+            self.progress = JobProgress(
+                bot.user, username, CLOSE_FRIENDS_JOB, total=len(self.followers) + self._stale_count,
+                processed=self.position + self.checkpoint.removed, clock=self.clock.time,
+            )
+        except Exception:
+            # A run that never started must not keep its proxy slot or its files open
+            self._release_proxy()
+            self._close_files(commit=False)
+            raise
+
+        self.failed = 0
+        self.connection_errors = 0
+        self.batch_done = False
+        self.stop_reason = None
+        self.error = None
+        self.lease_lost = False
+
+        self.started = self.clock.time()
+        self.start_position = self.position
+        self.start_removed = self.checkpoint.removed
+        self.added = 0
+        self.sleep_seconds = 0.0
+        # A run without a lease (e.g. the benchmarks) still records its proxy failovers in a single JobRun
+        self.chain_id = current_chain_id() or uuid.uuid4().hex
+        self._recorded = (self.started, 0, 0, 0.0)
+
+    @property
+    def _stale_count(self):
+        return len(self.stale) if self.stale is not None else 0
+
+    @property
+    def removing(self):
+        """Whether stale close friends are left to remove before the adds."""
+
+        return self.checkpoint.removed < self._stale_count
+
+    @property
+    def finished(self):
+        return self.stop_reason is not None or (self.position >= len(self.followers) and not self.removing)
+
+    def _sync(self):
+        """
+        Swap the follower list for the followers that are not close friends yet, building it
+        (and the list of stale close friends) when missing or outdated. Both lists are on
+        disk before the first add or removal is made, so a killed run resumes from them.
+        """
+
+        sync_file = self.bot._sync_followers_file(self.username)
+        stale_file = self.bot._stale_followers_file(self.username)
+        if not os.path.exists(sync_file) or os.path.getmtime(sync_file) < os.path.getmtime(self.followers.path):
+            besties = fetch_besties(self.bot.client)
+            to_add, to_remove = besties_delta(self.followers, besties)
+            logging.info(f"{self.username} has {len(besties)} close friends, {len(to_add)} followers to add and {len(to_remove)} to remove")
+
+            # Positions in the old lists mean nothing in the new ones
+            self.checkpoint.offset, self.checkpoint.last_id, self.checkpoint.removed = 0, '', 0
+            self.checkpoint.commit()
+
+            if self.bot.config.close_friends_remove_stale and to_remove:
+                write_follower_list(stale_file, to_remove, self.followers.source, self.followers.scraped_at)
+            elif os.path.exists(stale_file):
+                os.remove(stale_file)
+            # Written last, its mtime marks both lists as built
+            write_follower_list(sync_file, to_add, self.followers.source, self.followers.scraped_at)
+
+        self.followers.close()
+        self.followers = FollowerList(sync_file)
+        if self.bot.config.close_friends_remove_stale and os.path.exists(stale_file):
+            self.stale = FollowerList(stale_file)
+
+    def _remove_group(self, group):
+        _, removed = set_besties(self.bot.client, remove=group)
+        # Ids not confirmed were already gone from the close friends, nothing to retry
+        logging.info(f"Removed {len(removed)} former followers from Close Friends")
+
+    def add_next(self):
+        """
+        Make the next action: remove the next group of stale close friends while there are
+        any, then add the follower (or group of followers) at the current position.
+        """
+
+        self.batch_done = False
+        removing = self.removing
+        if removing:
+            group = self.stale[self.checkpoint.removed:self.checkpoint.removed + self.group_size].tolist()
+        else:
+            group = self.followers[self.position:self.position + self.group_size].tolist()
+        failed = self.failed
+        started = self.clock.monotonic()
+        try:
+            if removing:
+                self._remove_group(group)
+            elif self.group_size == 1:
+                self.bot.client.close_friend_add(user_id=group[0])
+                logging.info(f"Added {group[0]} to Close Friends", extra={'sample': True})
+            else:
+                self._add_group(group)
+
+        except (ClientConnectionError, ClientRequestTimeout, ProxyAddressIsBlocked) as e:
+            logging.error(f"Connection error: {e}")
+            self.progress.error(f"Connection error: {e}")
+            self._proxy_failed(self._observe('connection_error', started))
+            return
+
+        except FeedbackRequired as e:
+            self._proxy_ok(self._observe('feedback_required', started))
+            metrics.SOFT_BLOCKS.inc(tenant=self.bot.user, account=self.username, kind='feedback_required')
+            logging.error(f"Feedback required: {e}")
+            self.progress.error(f"Feedback required: {e}")
+            self._back_off(self.bot.feedback_error_sleep_time)
+            return
+
+        except (PleaseWaitFewMinutes, ClientThrottledError) as e:
+            self._proxy_ok(self._observe('throttled', started))
+            metrics.SOFT_BLOCKS.inc(tenant=self.bot.user, account=self.username, kind='throttled')
+            logging.error(f"Throttled: {e}")
+            self.progress.error(f"Throttled: {e}")
+            self._back_off(THROTTLE_PAUSE)
+            return
+
+        except Exception as e:
+            self._observe('error', started)
+            action = 'remove' if removing else 'add'
+            logging.error(f"Failed to {action} {group[0]}: {e}")
+            self.progress.error(f"Failed to {action} {group[0]}: {e}")
+            self.stop_reason = STOP_ERROR
+            self.error = f'{type(e).__name__}: {e}'
+            return
+
+        self._proxy_ok(self._observe('ok', started))
+        if removing:
+            self.checkpoint.removed += len(group)
+            self.progress.advance(len(group))
+            self.batch_done = self.scheduler.action_done(len(group))
+            self.checkpoint.commit()
+            return
+
+        added = len(group) - (self.failed - failed)
+        metrics.CLOSE_FRIENDS_ADDED.inc(added, tenant=self.bot.user, account=self.username)
+        self.added += added
+        self.position += len(group)
+        for follower in group:
+            self.checkpoint.record(follower)
+        self.progress.advance(len(group))
+
+        self.batch_done = self.scheduler.action_done(len(group))
+        if self.batch_done or self.group_size > 1:
+            self.checkpoint.commit()
+
+    def _add_group(self, group):
+        added, _ = set_besties(self.bot.client, add=group)
+        if not added:
+            # Nothing went through, Instagram is silently dropping the account's requests
+            raise ClientThrottledError(f"None of {len(group)} followers were added to Close Friends")
+
+        failed = [follower for follower in group if str(follower) not in added]
+        logging.info(f"Added {len(added)} followers to Close Friends")
+        if failed:
+            # Skipped rather than retried, a later sync of the account picks them up
+            self.failed += len(failed)
+            logging.warning(f"{len(failed)} followers were not added to Close Friends: {failed}")
+            self.progress.error(f"{self.failed} followers could not be added")
+
+    def _observe(self, outcome, started):
+        """Record the duration of an add request in the metrics and return it."""
+
+        elapsed = self.clock.monotonic() - started
+        metrics.CLOSE_FRIEND_ADD_SECONDS.observe(elapsed, tenant=self.bot.user, account=self.username, outcome=outcome)
+        metrics.WORK_SECONDS.inc(elapsed, tenant=self.bot.user, account=self.username)
+        return elapsed
+
+    def _proxy_ok(self, latency):
+        self.connection_errors = 0
+        if self.proxy is None:
+            return
+
+        proxy_pool.record(self.proxy, latency, ok=True)
+        if self.clock.monotonic() - self._proxy_kept_at >= proxy_pool.active_ttl / 3:
+            proxy_pool.keep(self.bot.user, self.username, self.proxy)
+            self._proxy_kept_at = self.clock.monotonic()
+
+    def _proxy_failed(self, latency):
+        """
+        Count a connection error against the proxy, failing over to another one once it is
+        taken out. Without a proxy there is nothing to fail over to, the run stops after
+        MAX_CONNECTION_ERRORS in a row.
+        """
+
+        self.connection_errors += 1
+        if self.proxy is None:
+            if self.connection_errors >= MAX_CONNECTION_ERRORS:
+                logging.error(f"{self.connection_errors} connection errors in a row for {self.username}, giving up")
+                self.stop_reason = STOP_ERROR
+                self.error = f"{self.connection_errors} connection errors in a row"
+            return
+
+        if proxy_pool.record(self.proxy, latency, ok=False):
+            # Retried after the usual gap
+            return
+
+        proxy = proxy_pool.acquire(self.bot.user, self.username, exclude={self.proxy.key})
+        if proxy is None:
+            logging.warning(f"No proxy left for {self.username}, pausing for {PROXY_RETRY_DELAY} seconds")
+            self.scheduler.paused_until = self.scheduler.clock() + PROXY_RETRY_DELAY
+            self.scheduler.save()
+            self.batch_done = True
+            return
+
+        logging.warning(f"Moving {self.username} from proxy {self.proxy.key} to {proxy.key}")
+        # The work so far is attributed to the proxy it went through
+        self._record(STOP_PAUSED)
+        self._release_proxy()
+        self.proxy = proxy
+        self.bot.client.set_proxy(proxy.url)
+        self.scheduler.set_proxy(proxy.key)
+
+    def _release_proxy(self):
+        if self.proxy is not None:
+            proxy_pool.release(self.bot.user, self.username, self.proxy)
+
+    def _back_off(self, pause):
+        """Slow down and park the account after a soft block, longer every time it happens in a row."""
+
+        strikes = self.scheduler.throttle.strikes + 1
+        if strikes > MAX_FEEDBACK_STRIKES:
+            # Give up, the next run of the account starts with a clean slate
+            self.scheduler.throttle.strikes = 0
+            self.scheduler.save()
+            self.stop_reason = STOP_FEEDBACK_REQUIRED
+            return
+
+        self.scheduler.throttled(pause * 2 ** (strikes - 1))
+        # The pause ends the batch, so batched runs hand the account back to the queue
+        self.batch_done = True
+        self.checkpoint.commit()
+
+    def run(self, max_inline_wait=None, max_duration=None, max_batches=None):
+        """
+        Add followers until the run is finished and return None.
+        With max_inline_wait, return early with the seconds until the next action as soon as
+        it is due later than that; with max_duration, return once that many seconds passed;
+        with max_batches, return once that many batches are completed.
+        """
+
+        started = self.clock.monotonic()
+        batches = 0
+        while not self.finished:
+            wait = self.scheduler.wait_time()
+            if max_inline_wait is not None and wait > max_inline_wait:
+                return wait
+            if max_duration is not None and self.clock.monotonic() - started >= max_duration:
+                return wait
+
+            wait = self.scheduler.reserve()
+            metrics.SLEEP_SECONDS.inc(wait, tenant=self.bot.user, account=self.username)
+            self.sleep_seconds += wait
+            self.clock.sleep(wait)
+            self._check_lease()
+            self.add_next()
+
+            if self.batch_done:
+                batches += 1
+                if max_batches is not None and batches >= max_batches and not self.finished:
+                    return self.scheduler.wait_time()
+
+        if self.stop_reason is None:
+            self.stop_reason = STOP_DONE
+        return None
+
+    def _check_lease(self):
+        try:
+            check_lease()
+        except LeaseLost:
+            self.lease_lost = True
+            raise
+
+    def fail(self, error):
+        """Stop the run on an unexpected error."""
+
+        self.progress.error(error)
+        self.stop_reason = STOP_ERROR
+        self.error = f'{type(error).__name__}: {error}'
+
+    def _close_files(self, commit=True):
+        if self.checkpoint is not None:
+            self.checkpoint.close(commit=commit)
+        if self.followers is not None:
+            self.followers.close()
+        if self.stale is not None:
+            self.stale.close()
+
+    def close(self):
+        if self.lease_lost:
+            # The task that took the job over owns the checkpoint, the proxy slot and the progress now
+            self._close_files(commit=False)
+            return
+
+        self._close_files()
+        self._release_proxy()
+        if self.stop_reason == STOP_DONE and self.bot.config.close_friends_sync:
+            # The next run syncs against the besties list again
+            for path in (self.bot._sync_followers_file(self.username), self.bot._stale_followers_file(self.username)):
+                if os.path.exists(path):
+                    os.remove(path)
+        if self.stop_reason is not None:
+            self.progress.finish('done' if self.stop_reason == STOP_DONE else 'stopped')
+
+        self._record(self.stop_reason or STOP_PAUSED)
+
+    def _record(self, stop_reason):
+        """Record the part of the run since the previous record as a JobRun segment."""
+
+        if not self.bot.record_history:
+            return
+
+        items = self.position - self.start_position + self.checkpoint.removed - self.start_removed
+        ended = self.clock.time()
+        started, recorded_items, recorded_added, recorded_sleep = self._recorded
+        record_job_run(
+            self.bot.user, self.username, CLOSE_FRIENDS_JOB, started,
+            items=items - recorded_items, added=self.added - recorded_added, sleep_seconds=self.sleep_seconds - recorded_sleep,
+            stop_reason=stop_reason, error=self.error, proxy=self.proxy.key if self.proxy else '',
+            ended=ended, chain_id=self.chain_id,
+        )
+        self._recorded = (ended, items, self.added, self.sleep_seconds)
@@ -0,0 +1,157 @@
+import os
+import json
+import logging
+from collections import OrderedDict
+
+from decouple import config
+
+from .followers import FollowerList, FollowerListWriter, SOURCE_HIKER
+from .lease import check_lease
+
+# Most recent ids checked for duplicates, which bounds the memory of a scrape whatever its size
+DEDUPE_WINDOW = config('SCRAPE_DEDUPE_WINDOW', default=50000, cast=int)
+
+
+class FollowerCrawler:
+    """
+    Streaming, resumable scrape of the followers of one Instagram account.
+    Every page is appended to followers/<username>.bin.part as soon as it arrives and
+    the page cursor is persisted to followers/<username>.cursor right after, so a
+    worker killed halfway through resumes from the last saved page instead of from
+    zero. Once the scrape is finished the part file is moved to <username>.bin.
+    Duplicates (a follower showing up again on a later page while the list shifts) are
+    dropped against the last DEDUPE_WINDOW ids saved, not against the whole list, so the
+    memory of a scrape stays constant. A duplicate further apart than that is kept, which
+    only costs a no-op close friends add.
+    Attributes:
+        followers_path (str): Directory holding the follower lists.
+        username (str): The Instagram username being scraped.
+        max_followers (int): Number of followers to collect before stopping.
+        source (int): Follower list source written in the header.
+        progress (JobProgress): Optional live progress updated after every page.
+        count (int): Number of unique followers saved so far.
+        finished (bool): Whether the last page has been saved.
+    """
+    def __init__(self, followers_path, username, max_followers, source=SOURCE_HIKER, progress=None):
+        self.followers_path = followers_path
+        self.username = username
+        self.max_followers = max_followers
+        self.source = source
+        self.progress = progress
+
+        self.followers_file = os.path.join(followers_path, f'{username}.bin')
+        self.part_file, self.cursor_file = self.files(followers_path, username)
+
+        self.count = 0
+        self.page_id = None
+        self.finished = False
+        self._seen = OrderedDict()
+        self._writer = None
+
+    @staticmethod
+    def files(followers_path, username):
+        """Return the in-progress files a crawl may leave behind for an account."""
+
+        return [
+            os.path.join(followers_path, f'{username}.bin.part'),
+            os.path.join(followers_path, f'{username}.cursor'),
+        ]
+
+    def open(self):
+        """Start or resume the crawl and return the page id to fetch first."""
+
+        cursor = None
+        if os.path.exists(self.cursor_file) and os.path.exists(self.part_file):
+            with open(self.cursor_file, 'r') as f:
+                cursor = json.load(f)
+
+        if cursor is None:
+            self._writer = FollowerListWriter(self.part_file, self.source)
+            return None
+
+        self._writer = FollowerListWriter(self.part_file, self.source, resume=True, resume_count=cursor['count'])
+        self.count = self._writer.count
+        self.page_id = cursor['next_page_id']
+        self.finished = cursor.get('finished', False)
+
+        # Rebuild the window from the tail of the saved ids, so duplicates across pages keep being dropped
+        with FollowerList(self.part_file) as saved:
+            self._seen = OrderedDict.fromkeys(saved[max(len(saved) - DEDUPE_WINDOW, 0):].tolist())
+
+        logging.info(f"Resuming follower scrape of {self.username} at {self.count} followers")
+        return self.page_id
+
+    def consume_page(self, users, next_page_id):
+        """Save one page of followers and its cursor. Returns True once the crawl is finished."""
+
+        new_ids = []
+        for user in users:
+            if self.count + len(new_ids) >= self.max_followers:
+                break
+
+            user_id = int(user.get('id'))
+            if user_id not in self._seen:
+                self._remember(user_id)
+                new_ids.append(user_id)
+
+        self._writer.write(new_ids)
+        self._writer.commit()
+        self.count += len(new_ids)
+
+        # A missing cursor, or one that does not move, means the end of the followers
+        self.finished = self.count >= self.max_followers or not next_page_id or next_page_id == self.page_id
+        self.page_id = next_page_id
+        self._save_cursor()
+
+        if self.progress is not None:
+            self.progress.update(self.count)
+
+        logging.info(f"Saved {len(new_ids)} followers of {self.username} ({self.count}/{self.max_followers})")
+        return self.finished
+
+    def _remember(self, user_id):
+        self._seen[user_id] = None
+        if len(self._seen) > DEDUPE_WINDOW:
+            self._seen.popitem(last=False)
+
+    def _save_cursor(self):
+        tmp_file = f'{self.cursor_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'next_page_id': self.page_id, 'count': self.count, 'finished': self.finished}, f)
+        os.replace(tmp_file, self.cursor_file)
+
+    def finish(self):
+        """Publish the scraped followers as <username>.bin and drop the crawl state."""
+
+        self._writer.close()
+        self._writer = None
+        os.replace(self.part_file, self.followers_file)
+        os.remove(self.cursor_file)
+        return self.count
+
+    def close(self):
+        """Stop the crawl, keeping the part file and cursor for a later resume."""
+
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def run(self, fetch_page):
+        """
+        Crawl every page using fetch_page(page_id), which returns a tuple of the
+        users of the page and the id of the next page. Returns the followers count.
+        """
+
+        page_id = self.open()
+        try:
+            while not self.finished:
+                check_lease()
+                users, next_page_id = fetch_page(page_id)
+                if self.consume_page(users, next_page_id):
+                    break
+                page_id = next_page_id
+        except BaseException:
+            self.close()
+            raise
+
+        return self.finish()
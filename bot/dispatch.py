@@ -0,0 +1,112 @@
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from decouple import config
+
+from .lease import QUEUE_TTL
+
+# Jobs of one kind a tenant may have in flight (queued in Celery or running) at once
+TENANT_JOB_CAP = config('TENANT_JOB_CAP', default=2, cast=int)
+# With a value above 0, every that many followers of max_close_friends_allocation add one slot to the cap
+TENANT_ALLOCATION_PER_JOB = config('TENANT_ALLOCATION_PER_JOB', default=0, cast=int)
+
+
+def tenant_cap(allocation):
+    """Number of jobs of one kind a tenant with the given max_close_friends_allocation may have in flight."""
+
+    if TENANT_ALLOCATION_PER_JOB > 0:
+        return TENANT_JOB_CAP + max(allocation, 0) // TENANT_ALLOCATION_PER_JOB
+    return TENANT_JOB_CAP
+
+
+def _tenant_caps(users):
+    from Core.models import User
+
+    allocations = dict(User.objects.filter(username__in=users).values_list('username', 'max_close_friends_allocation'))
+    return {user: tenant_cap(allocations.get(user, 0)) for user in users}
+
+
+def dispatch(kind):
+    """
+    Send waiting jobs of a kind to their Celery queue, within the cap of every tenant.
+    Tenants take turns, one job each per round in the order of their oldest waiting job,
+    so a tenant starting many jobs only ever holds its own slots and a job of any other
+    tenant is sent as soon as that tenant has a free slot. Returns the number of jobs sent.
+    """
+
+    from django.db import transaction
+    from django.db.models import Count
+    from django.utils import timezone
+    from Core.models import JobLease
+    from CloseFriends.celery import app
+
+    now = timezone.now()
+    dispatched = []
+    with transaction.atomic():
+        waiting = JobLease.objects.select_for_update().filter(kind=kind, dispatched_when__isnull=True).order_by('enqueued_when', 'id')
+
+        queues = defaultdict(deque)
+        for lease in waiting:
+            queues[lease.user].append(lease)
+        if not queues:
+            return 0
+
+        in_flight = defaultdict(int, JobLease.objects.filter(
+            kind=kind, user__in=list(queues), dispatched_when__isnull=False, expires_when__gt=now,
+        ).values('user').annotate(count=Count('id')).values_list('user', 'count'))
+        caps = _tenant_caps(list(queues))
+
+        while queues:
+            for user in list(queues):
+                if in_flight[user] >= caps[user] or not queues[user]:
+                    del queues[user]
+                    continue
+
+                lease = queues[user].popleft()
+                lease.dispatched_when = now
+                lease.expires_when = now + timedelta(seconds=QUEUE_TTL)
+                lease.save(update_fields=['dispatched_when', 'expires_when'])
+                in_flight[user] += 1
+                dispatched.append(lease)
+
+        for lease in dispatched:
+            transaction.on_commit(
+                lambda lease=lease: app.send_task(lease.task_name, kwargs=lease.task_kwargs, task_id=lease.task_id)
+            )
+    return len(dispatched)
+
+
+def queue_stats(users=None):
+    """
+    Return the queue depth and wait of every tenant, keyed by tenant then job kind:
+    jobs waiting for a slot, jobs in flight, the tenant's cap and the seconds the oldest
+    waiting job has been waiting.
+    """
+
+    from django.db.models import Count, Min, Q
+    from django.utils import timezone
+    from Core.models import JobLease
+
+    now = timezone.now()
+    leases = JobLease.objects.all()
+    if users is not None:
+        leases = leases.filter(user__in=users)
+
+    rows = leases.values('user', 'kind').annotate(
+        waiting=Count('id', filter=Q(dispatched_when__isnull=True)),
+        in_flight=Count('id', filter=Q(dispatched_when__isnull=False, expires_when__gt=now)),
+        oldest_waiting=Min('enqueued_when', filter=Q(dispatched_when__isnull=True)),
+    )
+
+    rows = list(rows)
+    caps = _tenant_caps({row['user'] for row in rows})
+
+    stats = defaultdict(dict)
+    for row in rows:
+        stats[row['user']][row['kind']] = {
+            'waiting': row['waiting'],
+            'in_flight': row['in_flight'],
+            'cap': caps[row['user']],
+            'max_wait': (now - row['oldest_waiting']).total_seconds() if row['oldest_waiting'] else 0,
+        }
+    return dict(stats)
@@ -0,0 +1,141 @@
+import os
+import sys
+import mmap
+import time
+import struct
+from array import array
+
+# followers/<username>.bin layout:
+#   header  magic (4s) | version (u16) | source (u8) | padding | count (u64) | scraped_at (f64)
+#   body    count fixed-width int64 user ids, little endian
+FOLLOWER_LIST_MAGIC = b'IGFL'
+FOLLOWER_LIST_VERSION = 1
+HEADER_FORMAT = '<4sHBxQd'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ID_SIZE = 8
+
+SOURCE_TXT = 0
+SOURCE_HIKER = 1
+SOURCE_INSTAGRAPI = 2
+
+
+class FollowerList:
+    """
+    Read-only, memory-mapped view of a followers/<username>.bin file.
+    Ids are read straight from the mapping, so iterating or slicing the list never
+    materializes it: an index returns an int and a slice returns a memoryview of ints.
+    Attributes:
+        path (str): Path of the .bin file.
+        source (int): Where the followers came from (SOURCE_TXT, SOURCE_HIKER or SOURCE_INSTAGRAPI).
+        scraped_at (float): Unix timestamp of the scrape.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.source, count, self.scraped_at = struct.unpack_from(HEADER_FORMAT, self._mmap)
+        if magic != FOLLOWER_LIST_MAGIC or version != FOLLOWER_LIST_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a follower list")
+
+        body = memoryview(self._mmap)[HEADER_SIZE:HEADER_SIZE + count * ID_SIZE]
+        if sys.byteorder == 'little':
+            self._ids = body.cast('q')
+        else:
+            self._ids = array('q', body)
+            self._ids.byteswap()
+            body.release()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        return self._ids[index]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._ids, memoryview):
+            self._ids.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Slices handed out by __getitem__ keep the mapping alive until they are released
+            pass
+
+
+class FollowerListWriter:
+    """
+    Write follower ids to a .bin follower list.
+    Ids are appended as they are written, the count in the header is only updated
+    by commit() and close(). With resume=True an existing list is reopened and
+    anything past the first resume_count ids (e.g. a torn write) is dropped.
+    """
+    def __init__(self, path, source, scraped_at=None, resume=False, resume_count=None):
+        self.path = path
+        self.source = source
+        self.scraped_at = scraped_at if scraped_at is not None else time.time()
+        self.count = 0
+
+        if resume and os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            self._file = open(path, 'r+b')
+            _, _, _, count, self.scraped_at = struct.unpack(HEADER_FORMAT, self._file.read(HEADER_SIZE))
+            self.count = count if resume_count is None else min(count, resume_count)
+            self._file.truncate(HEADER_SIZE + self.count * ID_SIZE)
+        else:
+            self._file = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(struct.pack(
+            HEADER_FORMAT, FOLLOWER_LIST_MAGIC, FOLLOWER_LIST_VERSION, self.source, self.count, self.scraped_at
+        ))
+
+    def write(self, ids):
+        ids = array('q', (int(user_id) for user_id in ids))
+        if sys.byteorder != 'little':
+            ids.byteswap()
+
+        self._file.seek(0, os.SEEK_END)
+        ids.tofile(self._file)
+        self.count += len(ids)
+
+    def commit(self):
+        """Durably write the ids written so far and the matching count."""
+
+        self._write_header()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+def write_follower_list(path, ids, source, scraped_at=None):
+    """Atomically (re)write a follower list with the given ids."""
+
+    tmp_path = f'{path}.tmp'
+    writer = FollowerListWriter(tmp_path, source, scraped_at)
+    writer.write(ids)
+    writer.close()
+    os.replace(tmp_path, path)
+    return writer.count
+
+
+def convert_txt_followers(txt_path, bin_path):
+    """Convert a legacy followers/<username>.txt file (one decimal id per line) to a .bin follower list."""
+
+    with open(txt_path, 'r') as f:
+        ids = (line for line in (line.strip() for line in f) if line)
+        return write_follower_list(bin_path, ids, SOURCE_TXT, scraped_at=os.path.getmtime(txt_path))
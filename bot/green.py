@@ -0,0 +1,98 @@
+"""
+Cooperative (gevent) execution mode for the close friends loop.
+
+With gevent's monkey patching, instagrapi's requests sockets and the time.sleep calls
+between actions yield to other greenlets, so one process can run the loops of hundreds
+of accounts. Every account runs on its own InstagramBot instance, which keeps the
+per-account state (client, username, config) isolated between greenlets.
+
+Two ways to use it:
+    celery -A CloseFriends worker -P gevent -c 500
+        Celery patches the process and runs every close friends task in a greenlet.
+    python -m bot.green <user>:<instagram username> [<user>:<instagram username> ...]
+        Standalone runner for a fixed set of accounts.
+
+The async Hiker scraping engine (HIKER_SCRAPE_MODE=async) runs its own event loop
+thread and is meant for threads pools, not gevent workers.
+"""
+if __name__ == '__main__':
+    # Must happen before anything imports socket, ssl or threading
+    from gevent import monkey
+    monkey.patch_all()
+
+import os
+import sys
+import time
+import uuid
+import logging
+
+from decouple import config
+
+
+def is_green():
+    """Whether the process runs with gevent's monkey patching (e.g. a -P gevent Celery worker)."""
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def release_db_connection():
+    """
+    Close the current greenlet's database connection.
+    Django connections are per thread, which gevent turns into per greenlet, so a long
+    running loop should not keep one open while it is mostly asleep.
+    """
+
+    from django.db import connection
+
+    connection.close()
+
+
+def _run_account(user, username):
+    from .bot import InstagramBot
+    from .lease import AccountLease
+    from .progress import CLOSE_FRIENDS_JOB
+    from .log import log_context
+
+    # Same lease as the Celery tasks, so an account is never run here and on a worker at once
+    lease = AccountLease(user, username, CLOSE_FRIENDS_JOB, f'green-{uuid.uuid4()}')
+    if not lease.acquire():
+        return
+
+    try:
+        with log_context(user, username, lease.task_id):
+            # A waiting greenlet costs nothing, unlike the worker a Celery task would hold
+            retry = InstagramBot(user=user).add_to_close_friends(username)
+            while retry is not None:
+                time.sleep(retry)
+                retry = InstagramBot(user=user).add_to_close_friends(username)
+    finally:
+        lease.release()
+
+
+def run_close_friends(accounts, concurrency=500):
+    """Run the close friends loop of every (user, username) pair in its own greenlet."""
+
+    from gevent.pool import Pool
+
+    pool = Pool(concurrency)
+    # One greenlet per account, two loops on the same account would share its client
+    for user, username in dict.fromkeys(accounts):
+        logging.info(f"Starting close friends loop of {username} ({user})")
+        pool.spawn(_run_account, user, username)
+    pool.join()
+
+
+if __name__ == '__main__':
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CloseFriends.settings')
+    django.setup()
+
+    run_close_friends(
+        [tuple(account.split(':', 1)) for account in sys.argv[1:]],
+        concurrency=config('GREEN_CONCURRENCY', default=500, cast=int),
+    )
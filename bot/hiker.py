@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import concurrent.futures
+import threading
+from typing import Optional
+from dataclasses import dataclass
+from collections import defaultdict
+
+import httpx
+from decouple import config
+
+from . import metrics
+from .crawler import FollowerCrawler
+from .lease import check_lease
+from .followers import SOURCE_HIKER
+from .progress import JobProgress
+from .ratelimit import TokenBucket
+
+HIKER_BASE_URL = config('HIKER_BASE_URL', default='https://api.hikerapi.com')
+HIKER_FOLLOWERS_ENDPOINT = '/v2/user/followers'
+HIKER_USER_BY_USERNAME_ENDPOINT = '/v1/user/by/username'
+
+HIKER_MAX_CONNECTIONS = config('HIKER_MAX_CONNECTIONS', default=20, cast=int)
+HIKER_MAX_KEEPALIVE = config('HIKER_MAX_KEEPALIVE', default=20, cast=int)
+HIKER_KEEPALIVE_EXPIRY = config('HIKER_KEEPALIVE_EXPIRY', default=60, cast=float)
+# Used when the h2 package is installed, many requests then share a single connection
+HIKER_HTTP2 = config('HIKER_HTTP2', default=True, cast=bool)
+# How often a task waiting for its async scrape checks that it still holds the account's lease
+LEASE_CHECK_INTERVAL = 10
+
+
+def _http2_enabled():
+    if not HIKER_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class RequestTimings:
+    """
+    Per endpoint count, total and maximum duration of the Hiker requests of the process.
+    Attributes:
+        slow_request (float): Requests taking longer than this many seconds are logged.
+    """
+    def __init__(self, slow_request=5):
+        self.slow_request = slow_request
+        self._timings = defaultdict(lambda: {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status_code):
+        with self._lock:
+            timing = self._timings[endpoint]
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+            if status_code >= 400:
+                timing['errors'] += 1
+
+        if seconds >= self.slow_request:
+            logging.warning(f"Hiker request to {endpoint} took {seconds:.2f} seconds")
+
+    def snapshot(self):
+        """Return the timings of every endpoint along with its mean duration."""
+
+        with self._lock:
+            return {
+                endpoint: {**timing, 'mean': timing['total'] / timing['count'] if timing['count'] else 0.0}
+                for endpoint, timing in self._timings.items()
+            }
+
+
+request_timings = RequestTimings()
+
+
+def _record_timing(response):
+    # get() reads the whole body, so response.elapsed covers the full request
+    request_timings.record(response.request.url.path, response.elapsed.total_seconds(), response.status_code)
+
+
+def _client_options(max_connections=None):
+    max_connections = max_connections or HIKER_MAX_CONNECTIONS
+    return {
+        'base_url': HIKER_BASE_URL,
+        'http2': _http2_enabled(),
+        'limits': httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(HIKER_MAX_KEEPALIVE, max_connections),
+            keepalive_expiry=HIKER_KEEPALIVE_EXPIRY,
+        ),
+        'headers': {'accept': 'application/json'},
+    }
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_hiker_session():
+    """
+    Return the process-wide httpx.Client for Hiker. Its connections are kept alive and
+    reused across pages, accounts and tasks, instead of every task paying for its own
+    TCP and TLS handshakes.
+    """
+
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = httpx.Client(
+                timeout=config('HIKER_TIMEOUT', default=30, cast=float),
+                **_client_options(),
+            )
+    return _session
+
+
+class PooledHikerClient:
+    """
+    Sync Hiker client on the shared session, covering the hikerapi Client calls the bot makes.
+    Attributes:
+        token (str): Hiker API key the requests are billed on.
+    """
+    def __init__(self, token):
+        self.token = token
+
+    def _get(self, endpoint, params):
+        response = get_hiker_session().get(endpoint, params=params, headers={'x-access-key': self.token})
+        _record_timing(response)
+        response.raise_for_status()
+        return response.json()
+
+    def user_followers_v2(self, user_id, page_id=None):
+        params = {'user_id': user_id}
+        if page_id:
+            params['page_id'] = page_id
+        return self._get(HIKER_FOLLOWERS_ENDPOINT, params)
+
+    def user_by_username_v1(self, username):
+        return self._get(HIKER_USER_BY_USERNAME_ENDPOINT, {'username': username})
+
+
+@dataclass
+class ScrapeJob:
+    """
+    A follower scrape to run on the async Hiker engine.
+    Attributes:
+        username (str): The Instagram username to scrape.
+        user_id (int): The numeric Instagram user id, looked up on Hiker when None.
+        max_followers (int): Number of followers to collect.
+        followers_path (str): Directory holding the follower lists of the account owner.
+        api_key (str): Hiker API key the requests are billed and rate limited on.
+        progress (JobProgress): Optional live progress of the scrape.
+        user (str): The username of the bot operator, used to label the metrics.
+    """
+    username: str
+    user_id: Optional[int]
+    max_followers: int
+    followers_path: str
+    api_key: str
+    progress: Optional[JobProgress] = None
+    user: Optional[str] = None
+
+
+class AsyncHikerScraper:
+    """
+    asyncio engine scraping followers of many accounts from a single event loop.
+    The loop runs in a background thread of the worker process. Celery tasks hand it
+    a ScrapeJob through scrape() and block until it is done, so with a threads (or
+    gevent) worker pool dozens of scrapes share one connection pool while they mostly
+    wait on HTTP. Requests are bounded by a global concurrency limit and a token
+    bucket per Hiker API key.
+    Attributes:
+        max_concurrency (int): Maximum number of Hiker requests in flight.
+        rate_limit (float): Requests per second allowed per API key.
+        burst (int): Requests per API key allowed in a burst.
+        timeout (float): Timeout of a single request in seconds.
+        max_retries (int): Retries of a page on throttling, server or transport errors.
+    """
+    def __init__(self, max_concurrency=20, rate_limit=10, burst=10, timeout=30, max_retries=3):
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='hiker-scraper', daemon=True).start()
+        return self._loop
+
+    def scrape(self, job):
+        """Run a scrape on the engine's event loop and wait for the number of followers saved."""
+
+        future = asyncio.run_coroutine_threadsafe(self.scrape_async(job), self._ensure_loop())
+        try:
+            while True:
+                try:
+                    return future.result(timeout=LEASE_CHECK_INTERVAL)
+                except concurrent.futures.TimeoutError:
+                    check_lease()
+        except BaseException:
+            # e.g. SoftTimeLimitExceeded, a revoke or a lost lease, the crawl must not go on writing files behind the task's back
+            future.cancel()
+            raise
+
+    async def run(self, jobs):
+        """Scrape several accounts concurrently on the running loop. Failed scrapes return their exception."""
+
+        return await asyncio.gather(*(self.scrape_async(job) for job in jobs), return_exceptions=True)
+
+    def _get_client(self):
+        # Created lazily so the client and semaphore belong to the loop that uses them
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, **_client_options(self.max_concurrency))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def _throttle(self, api_key):
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.rate_limit, self.burst)
+
+        wait = bucket.reserve(asyncio.get_running_loop().time())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _request(self, api_key, endpoint, params):
+        client = self._get_client()
+
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(api_key)
+            try:
+                async with self._semaphore:
+                    response = await client.get(endpoint, params=params, headers={'x-access-key': api_key})
+                _record_timing(response)
+
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+
+                error = httpx.HTTPStatusError(f"Hiker returned {response.status_code}", request=response.request, response=response)
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+
+            logging.warning(f"Hiker request to {endpoint} failed ({error}), retrying")
+            await asyncio.sleep(2 ** attempt)
+
+    async def _resolve_user_id(self, job):
+        user = await self._request(job.api_key, HIKER_USER_BY_USERNAME_ENDPOINT, {'username': job.username})
+        return int(user['pk'])
+
+    async def scrape_async(self, job):
+        crawler = FollowerCrawler(job.followers_path, job.username, job.max_followers, SOURCE_HIKER, job.progress)
+        # The part file and cursor are read and written off the event loop
+        page_id = await asyncio.to_thread(crawler.open)
+        consuming = None
+        try:
+            user_id = job.user_id if job.user_id is not None else await self._resolve_user_id(job)
+
+            while not crawler.finished:
+                params = {'user_id': user_id}
+                if page_id is not None:
+                    params['page_id'] = page_id
+
+                started = asyncio.get_running_loop().time()
+                page = await self._request(job.api_key, HIKER_FOLLOWERS_ENDPOINT, params)
+                metrics.HIKER_PAGE_SECONDS.observe(asyncio.get_running_loop().time() - started, tenant=job.user, account=job.username)
+                metrics.FOLLOWERS_RECEIVED.inc(len(page['response']['users']), tenant=job.user, account=job.username)
+                next_page_id = page.get('next_page_id')
+
+                # Cancelling the await does not stop the thread, shield it so the cleanup can wait for the page
+                consuming = asyncio.ensure_future(asyncio.to_thread(crawler.consume_page, page['response']['users'], next_page_id))
+                if await asyncio.shield(consuming):
+                    break
+                page_id = next_page_id
+        except BaseException:
+            if consuming is not None:
+                # Close the files only once the page being written is on disk
+                await asyncio.wait({consuming})
+            crawler.close()
+            raise
+
+        return await asyncio.to_thread(crawler.finish)
+
+_async_scraper = None
+_async_scraper_lock = threading.Lock()
+
+
+def get_async_scraper():
+    """Return the process-wide AsyncHikerScraper configured from the HIKER_* settings."""
+
+    global _async_scraper
+
+    with _async_scraper_lock:
+        if _async_scraper is None:
+            _async_scraper = AsyncHikerScraper(
+                max_concurrency=config('HIKER_MAX_CONCURRENCY', default=20, cast=int),
+                rate_limit=config('HIKER_RATE_LIMIT', default=10, cast=float),
+                burst=config('HIKER_RATE_BURST', default=10, cast=int),
+                timeout=config('HIKER_TIMEOUT', default=30, cast=float),
+            )
+    return _async_scraper
@@ -0,0 +1,112 @@
+"""
+Persistent history of the jobs: one JobRun per scrape or close friends job, with the
+aggregations the admin shows. In the step and batch modes a job is a chain of tasks
+handed the same lease, each one ending 'paused'; the next task of the chain (same
+chain id) extends the same JobRun, counting the time in between as sleep. Every
+record also adds a JobRunSegment, with the part of the run since the previous one and
+the proxy it went through, which the daily aggregates are computed from.
+"""
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+from .lease import current_chain_id
+from .log import current_job_id
+
+STOP_PAUSED = 'paused'
+
+
+def record_job_run(user, username, kind, started, items=0, added=0, sleep_seconds=0.0, active_seconds=None, stop_reason=STOP_PAUSED, error='', proxy='', ended=None, chain_id=None):
+    """
+    Record a run that started at the started timestamp and ends at ended (now by default),
+    as a new JobRun or as the continuation of the paused JobRun of the same chain_id
+    (the chain of the lease held by the running code by default). active_seconds
+    defaults to the part of the run that was not spent sleeping.
+    """
+
+    try:
+        from django.db import transaction
+        from Core.models import JobRun, JobRunSegment
+
+        chain_id = chain_id or current_chain_id() or ''
+        ended = time.time() if ended is None else ended
+        if active_seconds is None:
+            active_seconds = max(ended - started - sleep_seconds, 0.0)
+
+        with transaction.atomic():
+            run = None
+            if chain_id:
+                run = JobRun.objects.select_for_update().filter(
+                    user=user, username=username, kind=kind, chain_id=chain_id, stop_reason=STOP_PAUSED,
+                ).order_by('-ended_when').first()
+
+            if run is None:
+                run = JobRun(
+                    user=user, username=username, kind=kind, chain_id=chain_id,
+                    started_when=datetime.fromtimestamp(started, timezone.utc), items=0, added=0, sleep_seconds=0.0, active_seconds=0.0,
+                )
+            else:
+                # The job waited in the queue between its tasks
+                sleep_seconds += max(started - run.ended_when.timestamp(), 0.0)
+                started = min(started, run.ended_when.timestamp())
+
+            run.task_id = current_job_id() or run.task_id
+            run.proxy = proxy or run.proxy
+            run.ended_when = datetime.fromtimestamp(ended, timezone.utc)
+            run.duration_seconds = max(ended - run.started_when.timestamp(), 0.0)
+            run.items += items
+            run.added += added
+            run.sleep_seconds += sleep_seconds
+            run.active_seconds += active_seconds
+            run.adds_per_minute = run.added / (run.duration_seconds / 60) if run.duration_seconds else 0.0
+            run.stop_reason = stop_reason or STOP_PAUSED
+            run.error = error or ''
+            run.save()
+
+            JobRunSegment.objects.create(
+                run=run, task_id=current_job_id() or '', proxy=proxy or '',
+                started_when=datetime.fromtimestamp(started, timezone.utc), ended_when=run.ended_when,
+                duration_seconds=max(ended - started, 0.0), items=items, added=added,
+                sleep_seconds=sleep_seconds, active_seconds=active_seconds, stop_reason=run.stop_reason,
+            )
+    except Exception as e:
+        # The history must never fail the job it records
+        logging.warning(f"Failed to record the {kind} run of {username}: {e}")
+
+
+def _daily_stats(group_by, kind=None, days=30):
+    """Aggregate the run segments per day they ended on and group_by, so a run spanning several days counts on each of them."""
+
+    from django.db.models import Count, Sum, Q, F, FloatField, ExpressionWrapper
+    from django.db.models.functions import TruncDate, NullIf
+    from Core.models import JobRunSegment
+
+    segments = JobRunSegment.objects.filter(ended_when__gte=datetime.now(timezone.utc) - timedelta(days=days))
+    if kind is not None:
+        segments = segments.filter(run__kind=kind)
+
+    return segments.annotate(day=TruncDate('ended_when'), user=F('run__user'), username=F('run__username')).values('day', *group_by).annotate(
+        runs=Count('run', distinct=True),
+        items=Sum('items'),
+        added=Sum('added'),
+        duration=Sum('duration_seconds'),
+        sleep=Sum('sleep_seconds'),
+        active=Sum('active_seconds'),
+        feedback_required=Count('id', filter=Q(stop_reason='feedback_required')),
+        errors=Count('id', filter=Q(stop_reason='error')),
+    ).annotate(
+        adds_per_hour=ExpressionWrapper(F('added') * 3600.0 / NullIf(F('duration'), 0.0), output_field=FloatField()),
+        active_share=ExpressionWrapper(F('active') / NullIf(F('duration'), 0.0), output_field=FloatField()),
+    ).order_by('-day', *group_by)
+
+
+def account_stats(kind=None, days=30):
+    """Per day and account: runs, items, adds, time asleep and active, adds per hour, soft blocks and errors."""
+
+    return _daily_stats(('user', 'username'), kind, days)
+
+
+def proxy_stats(kind=None, days=30):
+    """The account_stats() aggregates per day and proxy."""
+
+    return _daily_stats(('proxy',), kind, days)
@@ -0,0 +1,210 @@
+import os
+import uuid
+import socket
+import logging
+import threading
+import contextvars
+from datetime import timedelta
+
+from decouple import config
+
+# A running task renews its lease every LEASE_TTL / 3 seconds, a lease that is not renewed
+# for LEASE_TTL seconds (worker killed) can be taken over
+LEASE_TTL = config('JOB_LEASE_TTL', default=300, cast=int)
+# How long a job sent to its Celery queue may wait there before another one can be enqueued for the account
+QUEUE_TTL = config('JOB_LEASE_QUEUE_TTL', default=3600, cast=int)
+
+HOLDER = f'{socket.gethostname()}:{os.getpid()}'
+
+_current_lease = contextvars.ContextVar('lease', default=None)
+
+
+class LeaseLost(Exception):
+    """Raised in a job whose lease was taken over by another task, which now runs the job."""
+    pass
+
+
+def current_chain_id():
+    """The chain id of the job the running code holds the lease of, if any."""
+
+    lease = _current_lease.get()
+    return lease.chain_id if lease is not None else None
+
+
+def check_lease():
+    """Raise LeaseLost when the lease of the running job (taken by AccountLease.acquire()) was lost."""
+
+    lease = _current_lease.get()
+    if lease is not None and lease.lost.is_set():
+        raise LeaseLost(f"Lost the {lease.kind} lease on {lease.username} to another task")
+
+
+def _now():
+    from django.utils import timezone
+
+    return timezone.now()
+
+
+def enqueue_once(task, user, username, kind, **kwargs):
+    """
+    Request a job for an account unless a job of the same kind is already waiting,
+    queued or running on it. The job waits for a free slot of its tenant and is sent to
+    its queue by the dispatcher. Returns the id of the new or existing job and whether
+    it was enqueued.
+    """
+
+    from django.db import transaction
+    from Core.models import JobLease
+    from .dispatch import dispatch
+
+    now = _now()
+    with transaction.atomic():
+        lease, created = JobLease.objects.select_for_update().get_or_create(
+            user=user, username=username, kind=kind,
+            defaults={'task_id': '', 'expires_when': now},
+        )
+        if not created and (lease.dispatched_when is None or lease.expires_when > now):
+            return lease.task_id, False
+
+        lease.task_id = str(uuid.uuid4())
+        lease.chain_id = uuid.uuid4().hex
+        lease.task_name = task.name
+        lease.task_kwargs = {'user': user, 'username': username, **kwargs}
+        lease.holder = ''
+        lease.heartbeat_when = None
+        lease.enqueued_when = now
+        lease.dispatched_when = None
+        lease.expires_when = now + timedelta(seconds=QUEUE_TTL)
+        lease.save()
+
+        transaction.on_commit(lambda: dispatch(kind))
+    return lease.task_id, True
+
+
+class AccountLease:
+    """
+    Lease of one kind of job on an Instagram account, held by the task running it.
+    Only the task the lease was handed to (or any task once it expired) can acquire it,
+    and only while no worker is running it, so a duplicate task, or a redelivered copy of
+    the running one (same task id), backs off instead of running a second loop on the
+    same account. While held, a background thread renews the lease every LEASE_TTL / 3
+    seconds; when the lease was taken over in the meantime, lost is set and the job stops
+    at its next check_lease(). Tasks that reschedule themselves hand the lease off to
+    their next task.
+    Attributes:
+        user (str): The username of the bot operator.
+        username (str): The Instagram username the job runs on.
+        kind (str): SCRAPE_JOB or CLOSE_FRIENDS_JOB.
+        task_id (str): The id of the task taking the lease.
+        holder (str): Identifies this acquisition in the lease row, the process plus a random suffix.
+        chain_id (str): The job's chain id, kept across hand-offs, set once acquired.
+        lost (threading.Event): Set once the lease was taken over by another task.
+    """
+    def __init__(self, user, username, kind, task_id):
+        self.user = user
+        self.username = username
+        self.kind = kind
+        self.task_id = task_id
+        self.holder = f'{HOLDER}:{uuid.uuid4().hex[:8]}'
+        self.chain_id = None
+        self.lost = threading.Event()
+
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _leases(self):
+        from Core.models import JobLease
+
+        return JobLease.objects.filter(user=self.user, username=self.username, kind=self.kind)
+
+    def _held(self):
+        """The lease row while this acquisition still holds it."""
+
+        return self._leases().filter(task_id=self.task_id, holder=self.holder)
+
+    def acquire(self):
+        """Take the lease. Returns False when another live task holds it."""
+
+        from django.db import transaction
+        from Core.models import JobLease
+
+        now = _now()
+        with transaction.atomic():
+            lease, created = JobLease.objects.select_for_update().get_or_create(
+                user=self.user, username=self.username, kind=self.kind,
+                defaults={'task_id': self.task_id, 'expires_when': now},
+            )
+            # A holder is only set while a worker runs the task, a redelivered copy of it has the same task id
+            if not created and lease.expires_when > now and (lease.task_id != self.task_id or lease.holder):
+                logging.warning(f"{self.kind} job on {self.username} is already held by task {lease.task_id} ({lease.holder or 'queued'})")
+                return False
+
+            if lease.enqueued_when is not None and lease.task_id == self.task_id and not lease.heartbeat_when:
+                logging.info(f"{self.kind} job on {self.username} started after {(now - lease.enqueued_when).total_seconds():.0f} seconds")
+
+            lease.task_id = self.task_id
+            lease.holder = self.holder
+            # Taken over after the holder died, the job goes on under the same chain
+            lease.chain_id = lease.chain_id or uuid.uuid4().hex
+            # Taken directly (e.g. by the gevent runner), not through the dispatcher
+            lease.dispatched_when = lease.dispatched_when or now
+            lease.heartbeat_when = now
+            lease.expires_when = now + timedelta(seconds=LEASE_TTL)
+            lease.save()
+
+        self.chain_id = lease.chain_id
+        _current_lease.set(self)
+        self._heartbeat = threading.Thread(target=self._renew, name=f'lease-{self.username}', daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def renew(self):
+        """Extend the lease by LEASE_TTL. Returns False, and sets lost, when another task took it over."""
+
+        now = _now()
+        if self._held().update(heartbeat_when=now, expires_when=now + timedelta(seconds=LEASE_TTL)):
+            return True
+
+        # e.g. the worker stalled for longer than LEASE_TTL and another task took the job over
+        logging.warning(f"Lost the {self.kind} lease on {self.username}, stopping the job")
+        self.lost.set()
+        return False
+
+    def _renew(self):
+        from .green import release_db_connection
+
+        # The heartbeat is asleep between renewals, its connection is not kept open for the life of the lease
+        while not self._stop.wait(LEASE_TTL / 3):
+            try:
+                if not self.renew():
+                    return
+            finally:
+                release_db_connection()
+
+    def _stop_heartbeat(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        if _current_lease.get() is self:
+            _current_lease.set(None)
+
+    def hand_off(self, countdown):
+        """Pass the lease to the task that continues the job in countdown seconds and return that task's id."""
+
+        self._stop_heartbeat()
+        next_task_id = str(uuid.uuid4())
+        self._held().update(
+            task_id=next_task_id, holder='', heartbeat_when=None, enqueued_when=None,
+            expires_when=_now() + timedelta(seconds=countdown + QUEUE_TTL),
+        )
+        return next_task_id
+
+    def release(self):
+        from .dispatch import dispatch
+
+        self._stop_heartbeat()
+        # A lost lease belongs to another task now
+        self._held().delete()
+        # The tenant has a free slot again
+        dispatch(self.kind)
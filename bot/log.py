@@ -0,0 +1,227 @@
+"""
+Logging pipeline of the bot.
+
+Records are put on an in-memory queue by a QueueHandler on the root logger and written
+by a QueueListener thread, so workers never block on file writes while they scrape or
+add followers. Every record is written as one JSON line tagged with the tenant, account
+and job id of the code that logged it, to users/bot.log and, when it belongs to an
+account, to users/<tenant>/logs/<account>.log. Per-item events (one line per follower)
+are logged with extra={'sample': True} and only a fraction of them is kept, per level.
+
+Every process (web, each prefork worker child) has its own listener appending to the
+same files, so the files are not rotated from Python, where one process would rename a
+file from under the others. Rotate them externally instead; the handlers notice the
+rename and reopen the file, e.g. with logrotate:
+
+    /path/to/users/bot.log /path/to/users/*/logs/*.log {
+        size 10M
+        rotate 5
+        compress
+        delaycompress
+        missingok
+    }
+"""
+import os
+import re
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+from decouple import config
+
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+# Open per-account log files kept by the listener, the least recently used is closed
+LOG_ACCOUNT_FILES = config('LOG_ACCOUNT_FILES', default=64, cast=int)
+# Share of sampled (per-item) records kept, per level; warnings and errors are always kept
+SAMPLE_RATES = {
+    logging.DEBUG: config('LOG_SAMPLE_RATE_DEBUG', default=0.01, cast=float),
+    logging.INFO: config('LOG_SAMPLE_RATE_INFO', default=0.1, cast=float),
+}
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+_tenant = contextvars.ContextVar('tenant', default=None)
+_account = contextvars.ContextVar('account', default=None)
+_job_id = contextvars.ContextVar('job_id', default=None)
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def set_log_context(tenant=None, account=None, job_id=None):
+    """Tag the records logged from now on in this thread (or task). Returns the tokens for reset_log_context()."""
+
+    return _tenant.set(tenant), _account.set(account), _job_id.set(job_id)
+
+
+def reset_log_context(tokens):
+    for var, token in zip((_tenant, _account, _job_id), tokens):
+        var.reset(token)
+
+
+def current_job_id():
+    """The job (Celery task) id of the running code, if any."""
+
+    return _job_id.get()
+
+
+@contextmanager
+def log_context(tenant=None, account=None, job_id=None):
+    tokens = set_log_context(tenant, account, job_id)
+    try:
+        yield
+    finally:
+        reset_log_context(tokens)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the log context onto the record in the logging thread, before it is queued."""
+
+    def filter(self, record):
+        for name, var in (('tenant', _tenant), ('account', _account), ('job_id', _job_id)):
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only SAMPLE_RATES[level] of the records logged with extra={'sample': True}."""
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False):
+            return True
+        rate = SAMPLE_RATES.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': ANSI_ESCAPE.sub('', record.getMessage()),
+            'tenant': getattr(record, 'tenant', None),
+            'account': getattr(record, 'account', None),
+            'job_id': getattr(record, 'job_id', None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AccountFileHandler(logging.Handler):
+    """
+    Write the records of an account to users/<tenant>/logs/<account>.log, reopened once rotated.
+    Only used from the QueueListener thread.
+    Attributes:
+        base_dir (str): The users directory.
+    """
+    def __init__(self, base_dir):
+        super().__init__()
+        self.base_dir = base_dir
+        self._handlers = OrderedDict()
+
+    def _handler(self, tenant, account):
+        key = (tenant, account)
+        handler = self._handlers.get(key)
+        if handler is None:
+            directory = os.path.join(self.base_dir, tenant, 'logs')
+            os.makedirs(directory, exist_ok=True)
+            handler = self._handlers[key] = WatchedFileHandler(os.path.join(directory, f'{account}.log'), encoding='utf-8')
+            handler.setFormatter(self.formatter)
+            while len(self._handlers) > LOG_ACCOUNT_FILES:
+                self._handlers.popitem(last=False)[1].close()
+        self._handlers.move_to_end(key)
+        return handler
+
+    def emit(self, record):
+        tenant, account = getattr(record, 'tenant', None), getattr(record, 'account', None)
+        if not tenant or not account:
+            return
+        try:
+            self._handler(tenant, account).emit(record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        self._handlers.clear()
+        super().close()
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler putting the records on the queue unformatted, so the listener's JsonFormatter
+    still sees the message and the exception apart. The stock prepare() merges the
+    traceback into the message.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            # The traceback objects are not kept alive on the queue
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(base_dir):
+    """Route the root logger through the queue to the JSON log files, once per process."""
+
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        formatter = JsonFormatter()
+        main_file = WatchedFileHandler(os.path.join(base_dir, 'bot.log'), encoding='utf-8')
+        main_file.setFormatter(formatter)
+        account_files = AccountFileHandler(base_dir)
+        account_files.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = RecordQueueHandler(log_queue)
+        # Filters run in the thread that logs, so sampled records never reach the queue
+        queue_handler.addFilter(SamplingFilter())
+        queue_handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        _listener = QueueListener(log_queue, main_file, account_files, respect_handler_level=True)
+        _listener.start()
+        atexit.register(lambda: _listener.stop())
+
+
+def _restart_listener():
+    # A forked child (prefork worker) inherits the queue handler but not the listener thread. It gets
+    # a queue of its own, the records still in the inherited copy are written by the parent.
+    global _listener
+
+    if _listener is not None:
+        log_queue = queue.SimpleQueue()
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, QueueHandler):
+                handler.queue = log_queue
+        _listener = QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener)
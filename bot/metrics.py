@@ -0,0 +1,377 @@
+"""
+Prometheus-style metrics of the bot's hot paths.
+
+Every process (web or worker) keeps its own counters and histograms in the module-level
+registry and renders them in the Prometheus text format. Workers serve their registry
+on METRICS_PORT (one port per worker process, counting up from it), and every process
+flushes a snapshot to the shared jobs cache every FLUSH_INTERVAL seconds, which the
+Django /metrics view merges into a single exposition of the whole deployment. The
+snapshot of a process that stopped flushing (e.g. a prefork child recycled after
+max-tasks-per-child) is folded into the retired totals, so the merged counters never
+go down.
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from decouple import config
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=15, cast=float)
+# Snapshots of processes that stopped flushing are folded into the retired totals after this many seconds
+SNAPSHOT_TIMEOUT = config('METRICS_SNAPSHOT_TIMEOUT', default=600, cast=int)
+
+
+def _process():
+    # Not computed at import, prefork children import the module in the parent
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _jobs_cache():
+    from django.core.cache import caches
+
+    return caches['jobs']
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class Metric:
+    """
+    Base of the metric types: a family of samples keyed by their label values.
+    Attributes:
+        name (str): The metric name.
+        help (str): One line description.
+        labelnames (tuple): Names of the labels every sample carries.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'type': self.type,
+                'help': self.help,
+                'labelnames': self.labelnames,
+                'samples': {key: self._copy(value) for key, value in self._samples.items()},
+            }
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+        registry.maybe_flush()
+
+
+class Histogram(Metric):
+    """A Metric counting observations into cumulative le buckets, with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['buckets'][index] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+        registry.maybe_flush()
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = self.buckets
+        return snapshot
+
+    def _copy(self, value):
+        return {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+
+
+def merge_snapshots(snapshots):
+    """Sum the samples of several registry snapshots (e.g. one per worker process)."""
+
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'samples': {}})
+            for key, value in metric['samples'].items():
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value if metric['type'] == 'counter' else {
+                        'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count'],
+                    }
+                elif metric['type'] == 'counter':
+                    target['samples'][key] = current + value
+                else:
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+    return merged
+
+
+def render(snapshot):
+    """Render a registry snapshot in the Prometheus text exposition format."""
+
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric['labelnames']
+
+        for key, value in sorted(metric['samples'].items()):
+            if metric['type'] == 'counter':
+                lines.append(f'{name}{_format_labels(labelnames, key)} {value}')
+                continue
+
+            for bound, count in zip(metric['buckets'], value['buckets']):
+                lines.append(f"{name}_bucket{_format_labels(labelnames, key, [('le', _format_bound(bound))])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, key)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labelnames, key)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+class Registry:
+    """The metrics of the process, flushed to the jobs cache every FLUSH_INTERVAL seconds by a background thread."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._flushed_at = 0.0
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def render(self):
+        return render(self.snapshot())
+
+    def maybe_flush(self):
+        if self._flusher is None:
+            self._start_flusher()
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def _start_flusher(self):
+        # An idle process keeps flushing, so it is not taken for a dead one and retired
+        with self._flush_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+                self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _after_fork(self):
+        # A forked child starts from zero (the parent flushes its own counters) and without the parent's thread
+        for metric in self._metrics.values():
+            metric._samples = {}
+            metric._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def flush(self):
+        """Publish the snapshot of the process to the jobs cache, for the /metrics view to merge."""
+
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._flushed_at = time.monotonic()
+            process = _process()
+            cache = _jobs_cache()
+            cache.set(f'metrics:{process}', self.snapshot(), None)
+
+            from .scheduler import _cache_lock
+
+            with _cache_lock('metrics:processes'):
+                processes = cache.get('metrics:processes') or {}
+                now = time.time()
+                dead = [dead for dead, seen in processes.items() if now - seen >= SNAPSHOT_TIMEOUT and dead != process]
+                if dead:
+                    _retire(cache, dead)
+                    for dead_process in dead:
+                        del processes[dead_process]
+                processes[process] = now
+                cache.set('metrics:processes', processes, None)
+        except Exception as e:
+            # Metrics must never break the work they measure
+            logging.warning(f"Failed to flush metrics: {e}")
+        finally:
+            self._flush_lock.release()
+
+
+def _retire(cache, processes):
+    """Fold the last snapshots of processes that stopped flushing into the retired totals."""
+
+    keys = [f'metrics:{process}' for process in processes]
+    snapshots = list(cache.get_many(keys).values())
+    retired = cache.get('metrics:retired')
+    if retired is not None:
+        snapshots.append(retired)
+    cache.set('metrics:retired', merge_snapshots(snapshots), None)
+    cache.delete_many(keys)
+    logging.info(f"Retired the metrics of {', '.join(processes)}")
+
+
+registry = Registry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
+def collect_all():
+    """Return the merged snapshots every live process flushed to the jobs cache, plus the retired totals."""
+
+    registry.flush()
+    cache = _jobs_cache()
+    processes = cache.get('metrics:processes') or {}
+    snapshots = list(cache.get_many([f'metrics:{process}' for process in processes]).values())
+    retired = cache.get('metrics:retired')
+    if retired is not None:
+        snapshots.append(retired)
+    return merge_snapshots(snapshots)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server_port = None
+
+
+def start_http_server(port, attempts=64):
+    """
+    Serve the registry of this process on the first free port from port onwards, so every
+    worker process of a host gets its own. Returns the port, or None when none was free.
+    """
+
+    for candidate in range(port, port + attempts):
+        try:
+            server = ThreadingHTTPServer(('', candidate), _MetricsHandler)
+        except OSError:
+            continue
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        logging.info(f"Serving metrics on port {candidate}")
+        return candidate
+    return None
+
+
+def serve_worker_metrics():
+    """Start the metrics server of a worker process on METRICS_PORT onwards, once per process."""
+
+    global _server_port
+
+    port = config('METRICS_PORT', default=0, cast=int)
+    if port and _server_port is None:
+        _server_port = start_http_server(port)
+
+
+# Close friends
+CLOSE_FRIEND_ADD_SECONDS = registry.histogram(
+    'ig_close_friend_add_seconds', 'Duration of a close friends add request.', ('tenant', 'account', 'outcome'),
+)
+CLOSE_FRIENDS_ADDED = registry.counter(
+    'ig_close_friends_added_total', 'Followers added to close friends.', ('tenant', 'account'),
+)
+SOFT_BLOCKS = registry.counter(
+    'ig_soft_blocks_total', 'FeedbackRequired and throttling errors.', ('tenant', 'account', 'kind'),
+)
+SLEEP_SECONDS = registry.counter(
+    'close_friends_sleep_seconds_total', 'Time close friends runs spent waiting for their next action.', ('tenant', 'account'),
+)
+WORK_SECONDS = registry.counter(
+    'close_friends_work_seconds_total', 'Time close friends runs spent making requests.', ('tenant', 'account'),
+)
+
+# Instagram login
+LOGIN_SECONDS = registry.histogram(
+    'ig_login_seconds', 'Duration of an Instagram login with credentials.', ('tenant', 'account', 'outcome'),
+)
+
+# Hiker
+HIKER_PAGE_SECONDS = registry.histogram(
+    'hiker_followers_page_seconds', 'Duration of a Hiker followers page request.', ('tenant', 'account'),
+)
+FOLLOWERS_RECEIVED = registry.counter(
+    'hiker_followers_received_total', 'Followers received in Hiker pages.', ('tenant', 'account'),
+)
+
+# Celery
+TASK_SECONDS = registry.histogram(
+    'celery_task_seconds', 'Duration of a Celery task.', ('task', 'tenant', 'account', 'state'),
+)
@@ -0,0 +1,160 @@
+"""
+Opt-in profiling of Celery tasks.
+
+Tasks named in PROFILE_TASKS are always profiled and the others with probability
+PROFILE_SAMPLE_RATE. A profiled task runs under cProfile, and with PROFILE_TRACEMALLOC
+under tracemalloc too. The result is stored as a TaskProfile keyed by the task id: the
+wall and CPU time, the peak traced memory, the top functions and allocation sites, and
+the raw profile, which can be downloaded from the admin and opened with pstats or
+snakeviz. Only one task per process is profiled at a time, the others run untouched,
+so a small sample rate can stay on in production.
+
+What a profile covers:
+    - cProfile and the CPU time only see the task's own thread. Work the task hands to
+      another thread is missing: with HIKER_SCRAPE_MODE=async the scrape runs on the
+      AsyncHikerScraper loop thread, and its profile shows the task waiting in
+      future.result(). Profile bot.hiker.AsyncHikerScraper.run() directly (e.g. the
+      benchmarks) to see the engine itself.
+    - tracemalloc is process-wide. Under a threads or gevent pool the peak memory and
+      allocation sites include every task running in the process at the same time, and
+      the async engine's allocations for other accounts; they are only the task's own
+      on a prefork (or solo) worker.
+"""
+import io
+import time
+import random
+import marshal
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+
+from decouple import config, Csv
+
+# Task names that are always profiled, '*' for every task
+PROFILE_TASKS = config('PROFILE_TASKS', default='', cast=Csv())
+# Share of the other tasks that are profiled
+PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+# Also trace memory allocations, which slows the task down noticeably more than cProfile
+PROFILE_TRACEMALLOC = config('PROFILE_TRACEMALLOC', default=True, cast=bool)
+# Functions and allocation sites kept in the summary
+PROFILE_TOP = config('PROFILE_TOP', default=25, cast=int)
+
+_active = threading.Lock()
+
+
+def should_profile(task_name):
+    if '*' in PROFILE_TASKS or task_name in PROFILE_TASKS:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class TaskProfiler:
+    """
+    cProfile and tracemalloc session around one task, run on the task's thread. The
+    profile and CPU time are those of that thread, the memory figures those of the
+    whole process (see the module docstring).
+    Attributes:
+        task_name (str): The name of the profiled task.
+    """
+    def __init__(self, task_name):
+        self.task_name = task_name
+
+        self._profile = cProfile.Profile()
+        self._tracing = False
+
+    def start(self):
+        if PROFILE_TRACEMALLOC and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        elif tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self._profile.enable()
+
+    def stop(self):
+        """Stop profiling and return the summary of the task and its raw profile (marshalled pstats)."""
+
+        self._profile.disable()
+        wall_seconds = time.perf_counter() - self.started
+        cpu_seconds = time.thread_time() - self.cpu_started
+
+        peak_memory = None
+        top_allocations = []
+        if tracemalloc.is_tracing():
+            # Process-wide, includes the tasks running next to this one on a threads or gevent pool
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            top_allocations = [
+                {'site': str(statistic.traceback), 'size': statistic.size, 'count': statistic.count}
+                for statistic in tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP]
+            ]
+        if self._tracing:
+            tracemalloc.stop()
+
+        # Stats takes the profile's data over
+        stats = pstats.Stats(self._profile, stream=io.StringIO())
+        raw_stats = marshal.dumps(stats.stats)
+        top_functions = []
+        for function in stats.sort_stats(pstats.SortKey.CUMULATIVE).fcn_list[:PROFILE_TOP]:
+            calls, primitive_calls, total, cumulative, _ = stats.stats[function]
+            filename, line, name = function
+            top_functions.append({
+                'function': f'{filename}:{line}({name})', 'calls': calls, 'total': total, 'cumulative': cumulative,
+            })
+
+        summary = {
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': cpu_seconds,
+            # Time the task spent sleeping, waiting on the network or on another thread (the async scrape engine)
+            'waiting_seconds': max(wall_seconds - cpu_seconds, 0.0),
+            'peak_memory': peak_memory,
+            'top_functions': top_functions,
+            'top_allocations': top_allocations,
+        }
+        return summary, raw_stats
+
+
+def start_profile(task_name):
+    """Start profiling a task when it is selected and no other task of the process is profiled. Returns the profiler or None."""
+
+    if not should_profile(task_name) or not _active.acquire(blocking=False):
+        return None
+    try:
+        profiler = TaskProfiler(task_name)
+        profiler.start()
+    except Exception as e:
+        # e.g. another profiler (coverage, a debugger) is already active
+        _active.release()
+        logging.warning(f"Could not profile task {task_name}: {e}")
+        return None
+    return profiler
+
+
+def finish_profile(profiler, task_id, user='', username='', state=''):
+    """Stop a profiler started by start_profile() and store its TaskProfile."""
+
+    try:
+        summary, stats = profiler.stop()
+    finally:
+        _active.release()
+
+    try:
+        from Core.models import TaskProfile
+
+        TaskProfile.objects.update_or_create(task_id=task_id, defaults={
+            'task_name': profiler.task_name,
+            'user': user or '',
+            'username': username or '',
+            'state': state or '',
+            'wall_seconds': summary['wall_seconds'],
+            'cpu_seconds': summary['cpu_seconds'],
+            'peak_memory': summary['peak_memory'],
+            'summary': summary,
+            'stats': stats,
+        })
+    except Exception as e:
+        # Profiling must never fail the task it measures
+        logging.warning(f"Failed to save the profile of task {task_id}: {e}")
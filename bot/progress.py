@@ -0,0 +1,115 @@
+import time
+
+SCRAPE_JOB = 'scrape'
+CLOSE_FRIENDS_JOB = 'close_friends'
+
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+
+def _jobs_cache():
+    from django.core.cache import caches
+
+    return caches['jobs']
+
+
+def progress_key(user, username, kind):
+    return f'progress:{user}:{username}:{kind}'
+
+
+class JobProgress:
+    """
+    Live progress of a running scrape or close friends job, published to the shared
+    'jobs' cache for the accounts page to poll.
+    Publishing is throttled to once every publish_interval seconds, so calling
+    advance() for every follower stays cheap.
+    Attributes:
+        user (str): The username of the bot operator.
+        username (str): The Instagram username the job runs on.
+        kind (str): SCRAPE_JOB or CLOSE_FRIENDS_JOB.
+        total (int): Number of items the job will process.
+        processed (int): Number of items processed so far.
+        rate (float): Smoothed number of items processed per minute.
+        last_error (str): The last error the job ran into.
+        state (str): 'running', 'done' or 'stopped'.
+        clock (callable): Returns the current time in seconds.
+    """
+    def __init__(self, user, username, kind, total, processed=0, publish_interval=2, clock=time.time):
+        self.user = user
+        self.username = username
+        self.kind = kind
+        self.total = total
+        self.processed = processed
+        self.publish_interval = publish_interval
+        self.clock = clock
+
+        self.rate = 0.0
+        self.last_error = None
+        self.state = 'running'
+        self.started_at = clock()
+
+        self._published_at = None
+        self._published_processed = processed
+
+    def advance(self, count=1):
+        self.processed += count
+        self.publish()
+
+    def update(self, processed):
+        self.processed = processed
+        self.publish()
+
+    def error(self, message):
+        self.last_error = str(message)
+        self.publish(force=True)
+
+    def finish(self, state='done'):
+        self.state = state
+        self.publish(force=True)
+
+    def eta(self):
+        """Seconds left at the current rate, or None while the rate is unknown."""
+
+        if self.rate <= 0:
+            return None
+        return max(self.total - self.processed, 0) / self.rate * 60
+
+    def publish(self, force=False):
+        now = self.clock()
+        if not force and self._published_at is not None and now - self._published_at < self.publish_interval:
+            return
+
+        since = self._published_at if self._published_at is not None else self.started_at
+        if now > since:
+            current_rate = (self.processed - self._published_processed) / (now - since) * 60
+            # Exponential moving average so a single slow action does not make the rate jump around
+            self.rate = current_rate if self._published_at is None else 0.3 * current_rate + 0.7 * self.rate
+
+        self._published_at = now
+        self._published_processed = self.processed
+
+        _jobs_cache().set(progress_key(self.user, self.username, self.kind), {
+            'processed': self.processed,
+            'total': self.total,
+            'rate': round(self.rate, 2),
+            'eta': self.eta(),
+            'last_error': self.last_error,
+            'state': self.state,
+            'started_at': self.started_at,
+            'updated_at': now,
+        }, PROGRESS_TIMEOUT)
+
+
+def get_progress(user, usernames):
+    """Return the published progress of every job of the given accounts, keyed by username then job kind."""
+
+    keys = {
+        progress_key(user, username, kind): (username, kind)
+        for username in usernames
+        for kind in (SCRAPE_JOB, CLOSE_FRIENDS_JOB)
+    }
+
+    progress = {username: {} for username in usernames}
+    for key, value in _jobs_cache().get_many(keys).items():
+        username, kind = keys[key]
+        progress[username][kind] = value
+    return progress
@@ -0,0 +1,209 @@
+import time
+import hashlib
+import logging
+from urllib.parse import urlsplit
+
+from decouple import config, Csv
+
+from .scheduler import _jobs_cache, _cache_lock, CacheLockTimeout
+
+PROXY_STATE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+class NoProxyAvailable(Exception):
+    """Raised when every proxy of the pool is down or full."""
+    pass
+
+
+class Proxy:
+    """
+    One egress proxy of the pool.
+    Attributes:
+        url (str): The proxy URL given to instagrapi, with credentials.
+        key (str): host:port of the proxy, used to key its shared state.
+    """
+    def __init__(self, url):
+        self.url = url
+        parts = urlsplit(url)
+        self.key = f'{parts.hostname}:{parts.port}'
+
+    def __repr__(self):
+        return f'Proxy({self.key})'
+
+
+class ProxyPool:
+    """
+    Pool of egress proxies the close friends runs are spread over.
+    An account sticks to the proxy it was last assigned to as long as that proxy is up
+    and has room, since Instagram dislikes sessions hopping between IPs. New accounts
+    are placed by rendezvous hashing, which spreads them evenly and keeps most
+    assignments in place when a proxy joins or leaves the pool. Every proxy keeps a
+    rolling (EWMA) latency and error rate; a proxy failing too often is taken out for
+    down_time seconds and its accounts fail over to the next proxy in their ranking.
+    The state lives in the shared jobs cache, so every worker sees the same health and
+    the same number of active accounts per proxy.
+    Attributes:
+        proxies (list): The Proxy objects of the pool.
+        max_accounts (int): Accounts allowed to run through one proxy at once, 0 for no cap.
+        max_error_rate (float): Error rate above which a proxy is taken out.
+        max_failures (int): Failures in a row after which a proxy is taken out.
+        down_time (int): Seconds a failing proxy stays out of the pool.
+        active_ttl (int): Seconds an account's slot on a proxy is kept without activity.
+    """
+    def __init__(self, proxies, max_accounts=0, max_error_rate=0.5, max_failures=3, down_time=300, active_ttl=900, clock=time.time):
+        self.proxies = proxies
+        self.max_accounts = max_accounts
+        self.max_error_rate = max_error_rate
+        self.max_failures = max_failures
+        self.down_time = down_time
+        self.active_ttl = active_ttl
+        self.clock = clock
+
+        self._by_key = {proxy.key: proxy for proxy in proxies}
+
+    def __bool__(self):
+        return bool(self.proxies)
+
+    def _health(self, proxy):
+        return _jobs_cache().get(f'proxy:health:{proxy.key}') or {'latency': None, 'error_rate': 0.0, 'failures': 0, 'down_until': 0}
+
+    def _active(self, proxy, now):
+        active = _jobs_cache().get(f'proxy:accounts:{proxy.key}') or {}
+        return {account: expires for account, expires in active.items() if expires > now}
+
+    def _ranking(self, account):
+        """Proxies in rendezvous hashing order for an account."""
+
+        def weight(proxy):
+            return hashlib.sha1(f'{account}|{proxy.key}'.encode()).digest()
+
+        return sorted(self.proxies, key=weight, reverse=True)
+
+    def acquire(self, user, username, exclude=()):
+        """
+        Take a slot for an account on its sticky proxy, or on the best ranked proxy that is
+        up and has room. Returns None when there is none.
+        """
+
+        account = f'{user}:{username}'
+        sticky_key = f'proxy:sticky:{account}'
+        now = self.clock()
+
+        sticky = self._by_key.get(_jobs_cache().get(sticky_key))
+        candidates = self._ranking(account)
+        if sticky is not None:
+            candidates.remove(sticky)
+            candidates.insert(0, sticky)
+
+        for proxy in candidates:
+            if proxy.key in exclude or self._health(proxy)['down_until'] > now:
+                continue
+
+            try:
+                with _cache_lock(f'proxy:accounts:{proxy.key}'):
+                    active = self._active(proxy, now)
+                    if self.max_accounts and account not in active and len(active) >= self.max_accounts:
+                        continue
+                    active[account] = now + self.active_ttl
+                    _jobs_cache().set(f'proxy:accounts:{proxy.key}', active, PROXY_STATE_TIMEOUT)
+            except CacheLockTimeout as e:
+                # Its slots cannot be counted, try the next proxy
+                logging.warning(f"{e}, skipping proxy {proxy.key}")
+                continue
+
+            if proxy is not sticky:
+                logging.info(f"Assigned {username} to proxy {proxy.key}")
+                _jobs_cache().set(sticky_key, proxy.key, PROXY_STATE_TIMEOUT)
+            return proxy
+
+        return None
+
+    def keep(self, user, username, proxy):
+        """Extend an account's slot on its proxy, long runs call this so the slot does not expire under them."""
+
+        account = f'{user}:{username}'
+        now = self.clock()
+        try:
+            with _cache_lock(f'proxy:accounts:{proxy.key}'):
+                active = self._active(proxy, now)
+                active[account] = now + self.active_ttl
+                _jobs_cache().set(f'proxy:accounts:{proxy.key}', active, PROXY_STATE_TIMEOUT)
+        except CacheLockTimeout as e:
+            # The slot still has most of its TTL, the next keep extends it
+            logging.warning(f"{e}, not extending the slot of {username}")
+
+    def release(self, user, username, proxy):
+        account = f'{user}:{username}'
+        try:
+            with _cache_lock(f'proxy:accounts:{proxy.key}'):
+                active = self._active(proxy, self.clock())
+                active.pop(account, None)
+                _jobs_cache().set(f'proxy:accounts:{proxy.key}', active, PROXY_STATE_TIMEOUT)
+        except CacheLockTimeout as e:
+            # The slot expires after active_ttl on its own
+            logging.warning(f"{e}, leaving the slot of {username} to expire")
+
+    def record(self, proxy, latency, ok):
+        """
+        Fold the outcome of one request into the proxy's rolling latency and error rate.
+        Returns False when the proxy was taken out of the pool.
+        """
+
+        key = f'proxy:health:{proxy.key}'
+        up = True
+        try:
+            with _cache_lock(key):
+                health = self._health(proxy)
+                if ok:
+                    health['latency'] = latency if health['latency'] is None else 0.2 * latency + 0.8 * health['latency']
+                    health['failures'] = 0
+                else:
+                    health['failures'] += 1
+                health['error_rate'] = 0.1 * (0.0 if ok else 1.0) + 0.9 * health['error_rate']
+
+                if not ok and (health['failures'] >= self.max_failures or health['error_rate'] > self.max_error_rate):
+                    logging.warning(f"Taking proxy {proxy.key} out of the pool for {self.down_time} seconds")
+                    health['down_until'] = self.clock() + self.down_time
+                    # Back in with a clean record, a proxy that still fails goes out again quickly
+                    health['failures'] = 0
+                    health['error_rate'] = 0.0
+                    up = False
+
+                _jobs_cache().set(key, health, PROXY_STATE_TIMEOUT)
+        except CacheLockTimeout as e:
+            # One outcome less in the rolling figures
+            logging.warning(f"{e}, not recording the outcome")
+        return up
+
+    def stats(self):
+        """Return the health and number of active accounts of every proxy."""
+
+        now = self.clock()
+        return {
+            proxy.key: {**self._health(proxy), 'active': len(self._active(proxy, now))}
+            for proxy in self.proxies
+        }
+
+
+def _proxy_urls():
+    """Proxy URLs from PROXY_POOL (comma separated, host:port entries use PROXY_LOGIN/PROXY_PASSWORD), or the single PROXY_HOST."""
+
+    login = config('PROXY_LOGIN', default='')
+    password = config('PROXY_PASSWORD', default='')
+    credentials = f'{login}:{password}@' if login else ''
+
+    entries = config('PROXY_POOL', default='', cast=Csv())
+    if not entries and config('PROXY_HOST', default=''):
+        entries = [f"{config('PROXY_HOST')}:{config('PROXY_PORT')}"]
+
+    return [entry if '://' in entry else f'http://{credentials}{entry}' for entry in entries]
+
+
+proxy_pool = ProxyPool(
+    [Proxy(url) for url in _proxy_urls()],
+    max_accounts=config('PROXY_MAX_ACCOUNTS', default=0, cast=int),
+    max_error_rate=config('PROXY_MAX_ERROR_RATE', default=0.5, cast=float),
+    max_failures=config('PROXY_MAX_FAILURES', default=3, cast=int),
+    down_time=config('PROXY_DOWN_TIME', default=300, cast=int),
+    active_ttl=config('PROXY_SLOT_TTL', default=900, cast=int),
+)
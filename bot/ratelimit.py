@@ -0,0 +1,36 @@
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+    The bucket does not read the clock itself, callers pass the current time so the
+    same bucket works with time.monotonic(), an event loop's time() or a stored timestamp.
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens (burst size).
+        tokens (float): Tokens currently available, negative when tokens are reserved ahead.
+        updated_at (float): Time of the last refill.
+    """
+    def __init__(self, rate, capacity, tokens=None, updated_at=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else tokens
+        self.updated_at = updated_at
+
+    def _refill(self, now):
+        if self.updated_at is not None and now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now if self.updated_at is None else max(now, self.updated_at)
+
+    def delay(self, now, tokens=1):
+        """Return the number of seconds until tokens are available, without taking them."""
+
+        self._refill(now)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def reserve(self, now, tokens=1):
+        """Take tokens, possibly ahead of time, and return the number of seconds to wait before using them."""
+
+        wait = self.delay(now, tokens)
+        self.tokens -= tokens
+        return wait
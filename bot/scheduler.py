@@ -0,0 +1,214 @@
+import os
+import time
+import fcntl
+import random
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from .ratelimit import TokenBucket
+from .throttle import AdaptiveRateController
+
+SCHEDULER_STATE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _jobs_cache():
+    from django.core.cache import caches
+
+    return caches['jobs']
+
+
+class CacheLockTimeout(Exception):
+    """Raised when a lock on the jobs cache could not be taken in time."""
+    pass
+
+
+@contextmanager
+def _file_lock(directory, key, attempts):
+    path = os.path.join(directory, f"{hashlib.md5(key.encode()).hexdigest()}.lock")
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        for _ in range(attempts):
+            try:
+                # Non-blocking, so a gevent worker only sleeps its own greenlet while waiting
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(0.01)
+        else:
+            raise CacheLockTimeout(f"Could not lock {key}")
+
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _cache_lock(key, timeout=5, attempts=50):
+    """
+    Cross-process lock on the jobs cache, used around read-modify-write of shared state.
+    The file based cache has no atomic add, it is locked with flock on a file next to its
+    entries (released by the kernel if the holder dies); the other backends use add, atomic
+    on Redis, Memcached and the in-memory cache. Raises CacheLockTimeout when the lock is
+    still held after attempts tries, the caller skips its update rather than writing unlocked.
+    """
+
+    from django.core.cache.backends.filebased import FileBasedCache
+
+    cache = _jobs_cache()
+    if isinstance(cache, FileBasedCache):
+        with _file_lock(cache._dir, key, attempts):
+            yield
+        return
+
+    lock_key = f'{key}:lock'
+    for _ in range(attempts):
+        if cache.add(lock_key, 1, timeout):
+            break
+        time.sleep(0.01)
+    else:
+        raise CacheLockTimeout(f"Could not lock {key}")
+
+    try:
+        yield
+    finally:
+        cache.delete(lock_key)
+
+
+class ActionScheduler:
+    """
+    Decides when the next close friends action of an account is due.
+    The gap after every add comes from the account's AdaptiveRateController: it starts at
+    about action_delay_max, shrinks towards action_delay_min while the account does well
+    and grows up to 20x action_delay_min after soft blocks (see max_action_gap()). A
+    batch_cooldown..2x batch_cooldown pause follows every followers_batch_size adds, and
+    a soft block parks the account until paused_until. On top
+    of that a token bucket per account (at most one action per action_delay_min) and one
+    per proxy (shared by every account using it) cap the rates. The state lives in the
+    shared jobs cache, so a worker can hand an account back to the queue between actions
+    and any worker can pick it up when wait_time() says it is due.
+    Attributes:
+        user (str): The username of the bot operator.
+        username (str): The Instagram username the actions are made from.
+        config (BotConfig): The account's bot configuration.
+        proxy (str): Key of the proxy the account goes through, if any.
+        proxy_rate (float): Actions per second allowed through one proxy.
+        clock (callable): Returns the current time in seconds.
+    """
+    def __init__(self, user, username, config, proxy=None, proxy_rate=1.0, clock=time.time):
+        self.user = user
+        self.username = username
+        self.config = config
+        self.proxy = proxy
+        self.proxy_rate = proxy_rate
+        self.clock = clock
+
+        self.account_key = f'scheduler:account:{user}:{username}'
+        self.proxy_key = f'scheduler:proxy:{proxy}' if proxy else None
+
+        state = _jobs_cache().get(self.account_key) or {}
+        self.not_before = state.get('not_before', 0)
+        self.cooldown_until = state.get('cooldown_until', 0)
+        self.batch_count = state.get('batch_count', 0)
+        self.paused_until = state.get('paused_until', 0)
+        self.throttle = AdaptiveRateController.for_config(config, state.get('throttle'))
+        self.account_bucket = TokenBucket(
+            1 / max(config.action_delay_min, 0.001), 1,
+            tokens=state.get('tokens'), updated_at=state.get('updated_at'),
+        )
+
+    def set_proxy(self, proxy):
+        """Pace the account on another proxy's bucket (after a failover)."""
+
+        self.proxy = proxy
+        self.proxy_key = f'scheduler:proxy:{proxy}' if proxy else None
+
+    def _proxy_bucket(self):
+        state = _jobs_cache().get(self.proxy_key) or {}
+        return TokenBucket(self.proxy_rate, max(self.proxy_rate, 1), tokens=state.get('tokens'), updated_at=state.get('updated_at'))
+
+    def _save_proxy_bucket(self, bucket):
+        _jobs_cache().set(self.proxy_key, {'tokens': bucket.tokens, 'updated_at': bucket.updated_at}, SCHEDULER_STATE_TIMEOUT)
+
+    def save(self):
+        _jobs_cache().set(self.account_key, {
+            'not_before': self.not_before,
+            'cooldown_until': self.cooldown_until,
+            'batch_count': self.batch_count,
+            'paused_until': self.paused_until,
+            'throttle': self.throttle.state(),
+            'tokens': self.account_bucket.tokens,
+            'updated_at': self.account_bucket.updated_at,
+        }, SCHEDULER_STATE_TIMEOUT)
+
+    def max_action_gap(self):
+        """The longest gap the scheduler leaves between two actions, outside of cooldowns and pauses."""
+
+        return max(self.throttle.max_gap(), self.config.action_delay_max)
+
+    def wait_time(self):
+        """Seconds until the next action is due, without reserving it."""
+
+        now = self.clock()
+        waits = [self.not_before - now, self.cooldown_until - now, self.paused_until - now, self.account_bucket.delay(now)]
+        if self.proxy_key:
+            waits.append(self._proxy_bucket().delay(now))
+        return max(max(waits), 0)
+
+    def reserve(self):
+        """Take the tokens for one action. Returns the seconds to wait before making it."""
+
+        now = self.clock()
+        wait = max(self.not_before - now, self.cooldown_until - now, self.paused_until - now, self.account_bucket.reserve(now), 0)
+
+        if self.proxy_key:
+            try:
+                with _cache_lock(self.proxy_key):
+                    bucket = self._proxy_bucket()
+                    wait = max(wait, bucket.reserve(now))
+                    self._save_proxy_bucket(bucket)
+            except CacheLockTimeout as e:
+                # Leave the shared bucket alone and keep to the proxy's rate on our own
+                logging.warning(f"{e}, waiting a full proxy gap")
+                wait = max(wait, 1 / max(self.proxy_rate, 0.001))
+
+        self.save()
+        return wait
+
+    def action_done(self, count=1):
+        """
+        Schedule the gap after an action that added count followers. Returns True when it
+        completed a batch (a cooldown starts).
+        """
+
+        now = self.clock()
+        self.throttle.success()
+        self.not_before = now + self.throttle.gap()
+        self.batch_count += count
+
+        batch_done = self.batch_count >= self.config.followers_batch_size
+        if batch_done:
+            cooldown = random.uniform(self.config.batch_cooldown, self.config.batch_cooldown * 2)
+            logging.info(f"Cooling down for {cooldown:.2f} seconds...")
+            self.cooldown_until = now + cooldown
+            self.batch_count = 0
+
+        self.save()
+        return batch_done
+
+    def throttled(self, pause):
+        """
+        Cut the action rate after a soft block and park the account for pause seconds.
+        Returns the number of soft blocks in a row, so the caller can give up on an
+        account that keeps getting blocked.
+        """
+
+        self.throttle.throttled()
+        logging.warning(f"Throttled, slowing down to {self.throttle.rate:.2f} actions/min and pausing for {pause:.0f} seconds...")
+        self.paused_until = self.clock() + pause
+        self.save()
+        return self.throttle.strikes
@@ -0,0 +1,268 @@
+"""
+Close friends runs on a virtual clock.
+
+A simulated account goes through the real CloseFriendsRun (scheduler, adaptive rate,
+batch cooldowns, soft block back off and checkpoints), with a fake Instagram client and
+a VirtualClock, so hours of adds take seconds. The fake client spends a random request
+latency of simulated time per add, answers some adds with a 429 and starts soft blocks,
+during which every add gets FeedbackRequired for block_duration seconds. The report
+gives the simulated wall time and the adds per hour, to compare BotConfig values and
+scheduler changes before rolling them out:
+
+    python -m bot.simulation --followers 50000 --feedback-rate 0.0005 --throttle-rate 0.001
+
+Proxies are not simulated, the proxy pool runs on the wall clock (its state is shared
+between processes), so leave PROXY_POOL unset when simulating.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+from array import array
+from dataclasses import dataclass, asdict
+
+from instagrapi.exceptions import FeedbackRequired, ClientThrottledError
+
+from .clock import VirtualClock
+from .followers import write_follower_list, FollowerList, SOURCE_HIKER
+from .besties import SET_BESTIES_ENDPOINT, BESTIES_ENDPOINT
+
+# Ids of the simulated followers
+FIRST_FOLLOWER_ID = 10 ** 12
+
+
+@dataclass
+class SimulatedInstagram:
+    """
+    Behaviour of the fake Instagram.
+    Attributes:
+        latency (float): Mean simulated seconds of a request.
+        jitter (float): Standard deviation of the request latency.
+        throttle_rate (float): Share of adds answered with a 429.
+        feedback_rate (float): Share of adds that start a soft block.
+        block_duration (float): Simulated seconds a soft block lasts.
+    """
+    latency: float = 0.5
+    jitter: float = 0.2
+    throttle_rate: float = 0.0
+    feedback_rate: float = 0.0
+    block_duration: float = 3600
+
+
+class SimulatedClient:
+    """Fake instagrapi Client for the calls a close friends run makes, answering on the virtual clock."""
+
+    def __init__(self, clock, instagram, rng):
+        self.clock = clock
+        self.instagram = instagram
+        self.rng = rng
+
+        self.user_id = '1'
+        self.uuid = str(uuid.uuid4())
+        self.besties = set()
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.feedback_required = 0
+        self.throttled = 0
+
+    def set_proxy(self, url):
+        pass
+
+    def _request(self):
+        self.requests += 1
+        self.clock.advance(max(self.rng.gauss(self.instagram.latency, self.instagram.jitter), 0.0))
+
+        now = self.clock.monotonic()
+        if now < self.blocked_until:
+            self.feedback_required += 1
+            raise FeedbackRequired("feedback_required: We limit how often you can do certain things on Instagram")
+        if self.rng.random() < self.instagram.feedback_rate:
+            self.blocked_until = now + self.instagram.block_duration
+            self.feedback_required += 1
+            raise FeedbackRequired("feedback_required: We limit how often you can do certain things on Instagram")
+        if self.rng.random() < self.instagram.throttle_rate:
+            self.throttled += 1
+            raise ClientThrottledError("Please wait a few minutes before you try again.")
+
+    def close_friend_add(self, user_id):
+        self._request()
+        self.besties.add(int(user_id))
+        return True
+
+    def private_request(self, endpoint, data=None, params=None):
+        if endpoint == BESTIES_ENDPOINT:
+            self.requests += 1
+            self.clock.advance(self.instagram.latency)
+            return {'users': [{'pk': str(user_id)} for user_id in sorted(self.besties)], 'next_max_id': None}
+        if endpoint != SET_BESTIES_ENDPOINT:
+            raise ValueError(f"The simulation does not support {endpoint}")
+
+        self._request()
+        self.besties.update(int(user_id) for user_id in data['add'])
+        self.besties.difference_update(int(user_id) for user_id in data['remove'])
+        statuses = {user_id: {'is_bestie': True} for user_id in data['add']}
+        statuses.update({user_id: {'is_bestie': False} for user_id in data['remove']})
+        return {'friendship_statuses': statuses, 'status': 'ok'}
+
+
+class SimulatedBot:
+    """
+    Stand-in for InstagramBot with what CloseFriendsRun uses of it, on a virtual clock
+    and a temporary directory, without the account store or the job history.
+    Attributes:
+        config (BotConfig): The BotConfig of the simulated account.
+        client (SimulatedClient): The fake Instagram client.
+        clock (VirtualClock): The simulated clock.
+        directory (str): Directory holding the follower list and checkpoint.
+    """
+    record_history = False
+    feedback_error_sleep_time = 1800
+
+    def __init__(self, config, client, clock, directory):
+        self.user = f'simulation-{uuid.uuid4().hex[:8]}'
+        self.config = config
+        self.client = client
+        self.clock = clock
+        self.last_added_path = directory
+        self.followers_path = directory
+
+    def _get_account(self, username):
+        return username, '', self.config
+
+    def _initialize_client(self, username, add_to_close_friends_mode=False, proxy=None):
+        return self.client
+
+    def _read_followers(self, username):
+        return FollowerList(os.path.join(self.followers_path, f'{username}.bin'))
+
+    def _sync_followers_file(self, username):
+        return os.path.join(self.followers_path, f'{username}.sync.bin')
+
+    def _stale_followers_file(self, username):
+        return os.path.join(self.followers_path, f'{username}.stale.bin')
+
+
+def simulate(followers=50000, config=None, instagram=None, seed=0, max_seconds=60 * 60 * 24 * 30):
+    """
+    Run the close friends adds of a simulated account with followers followers until the
+    run ends (done or given up after too many soft blocks) or max_seconds of simulated
+    time passed, and return the report.
+    """
+
+    from .bot import BotConfig
+    from .close_friends import CloseFriendsRun, STOP_DONE
+
+    config = config or BotConfig()
+    instagram = instagram or SimulatedInstagram()
+    # The scheduler and rate controller draw their gaps from the random module
+    random.seed(seed)
+
+    clock = VirtualClock()
+    client = SimulatedClient(clock, instagram, random.Random(seed))
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as directory:
+        username = 'simulated'
+        write_follower_list(
+            os.path.join(directory, f'{username}.bin'),
+            array('q', range(FIRST_FOLLOWER_ID, FIRST_FOLLOWER_ID + followers)), SOURCE_HIKER,
+        )
+
+        bot = SimulatedBot(config, client, clock, directory)
+        run = CloseFriendsRun(bot, username)
+        try:
+            run.run(max_duration=max_seconds)
+        finally:
+            run.close()
+
+    hours = clock.elapsed / 3600
+    return {
+        'followers': followers,
+        'config': asdict(config),
+        'instagram': asdict(instagram),
+        'seed': seed,
+        'stop_reason': run.stop_reason or 'time_limit',
+        'done': run.stop_reason == STOP_DONE,
+        'position': run.position,
+        'added': run.added,
+        'simulated_seconds': clock.elapsed,
+        'simulated_hours': hours,
+        'adds_per_hour': run.added / hours if hours else 0.0,
+        'sleep_share': clock.slept / clock.elapsed if clock.elapsed else 0.0,
+        'requests': client.requests,
+        'feedback_required': client.feedback_required,
+        'throttled': client.throttled,
+        'final_rate': run.scheduler.throttle.rate,
+        'real_seconds': time.perf_counter() - started,
+    }
+
+
+def _configure_django():
+    """
+    Minimal Django setup without a database: the bot's modules need the Core app loaded,
+    and the scheduler and progress state go to a private in-memory jobs cache, never to
+    the deployment's.
+    """
+
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        memory = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        settings.configure(
+            INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'Core'],
+            AUTH_USER_MODEL='Core.User',
+            CACHES={'default': memory, 'jobs': {**memory, 'LOCATION': 'simulation'}},
+        )
+    django.setup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a close friends run on a virtual clock")
+    parser.add_argument('--followers', type=int, default=50000)
+    parser.add_argument('--latency', type=float, default=0.5, help="Mean seconds of a request")
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of adds answered with a 429")
+    parser.add_argument('--feedback-rate', type=float, default=0.0, help="Share of adds starting a soft block")
+    parser.add_argument('--block-duration', type=float, default=3600, help="Seconds a soft block lasts")
+    parser.add_argument('--batch-size', type=int, default=200, help="BotConfig.followers_batch_size")
+    parser.add_argument('--batch-cooldown', type=float, default=60, help="BotConfig.batch_cooldown")
+    parser.add_argument('--action-delay-min', type=float, default=2, help="BotConfig.action_delay_min")
+    parser.add_argument('--action-delay-max', type=float, default=5, help="BotConfig.action_delay_max")
+    parser.add_argument('--group-size', type=int, default=1, help="BotConfig.close_friends_group_size")
+    parser.add_argument('--max-days', type=float, default=30, help="Stop after this many simulated days")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    _configure_django()
+
+    from .bot import BotConfig
+
+    report = simulate(
+        followers=args.followers,
+        config=BotConfig(
+            followers_batch_size=args.batch_size,
+            batch_cooldown=args.batch_cooldown,
+            max_followers=args.followers,
+            action_delay_min=args.action_delay_min,
+            action_delay_max=args.action_delay_max,
+            close_friends_group_size=args.group_size,
+            close_friends_sync=False,
+        ),
+        instagram=SimulatedInstagram(
+            latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+            feedback_rate=args.feedback_rate, block_duration=args.block_duration,
+        ),
+        seed=args.seed,
+        max_seconds=args.max_days * 24 * 60 * 60,
+    )
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import random
+
+
+class AdaptiveRateController:
+    """
+    Additive-increase / multiplicative-decrease control of an account's action rate.
+    Every successful action raises the rate a little, every soft block (FeedbackRequired,
+    429 style throttling) cuts it sharply, so an account converges on the fastest rate
+    Instagram tolerates instead of running at a fixed guess.
+    Attributes:
+        min_rate (float): Lowest rate in actions per minute.
+        max_rate (float): Highest rate in actions per minute.
+        rate (float): Current rate in actions per minute.
+        increase (float): Actions per minute added after each success.
+        decrease (float): Factor the rate is multiplied by on a soft block.
+        strikes (int): Soft blocks in a row without a success in between.
+    """
+    def __init__(self, min_rate, max_rate, rate=None, increase=0.1, decrease=0.5, strikes=0):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate if rate is not None else min_rate, min_rate), max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.strikes = strikes
+
+    @classmethod
+    def for_config(cls, config, state=None):
+        """
+        Controller for a BotConfig: the rate starts at one action per action_delay_max, may
+        grow up to one per action_delay_min and drops to a twentieth of that after soft blocks.
+        """
+
+        state = state or {}
+        max_rate = 60 / max(config.action_delay_min, 0.001)
+        start_rate = 60 / max(config.action_delay_max, 0.001)
+        return cls(
+            min_rate=max_rate / 20,
+            max_rate=max_rate,
+            rate=state.get('rate', start_rate),
+            strikes=state.get('strikes', 0),
+        )
+
+    def state(self):
+        return {'rate': self.rate, 'strikes': self.strikes}
+
+    def gap(self):
+        """Seconds to wait after an action at the current rate, with some jitter."""
+
+        return 60 / self.rate * random.uniform(0.8, 1.2)
+
+    def max_gap(self):
+        """The longest gap() at the lowest rate."""
+
+        return 60 / self.min_rate * 1.2
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+        self.strikes = 0
+
+    def throttled(self):
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.strikes += 1